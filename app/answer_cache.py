@@ -0,0 +1,198 @@
+# app/answer_cache.py
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+from app.catalog import question_intent
+from app.context_packing import TOPIC_PATTERNS
+from app.hybrid import tokenize
+from app.query_planner import plan_query
+
+# "sin nfc", "que no sea samsung": lo negado (una o dos palabras) distingue preguntas casi iguales
+NEGATED = re.compile(r"\b(?:sin|no|ni|without)\s+(\w+(?:\s+\w+)?)")
+
+
+def normalize_question(text: str) -> str:
+    """
+    Minúsculas, sin tildes ni signos de puntuación y con espacios colapsados.
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w€$%.,]+", " ", text)
+    return re.sub(r"\s+", " ", text).strip(" .,")
+
+
+def _numbers(text: str) -> tuple:
+    return tuple(re.findall(r"\d+(?:[.,]\d+)?", text))
+
+
+def question_signature(question: str, matcher) -> tuple:
+    """
+    Lo que tiene que coincidir para reutilizar una respuesta parecida: restricciones del
+    planificador (con las negadas), lo negado, el ranking o agregado que pide con su
+    dirección ("más barato" / "más caro"), los temas con la palabra que los nombra ("para
+    jugar" / "para fotos", "pantalla grande" / "pequeña") y los modelos y marcas que nombra,
+    según el ModelMatcher del catálogo (app/hybrid.py).
+    """
+    plan = plan_query(question, matcher)
+    tokens = tokenize(question)
+    words = set(tokens)
+    text = " ".join(tokens)
+    topics = {(tuple(keys), m.group(0)) for pattern, keys in TOPIC_PATTERNS for m in pattern.finditer(text)}
+    return (
+        tuple(sorted(plan.numeric)),
+        tuple(sorted(plan.booleans.items())),
+        plan.network_type,
+        plan.excluded_network,
+        tuple(sorted(NEGATED.findall(normalize_question(question)))),
+        question_intent(question, matcher),
+        tuple(sorted(topics)),
+        tuple(sorted(matcher.match(question))),
+        tuple(sorted(words & matcher.brands)),
+    )
+
+
+class AnswerCache:
+    """
+    Caché de respuestas delante del motor de consulta:
+    - búsqueda exacta por pregunta normalizada;
+    - búsqueda semántica por similitud coseno del embedding de la pregunta (>= threshold),
+      solo entre preguntas con las mismas cifras ("bajo 300 €" nunca reutiliza "bajo 500 €")
+      y la misma question_signature() ("sin nfc" nunca reutiliza "con nfc", ni "el más
+      caro" a "el más barato", ni "samsung" a "xiaomi"). Sin matcher_fn, o si devuelve
+      None, solo hay búsqueda exacta.
+    Expulsión por TTL y LRU; se vacía sola cuando cambia la versión del índice.
+    """
+
+    def __init__(self, embed_fn, version_fn, threshold: float, ttl: float, max_entries: int, matcher_fn=None):
+        self._embed_fn = embed_fn
+        self._version_fn = version_fn
+        # matcher_fn() -> ModelMatcher del catálogo en servicio (o None)
+        self._matcher_fn = matcher_fn or (lambda: None)
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # clave normalizada -> (respuesta, embedding, creado, firma)
+        self._matrix = None
+        self._matrix_keys = []
+        self._version = version_fn()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _check_version(self) -> None:
+        version = self._version_fn()
+        if version != self._version:
+            self._entries.clear()
+            self._matrix = None
+            self._version = version
+            self.invalidations += 1
+
+    def _expire(self) -> None:
+        limit = time.time() - self.ttl
+        expired = [k for k, (_, _, created, _) in self._entries.items() if created < limit]
+        for k in expired:
+            del self._entries[k]
+        if expired:
+            self._matrix = None
+
+    def _embed(self, key: str):
+        return self._unit(self._embed_fn(key))
+
+    def _signature(self, question: str):
+        matcher = self._matcher_fn()
+        return question_signature(question, matcher) if matcher is not None else None
+
+    @staticmethod
+    def _unit(vec):
+        vec = np.asarray(vec, dtype=np.float32)
+        return vec / (np.linalg.norm(vec) or 1.0)
+
+    def lookup(self, question: str, embedding=None):
+        """
+        Devuelve (respuesta, "exact" | "semantic") o None. `embedding` es el de la
+        pregunta normalizada si ya se tiene (modo por lotes): así no se vuelve a calcular.
+        """
+        key = normalize_question(question)
+        with self._lock:
+            self._check_version()
+            self._expire()
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return self._entries[key][0], "exact"
+            if self._matrix is None and self._entries:
+                self._matrix_keys = list(self._entries)
+                self._matrix = np.stack([self._entries[k][1] for k in self._matrix_keys])
+
+        signature = self._signature(question)
+        try:
+            # Sin firma no se sabe si dos preguntas parecidas piden lo mismo: solo exacta
+            if signature is not None:
+                embedding = self._embed(key) if embedding is None else self._unit(embedding)
+        except Exception:
+            # Sin embeddings (Ollama caído...) solo queda la búsqueda exacta
+            embedding = None
+        with self._lock:
+            if signature is not None and embedding is not None and self._matrix is not None and len(self._matrix_keys):
+                scores = self._matrix @ embedding
+                numbers = _numbers(key)
+                for i in np.argsort(-scores)[:5]:
+                    if scores[i] < self.threshold:
+                        break
+                    match = self._matrix_keys[i]
+                    if (match in self._entries and _numbers(match) == numbers
+                            and self._entries[match][3] == signature):
+                        self._entries.move_to_end(match)
+                        self.semantic_hits += 1
+                        return self._entries[match][0], "semantic"
+            self.misses += 1
+        return None
+
+    def store(self, question: str, answer: str, embedding=None, version=None) -> None:
+        """
+        Guarda la respuesta. `version`: la del índice con el que se generó (la de la
+        instantánea de la petición); si entretanto ha cambiado, no se guarda, para que una
+        respuesta del índice anterior no sobreviva al cambio hasta que caduque.
+        """
+        if not answer.strip():
+            return
+        key = normalize_question(question)
+        try:
+            embedding = self._embed(key) if embedding is None else self._unit(embedding)
+        except Exception:
+            return
+        signature = self._signature(question)
+        with self._lock:
+            self._check_version()
+            if version is not None and version != self._version:
+                return
+            self._entries[key] = (answer, embedding, time.time(), signature)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            lookups = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,234 @@
+# app/batch.py
+import json
+import queue
+import threading
+import time
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+
+from llama_index.core.schema import QueryBundle
+
+from app.answer_cache import normalize_question
+from app.metrics import BATCH_QUESTIONS, track_request
+
+# Preguntas que comparten una multiplicación de matrices al recuperar (acota la memoria
+# temporal: filas del índice × RETRIEVE_CHUNK × 4 bytes)
+RETRIEVE_CHUNK = 64
+
+
+def parse_questions(lines) -> list:
+    """
+    Preguntas de un JSONL: {"question": "...", "id": ...} (o "message"), una cadena JSON
+    o texto plano. Las líneas vacías se ignoran. Devuelve [{"id", "question"}].
+    """
+    items = []
+    for n, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError:
+            data = line
+        if isinstance(data, dict):
+            question = data.get("question") or data.get("message") or ""
+            items.append({"id": data.get("id", n), "question": str(question).strip()})
+        else:
+            items.append({"id": n, "question": str(data).strip()})
+    return items
+
+
+def find_vector_store(retriever):
+    """
+    Vector store debajo de la cadena de recuperadores (CatalogRetriever -> SimilarRetriever
+    -> PlannedRetriever -> índice). None si no se encuentra.
+    """
+    while retriever is not None:
+        index = getattr(retriever, "_index", None)
+        if index is not None:
+            return index.vector_store
+        retriever = getattr(retriever, "_base", None)
+    return None
+
+
+class BatchRunner:
+    """
+    Responde un lote de preguntas con el mismo motor que /api/chat, pero:
+    1. deduplica por pregunta normalizada (cada pregunta distinta se responde una vez);
+    2. resuelve antes las respuestas directas y las de la caché;
+    3. calcula los embeddings de todas las pendientes en una sola llamada;
+    4. recupera por tramos de RETRIEVE_CHUNK con una multiplicación de matrices por tramo;
+    5. genera en un pool de `concurrency` hilos según se van recuperando.
+    run() devuelve un resultado por pregunta según terminan y, al final, un resumen.
+    """
+
+    def __init__(self, engine, build_prompt, embed_fn=None, direct_fn=None, answer_cache=None,
+                 concurrency: int = 4, generate_fn=None, cache_version=None):
+        self.engine = engine
+        self.build_prompt = build_prompt
+        self.embed_fn = embed_fn
+        self.direct_fn = direct_fn
+        self.answer_cache = answer_cache
+        # Versión del índice de `engine`: las respuestas no se guardan si la caché ya va por otra
+        self.cache_version = cache_version
+        self.concurrency = max(1, concurrency)
+        # generate_fn(fn, cancelled) ejecuta la generación (en el servidor, a través del
+        # GenerationPool con prioridad baja); None si se cancela antes de empezar
+        self.generate_fn = generate_fn or (lambda fn, cancelled: fn())
+
+    def _embed(self, texts: list):
+        if self.embed_fn is None or not texts:
+            return None
+        try:
+            return self.embed_fn(texts)
+        except Exception as e:
+            # Cada pregunta calculará su embedding al recuperar
+            print(f"Aviso: no se pudieron calcular los embeddings del lote ({e})")
+            return None
+
+    def _generate(self, question: str, bundle: QueryBundle, nodes, key_embedding, submitted: float,
+                  cancelled: threading.Event) -> dict:
+        if cancelled.is_set():
+            # El cliente se ha ido mientras esperaba turno: no se genera
+            return {"reply": "", "source": "cancelled"}
+        started = time.perf_counter()
+        with track_request() as timings:
+            reply = self.generate_fn(lambda: str(self.engine.synthesize(bundle, nodes)), cancelled)
+        if reply is None:
+            return {"reply": "", "source": "cancelled"}
+        if self.answer_cache:
+            self.answer_cache.store(question, reply, embedding=key_embedding, version=self.cache_version)
+        return {
+            "reply": reply,
+            "source": "rag",
+            "queue_ms": round((started - submitted) * 1000, 1),
+            "generate_ms": round((time.perf_counter() - started) * 1000, 1),
+            "stages_ms": timings.as_dict()["stages_ms"],
+        }
+
+    def run(self, items: list):
+        started = time.perf_counter()
+        groups = {}  # pregunta normalizada -> posiciones en items
+        for i, item in enumerate(items):
+            groups.setdefault(normalize_question(item["question"]), []).append(i)
+        results = queue.Queue()
+        cancelled = threading.Event()
+        # Como mucho `concurrency` preguntas recuperadas esperando o generando: el resto no se
+        # recupera hasta que haya hueco, así que al cancelar no queda trabajo encolado
+        slots = threading.Semaphore(self.concurrency)
+        futures = []
+        summary = {"questions": len(items), "unique": len(groups), "sources": {}}
+
+        def plan():
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch") as pool:
+                pending = []
+                for key, positions in groups.items():
+                    question = items[positions[0]]["question"]
+                    if not key:
+                        results.put((positions, {"reply": "", "source": "empty"}))
+                        continue
+                    t0 = time.perf_counter()
+                    direct = self.direct_fn(question) if self.direct_fn else None
+                    if direct:
+                        results.put((positions, {
+                            "reply": direct["reply"], "source": "direct", "direct": direct["intent"],
+                            "lookup_ms": round((time.perf_counter() - t0) * 1000, 1),
+                        }))
+                    else:
+                        pending.append((key, positions, question, self.build_prompt(question)))
+
+                # Una sola llamada: preguntas normalizadas (caché) + prompts (recuperación)
+                t0 = time.perf_counter()
+                keys = [p[0] for p in pending] if self.answer_cache else []
+                vectors = self._embed(keys + [p[3] for p in pending])
+                summary["embedding_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+                key_vectors = vectors[:len(keys)] if vectors is not None and keys else [None] * len(pending)
+                prompt_vectors = vectors[len(keys):] if vectors is not None else [None] * len(pending)
+
+                todo = []
+                for (key, positions, question, prompt), kv, pv in zip(pending, key_vectors, prompt_vectors):
+                    cached = self.answer_cache.lookup(question, embedding=kv) if self.answer_cache else None
+                    if cached:
+                        results.put((positions, {"reply": cached[0], "source": "cache", "cached": cached[1]}))
+                    else:
+                        todo.append((positions, question, prompt, kv, pv))
+
+                store = find_vector_store(self.engine.retriever) if todo else None
+                for c in range(0, len(todo), RETRIEVE_CHUNK):
+                    chunk = todo[c:c + RETRIEVE_CHUNK]
+                    embeddings = [t[4] for t in chunk if t[4] is not None]
+                    batch = getattr(store, "batch", None)
+                    with batch(embeddings) if batch and embeddings else nullcontext():
+                        for positions, question, prompt, kv, pv in chunk:
+                            while not slots.acquire(timeout=0.2):
+                                if cancelled.is_set():
+                                    break
+                            if cancelled.is_set():
+                                # El cliente se ha ido: no se recupera ni se genera nada más
+                                pool.shutdown(wait=False, cancel_futures=True)
+                                return
+                            bundle = QueryBundle(query_str=prompt, embedding=pv)
+                            t0 = time.perf_counter()
+                            try:
+                                with track_request() as timings:
+                                    nodes = self.engine.retrieve(bundle)
+                            except Exception as e:
+                                slots.release()
+                                results.put((positions, {"reply": "", "source": "error", "error": str(e)}))
+                                continue
+                            retrieve = {
+                                "retrieve_ms": round((time.perf_counter() - t0) * 1000, 1),
+                                "retrieve_stages_ms": timings.as_dict()["stages_ms"],
+                            }
+                            future = pool.submit(
+                                self._generate, question, bundle, nodes, kv, time.perf_counter(), cancelled
+                            )
+                            futures.append(future)
+                            future.add_done_callback(
+                                lambda f, positions=positions, retrieve=retrieve: (
+                                    slots.release(), results.put((positions, _outcome(f, retrieve)))
+                                )
+                            )
+
+        def planner():
+            try:
+                plan()
+            except Exception as e:
+                print(f"[batch] error: {e}")
+                summary["error"] = str(e)
+            finally:
+                # Al salir del pool ya se han encolado todos los resultados: None es siempre el último
+                results.put(None)
+
+        thread = threading.Thread(target=planner, name="batch-plan", daemon=True)
+        thread.start()
+        done = 0
+        try:
+            while done < len(groups):
+                entry = results.get()
+                if entry is None:
+                    break
+                positions, outcome = entry
+                done += 1
+                summary["sources"][outcome["source"]] = summary["sources"].get(outcome["source"], 0) + len(positions)
+                BATCH_QUESTIONS.inc(len(positions), source=outcome["source"])
+                for n, i in enumerate(positions):
+                    result = {"index": i, "id": items[i].get("id"), "question": items[i]["question"], **outcome}
+                    if n:
+                        result["duplicate_of"] = positions[0]
+                    result["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                    yield result
+        finally:
+            cancelled.set()
+            # Al cerrarse el stream: las que aún no han empezado no llegan a ejecutarse
+            for future in futures:
+                future.cancel()
+        summary["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        yield {"done": True, **summary}
+
+
+def _outcome(future, retrieve: dict) -> dict:
+    try:
+        return {**retrieve, **future.result()}
+    except Exception as e:
+        return {**retrieve, "reply": "", "source": "error", "error": str(e) or type(e).__name__}
@@ -0,0 +1,510 @@
+# app/catalog.py
+import json
+import re
+import shutil
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+import numpy as np
+from llama_index.core import Settings
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+
+from app.direct_answer import RELATIVE
+from app.hybrid import STOPWORDS, ModelMatcher, tokenize
+from app.ingest_utils import TEXT_FIELDS
+from app.metrics import timed
+from app.query_planner import FIELD_LABELS, extract_question, plan_query
+
+# Instantánea columnar del catálogo, dentro del directorio del índice
+CATALOG_DIRNAME = "catalog"
+META_FNAME = "catalog.json"
+
+# Columnas numéricas (float32, NaN = sin dato), booleanas y categóricas (códigos int32 +
+# diccionario de valores; -1 = vacío). "brand" sale de la primera palabra del modelo
+NUMERIC = [
+    "price", "rating", "ram_gb", "storage_gb", "battery_mah", "screen_size_in", "refresh_rate_hz",
+    "rear_camera_count", "front_camera_mp",
+]
+BOOLEAN = ["nfc", "volte", "ir_blaster", "memory_card_supported"]
+CATEGORICAL = ["brand", "os", "network_type", "chipset", "display_type", "memory_card_type", "rear_camera_mp_list"]
+LABELS = {key: label for label, key, _ in TEXT_FIELDS}
+LABELS["brand"] = "Brand"
+# Nombres en las frases del resultado (las cabeceras de las tablas usan LABELS, como ContextPacker)
+NAMES = {
+    **FIELD_LABELS, "rating": "valoración", "rear_camera_count": "cámaras traseras",
+    "front_camera_mp": "cámara frontal (MP)", "brand": "marca", "os": "sistema", "chipset": "chipset",
+    "network_type": "red", "display_type": "tipo de pantalla",
+}
+
+OPS = {
+    "<=": np.less_equal, ">=": np.greater_equal, "<": np.less, ">": np.greater,
+    "==": np.equal, "!=": np.not_equal,
+}
+
+# --- preguntas de ranking / agregados ---
+
+# Campos ordenables y cómo se nombran en la pregunta (sobre tokenize())
+SORT_FIELDS = {
+    "price": r"precio|cuesta|cuestan|euros?",
+    "rating": r"valoracion|valorados?|puntuacion|nota|rating",
+    "ram_gb": r"ram",
+    "storage_gb": r"almacenamiento|memoria interna|capacidad",
+    "battery_mah": r"bateria|mah|autonomia",
+    "screen_size_in": r"pantalla|pulgadas",
+    "refresh_rate_hz": r"refresco|hz|hercios",
+    "front_camera_mp": r"camara frontal|frontal|selfies?",
+    "rear_camera_count": r"camaras traseras|numero de camaras",
+}
+SORT_PATTERNS = {f: re.compile(rf"\b(?:{p})\b") for f, p in SORT_FIELDS.items()}
+# Orden implícito: "los más baratos", "el mejor valorado"
+IMPLIED_SORT = [
+    (re.compile(r"\bbarat[oa]s?\b"), "price", False),
+    (re.compile(r"\bcar[oa]s?\b"), "price", True),
+    (re.compile(r"\bmejor valorad[oa]s?\b|\bmas valorad[oa]s?\b"), "rating", True),
+    (re.compile(r"\bpeor valorad[oa]s?\b|\bmenos valorad[oa]s?\b"), "rating", False),
+]
+NUMBER_WORDS = {"dos": 2, "tres": 3, "cuatro": 4, "cinco": 5, "seis": 6, "siete": 7, "ocho": 8, "nueve": 9, "diez": 10}
+TOP_N = re.compile(r"\btop (\d+|\w+)\b|\blos (\d+|" + "|".join(NUMBER_WORDS) + r")\b")
+SUPERLATIVE = re.compile(
+    r"\b(?:el|la|los|las)(?: \w+)? (?:mas|menos|mejor|peor|mayor|menor)\b|\bcon (?:mas|menos|mayor|menor)\b|\btop\b|\branking\b"
+)
+DESCENDING = re.compile(r"\b(?:mas|mayor|mejor)\b")
+MEAN = re.compile(r"\b(?:medio|media|promedio)\b")
+NOT_MEAN = re.compile(r"\b(?:gama|de precio) medi[oa]\b")
+COUNT = re.compile(r"\bcuant[oa]s\b|\bnumero de (?:moviles|telefonos|modelos)\b")
+GROUP_BY = {
+    "brand": r"marcas?|fabricantes?",
+    "os": r"sistemas?(?: operativos?)?|so",
+    "chipset": r"chipsets?|procesador(?:es)?",
+    "network_type": r"redes?",
+    "display_type": r"tipos? de pantalla",
+}
+GROUP_PATTERN = re.compile(r"\bpor (" + "|".join(f"(?P<{k}>{p})" for k, p in GROUP_BY.items()) + r")\b")
+# El CSV no trae el tipo de panel: se dice en el contexto en vez de ignorarlo en silencio
+PANEL_TYPES = re.compile(r"\b(?:amoled|oled|lcd|ips|super amoled)\b")
+DEFAULT_TOP_N = 5
+MAX_TOP_N = 20
+MAX_GROUPS = 15
+
+
+def _code_dtype(n: int):
+    return np.int16 if n < 2**15 else np.int32
+
+
+class Catalog:
+    """
+    El catálogo normalizado en columnas NumPy (una por campo, memory-mapped al cargar)
+    para filtrar, ordenar, sacar el top-N o agrupar sobre todos los teléfonos a la vez.
+    Las columnas de texto se guardan codificadas con diccionario.
+    """
+
+    def __init__(self, columns: dict, dictionaries: dict, models: List[str]):
+        self.columns = columns
+        self.dictionaries = dictionaries
+        self.models = models
+        # Nombres de modelo de la pregunta, que no cuentan como restricciones ("oneplus 11 5g")
+        self.matcher = ModelMatcher(models)
+        # Por columna categórica: palabra -> códigos de los valores que la contienen
+        self._terms = {
+            col: self._term_index(values) for col, values in dictionaries.items() if col != "rear_camera_mp_list"
+        }
+
+    def __len__(self) -> int:
+        return len(self.models)
+
+    @staticmethod
+    def _term_index(values: List[str]) -> dict:
+        index = {}
+        for code, value in enumerate(values):
+            for term in set(tokenize(value)) - STOPWORDS:
+                index.setdefault(term, []).append(code)
+        return index
+
+    @classmethod
+    def from_rows(cls, rows: List[dict]) -> "Catalog":
+        """
+        rows: filas de normalize_frame() (o de parse_text() sobre el índice).
+        """
+        columns = {}
+        for col in NUMERIC:
+            columns[col] = np.array([np.nan if r.get(col) is None else r[col] for r in rows], dtype=np.float32)
+        for col in BOOLEAN:
+            columns[col] = np.array([bool(r.get(col)) for r in rows], dtype=bool)
+        dictionaries = {}
+        for col in CATEGORICAL:
+            if col == "brand":
+                values = [r["model"].split()[0].lower() if r["model"].split() else "" for r in rows]
+            else:
+                values = [" ".join(str(r.get(col) or "").split()) for r in rows]
+            dictionary = sorted(set(values) - {""})
+            codes = {v: i for i, v in enumerate(dictionary)}
+            columns[col] = np.array([codes.get(v, -1) for v in values], dtype=_code_dtype(len(dictionary)))
+            dictionaries[col] = dictionary
+        return cls(columns, dictionaries, [r["model"] for r in rows])
+
+    @classmethod
+    def exists(cls, catalog_dir) -> bool:
+        return (Path(catalog_dir) / META_FNAME).exists()
+
+    @classmethod
+    def load(cls, catalog_dir, mmap: bool = True) -> "Catalog":
+        catalog_dir = Path(catalog_dir)
+        meta = json.loads((catalog_dir / META_FNAME).read_text(encoding="utf-8"))
+        # asarray: ndarray normal sobre el mmap (np.memmap hace cada operación bastante más lenta)
+        columns = {
+            col: np.asarray(np.load(catalog_dir / f"{col}.npy", mmap_mode="r" if mmap else None))
+            for col in meta["columns"]
+        }
+        return cls(columns, meta["dictionaries"], meta["models"])
+
+    def persist(self, catalog_dir) -> None:
+        """
+        Escribe en un directorio nuevo y lo cambia por el anterior al final: un servidor
+        que carga a la vez ve la instantánea vieja o la nueva, nunca una mezcla.
+        """
+        catalog_dir = Path(catalog_dir)
+        tmp = catalog_dir.with_name(catalog_dir.name + ".tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        for col, array in self.columns.items():
+            np.save(tmp / f"{col}.npy", np.ascontiguousarray(array))
+        meta = {"rows": len(self), "columns": list(self.columns), "dictionaries": self.dictionaries, "models": self.models}
+        (tmp / META_FNAME).write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        old = catalog_dir.with_name(catalog_dir.name + ".old")
+        shutil.rmtree(old, ignore_errors=True)
+        if catalog_dir.exists():
+            catalog_dir.replace(old)
+        tmp.replace(catalog_dir)
+        shutil.rmtree(old, ignore_errors=True)
+
+    # --- consultas ---
+
+    def terms(self, col: str, words: Iterable[str]) -> List[str]:
+        """
+        Palabras (de al menos 3 letras) que aparecen en algún valor de la columna `col`.
+        """
+        index = self._terms.get(col, {})
+        return [w for w in words if len(w) >= 3 and w.isalpha() and w in index]
+
+    def codes(self, col: str, terms: Iterable[str]) -> np.ndarray:
+        """
+        Códigos de `col` cuyos valores contienen todas las palabras de `terms`.
+        """
+        found = None
+        for term in terms:
+            hits = set(self._terms.get(col, {}).get(term, ()))
+            found = hits if found is None else found & hits
+        return np.array(sorted(found or ()), dtype=np.int32)
+
+    def mask(self, filters: Iterable[tuple] = ()) -> np.ndarray:
+        """
+        Máscara de los teléfonos que cumplen todos los filtros (campo, op, valor):
+        op en <=, >=, <, >, ==, != para números y booleanos; "in" (lista de valores),
+        "contains" y "excludes" (palabras) para las categóricas. Los valores sin dato no cumplen nada.
+        """
+        out = np.ones(len(self), dtype=bool)
+        for field, op, value in filters:
+            column = self.columns[field]
+            if field in self.dictionaries:
+                if op in ("contains", "excludes"):
+                    wanted = self.codes(field, tokenize(value) if isinstance(value, str) else value)
+                else:
+                    index = {v: i for i, v in enumerate(self.dictionaries[field])}
+                    values = [value] if isinstance(value, str) else value
+                    wanted = np.array([index[v] for v in values if v in index], dtype=np.int32)
+                if len(wanted) <= 8:
+                    # Pocos valores: comparaciones vectorizadas, más rápidas que indexar una tabla
+                    hit = np.zeros(len(self), dtype=bool)
+                    for code in wanted:
+                        hit |= column == code
+                else:
+                    # Tabla código -> cumple (la última posición es el -1 de los vacíos)
+                    lookup = np.zeros(len(self.dictionaries[field]) + 1, dtype=bool)
+                    lookup[wanted] = True
+                    hit = lookup[column]
+                if op == "excludes":
+                    hit = ~hit & (column >= 0)
+                out &= hit
+            else:
+                out &= OPS[op](column, value)
+        return out
+
+    def top(self, field: str, n: int, mask: Optional[np.ndarray] = None, descending: bool = True) -> np.ndarray:
+        """
+        Posiciones de los `n` teléfonos con más (o menos) `field` entre los de `mask`, ordenadas.
+        """
+        values = np.asarray(self.columns[field], dtype=np.float32)
+        keep = ~np.isnan(values) if mask is None else mask & ~np.isnan(values)
+        rows = np.flatnonzero(keep)
+        if not len(rows):
+            return rows
+        keys = np.take(values, rows)
+        keys = -keys if descending else keys
+        if len(rows) > n:
+            part = np.argpartition(keys, n - 1)[:n]
+            rows, keys = rows[part], keys[part]
+        # Estable: a igualdad de valor, el orden del catálogo
+        return rows[np.lexsort((rows, keys))]
+
+    def aggregate(self, field: str, mask: Optional[np.ndarray] = None) -> dict:
+        """
+        {"n", "mean", "min", "max"} de `field` sobre `mask` (solo los teléfonos con dato).
+        """
+        # np.compress en vez de values[mask]: misma selección, bastante más rápida con máscaras grandes
+        values = self.columns[field] if mask is None else np.compress(mask, self.columns[field])
+        values = np.compress(~np.isnan(values), values)
+        if not len(values):
+            return {"n": 0, "mean": None, "min": None, "max": None}
+        return {
+            "n": len(values), "mean": float(values.mean(dtype=np.float64)),
+            "min": float(values.min()), "max": float(values.max()),
+        }
+
+    def group_by(self, key: str, field: Optional[str] = None, fn: str = "count", mask: Optional[np.ndarray] = None) -> list:
+        """
+        [(grupo, valor, teléfonos)] de `key` (categórica) de mayor a menor valor: fn "count"
+        o "mean" de `field`. Con bincount sobre los códigos, sin bucles por teléfono.
+        """
+        codes = np.asarray(self.columns[key])
+        keep = codes >= 0 if mask is None else mask & (codes >= 0)
+        size = len(self.dictionaries[key])
+        if fn == "count":
+            counts = np.bincount(np.compress(keep, codes), minlength=size)
+            values = counts.astype(np.float64)
+        else:
+            data = self.columns[field]
+            keep &= ~np.isnan(data)
+            kept = np.compress(keep, codes)
+            counts = np.bincount(kept, minlength=size)
+            sums = np.bincount(kept, weights=np.compress(keep, data), minlength=size)
+            values = np.divide(sums, counts, out=np.zeros(size), where=counts > 0)
+        order = np.lexsort((np.arange(size), -values))
+        return [(self.dictionaries[key][i], float(values[i]), int(counts[i])) for i in order if counts[i]]
+
+    def value(self, col: str, row: int):
+        v = self.columns[col][row]
+        if col in self.dictionaries:
+            return self.dictionaries[col][v] if v >= 0 else ""
+        if col in BOOLEAN:
+            return bool(v)
+        return None if np.isnan(v) else float(v)
+
+    def records(self, rows: Iterable[int], fields: List[str]) -> List[dict]:
+        return [{"model": self.models[i], **{f: self.value(f, i) for f in fields}} for i in rows]
+
+
+def _fmt(field: str, value) -> str:
+    if value is None or value == "":
+        return "-"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float):
+        return str(round(value)) if field == "price" else f"{value:.3g}" if field == "rating" else f"{value:g}"
+    return str(value)
+
+
+class CatalogQuery:
+    """
+    Pregunta de ranking o agregado traducida a la API de Catalog: filtros (los del
+    planificador más las palabras que nombran una marca, un SO, un chipset...) y una
+    acción: "top", "mean", "count" o agrupada con `group`.
+    """
+
+    def __init__(self, filters: list, action: str, field: Optional[str] = None, n: int = DEFAULT_TOP_N,
+                 descending: bool = True, group: Optional[str] = None, notes=()):
+        self.filters = filters
+        self.action = action
+        self.field = field
+        self.n = n
+        self.descending = descending
+        self.group = group
+        self.notes = list(notes)
+
+    def describe_filters(self) -> str:
+        parts = []
+        for field, op, value in self.filters:
+            if op == "contains":
+                parts.append(f"{NAMES[field]} contiene '{' '.join(value)}'")
+            elif op == "excludes":
+                parts.append(f"{NAMES[field]} no contiene '{' '.join(value)}'")
+            elif field in BOOLEAN:
+                parts.append(f"{LABELS[field]}={'sí' if value else 'no'}")
+            else:
+                parts.append(f"{NAMES[field]} {op} {value:g}")
+        return ", ".join(parts) or "ninguna"
+
+    def run(self, catalog: Catalog) -> str:
+        """
+        Resultado exacto sobre todo el catálogo como texto compacto para el LLM.
+        """
+        mask = catalog.mask(self.filters)
+        matched = int(np.count_nonzero(mask))
+        lines = [
+            f"Datos exactos calculados sobre todo el catálogo ({len(catalog)} teléfonos). "
+            f"Condiciones: {self.describe_filters()}. Las cumplen {matched}."
+        ] + self.notes
+        name = NAMES.get(self.field, "")
+        if not matched:
+            return "\n".join(lines)
+        if self.group:
+            shown = MAX_GROUPS
+            if self.action == "count":
+                groups = catalog.group_by(self.group, mask=mask)
+                lines.append(f"Teléfonos por {NAMES[self.group]} (de más a menos, {min(len(groups), shown)} de {len(groups)}):")
+                lines.append(f"{LABELS[self.group]} | teléfonos")
+                lines += [f"{g} | {n}" for g, _, n in groups[:shown]]
+            else:
+                groups = catalog.group_by(self.group, self.field, "mean", mask)
+                lines.append(
+                    f"Media de {name} por {NAMES[self.group]} (de mayor a menor, {min(len(groups), shown)} de {len(groups)}):"
+                )
+                lines.append(f"{LABELS[self.group]} | {LABELS[self.field]} medio | teléfonos con dato")
+                lines += [f"{g} | {_fmt(self.field, v)} | {n}" for g, v, n in groups[:shown]]
+        elif self.action == "count":
+            lines.append(f"Número de teléfonos: {matched}.")
+        elif self.action == "mean":
+            agg = catalog.aggregate(self.field, mask)
+            if agg["n"]:
+                lines.append(
+                    f"Media de {name}: {_fmt(self.field, agg['mean'])} (mínimo {_fmt(self.field, agg['min'])}, "
+                    f"máximo {_fmt(self.field, agg['max'])}; {agg['n']} teléfonos con dato)."
+                )
+        else:
+            rows = catalog.top(self.field, self.n, mask, self.descending)
+            order = "de mayor a menor" if self.descending else "de menor a mayor"
+            fields = list(dict.fromkeys(["price", "rating", self.field] + [f for f, _, _ in self.filters]))
+            lines.append(f"Top {len(rows)} por {name}, {order}:")
+            lines.append(" | ".join(["Model"] + [LABELS[f] for f in fields]))
+            lines += [
+                " | ".join([r["model"]] + [_fmt(f, r[f]) for f in fields])
+                for r in catalog.records(rows, fields)
+            ]
+        return "\n".join(lines)
+
+
+def _mentioned(text: str) -> List[str]:
+    """
+    Campos ordenables nombrados en la pregunta, por orden de aparición.
+    """
+    found = [(m.start(), f) for f, p in SORT_PATTERNS.items() for m in [p.search(text)] if m]
+    return [f for _, f in sorted(found)]
+
+
+def _intent(text: str, plan) -> Optional[tuple]:
+    """
+    (acción, campo, n, de mayor a menor, grupo) que pide el texto ya tokenizado, con las
+    restricciones de `plan`; None si no es un ranking ni un agregado.
+    """
+    constrained = {f for f, _, _ in plan.numeric}
+    mentioned = _mentioned(text)
+    # El campo del ranking o del agregado: el nombrado que no es una condición ("top 5 por batería
+    # por debajo de 250 €" -> batería); si no hay otro, el de la condición
+    field = next((f for f in mentioned if f not in constrained), mentioned[0] if mentioned else None)
+    group = GROUP_PATTERN.search(text)
+    group = next(k for k, v in group.groupdict().items() if v) if group else None
+
+    if COUNT.search(text):
+        return "count", None, None, None, group
+    if MEAN.search(text) and not NOT_MEAN.search(text):
+        if field is None:
+            return None
+        return "mean", field, None, None, group
+    if group:
+        return "count", None, None, None, group
+
+    if not (SUPERLATIVE.search(text) or TOP_N.search(text)):
+        return None
+    descending = None
+    for pattern, implied, desc in IMPLIED_SORT:
+        if pattern.search(text):
+            field, descending = implied, desc
+            break
+    if field is None:
+        return None  # "el mejor para jugar": sin campo que ordenar, es una recomendación
+    if descending is None:
+        # "con más batería" / "con menos RAM"; sin dirección, el precio de menor a mayor
+        phrase = re.search(rf"\b(mas|mayor|mejor|menos|menor|peor)(?: \w+)? (?:{SORT_FIELDS[field]})\b", text)
+        if phrase:
+            descending = bool(DESCENDING.fullmatch(phrase.group(1)))
+        else:
+            descending = field != "price"
+    n = DEFAULT_TOP_N
+    m = TOP_N.search(text)
+    if m:
+        raw = m.group(1) or m.group(2)
+        n = int(raw) if raw.isdigit() else NUMBER_WORDS.get(raw, DEFAULT_TOP_N)
+    return "top", field, max(1, min(n, MAX_TOP_N)), descending, None
+
+
+def question_intent(question: str, matcher=None) -> Optional[tuple]:
+    """
+    (acción, campo, n, de mayor a menor, grupo) del ranking o agregado que pide la pregunta,
+    igual que parse_question() pero sin catálogo; None si no pide ninguno.
+    "el más barato" y "el más caro" dan el mismo campo y distinta dirección.
+    """
+    text = " ".join(tokenize(question))
+    if RELATIVE.search(text):
+        return None
+    return _intent(text, plan_query(question, matcher))
+
+
+def parse_question(question: str, catalog: Catalog) -> Optional[CatalogQuery]:
+    """
+    CatalogQuery si la pregunta pide un ranking ("top 5 por batería por menos de 250 €",
+    "el más barato con NFC"), un agregado ("precio medio de los de 120 Hz", "¿cuántos
+    móviles Samsung tienen 5G?") o un agregado por grupos ("precio medio por marca");
+    None si no (decide el recuperador normal).
+    """
+    words = tokenize(question)
+    text = " ".join(words)
+    if RELATIVE.search(text):
+        return None  # "más barato que el X": alternativas a un modelo, no ranking
+
+    plan = plan_query(question, catalog.matcher)
+    intent = _intent(text, plan)
+    if intent is None:
+        return None
+    action, field, n, descending, group = intent
+    filters = [(f, op, v) for f, op, v in plan.numeric]
+    filters += [(f, "==", v) for f, v in plan.booleans.items()]
+    if plan.network_type:
+        filters.append(("network_type", "contains", [plan.network_type]))
+    if plan.excluded_network:
+        filters.append(("network_type", "excludes", [plan.excluded_network]))
+    used = set()
+    for col in ("brand", "os", "chipset", "display_type"):
+        # Cada palabra filtra una sola columna ("samsung" es la marca, no los Exynos de Samsung)
+        terms = [w for w in catalog.terms(col, words) if w not in used]
+        if terms:
+            filters.append((col, "contains", terms))
+            used.update(terms)
+    notes = []
+    if PANEL_TYPES.search(text):
+        notes.append("El catálogo no indica el tipo de panel (AMOLED, LCD...): no se ha filtrado por él.")
+
+    if action == "top":
+        return CatalogQuery(filters, "top", field=field, n=n, descending=descending, notes=notes)
+    return CatalogQuery(filters, action, field=field, group=group, notes=notes)
+
+
+class CatalogRetriever(BaseRetriever):
+    """
+    Delante del resto de recuperadores: las preguntas de ranking o agregados se
+    resuelven con la instantánea columnar del catálogo (exacto y sobre todos los
+    teléfonos, no sobre los 10 recuperados) y el resultado va al LLM como contexto.
+    """
+
+    def __init__(self, catalog: Catalog, base: BaseRetriever):
+        super().__init__(callback_manager=Settings.callback_manager)
+        self._catalog = catalog
+        self._base = base
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        question = extract_question(query_bundle.query_str)
+        with timed("catalog_query"):
+            query = parse_question(question, self._catalog)
+            text = query.run(self._catalog) if query is not None else None
+        if text is None:
+            return self._base.retrieve(query_bundle)
+        return [NodeWithScore(node=TextNode(text=text), score=1.0)]
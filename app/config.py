@@ -10,7 +10,104 @@ load_dotenv(dotenv_path=ENV_PATH)
 NEO4J_URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
 NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
 NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "")
+NEO4J_DATABASE = os.getenv("NEO4J_DATABASE") or None  # None = base de datos por defecto del servidor
+
+# Driver compartido: conexiones en el pool, tiempos máximos (s) y registros por lote al leer
+NEO4J_POOL_SIZE = int(os.getenv("NEO4J_POOL_SIZE", "50"))
+NEO4J_CONNECTION_TIMEOUT = float(os.getenv("NEO4J_CONNECTION_TIMEOUT", "5"))
+NEO4J_ACQUIRE_TIMEOUT = float(os.getenv("NEO4J_ACQUIRE_TIMEOUT", "10"))
+NEO4J_QUERY_TIMEOUT = float(os.getenv("NEO4J_QUERY_TIMEOUT", "0"))  # 0 = sin límite
+NEO4J_MAX_RETRY_TIME = float(os.getenv("NEO4J_MAX_RETRY_TIME", "15"))
+NEO4J_FETCH_SIZE = int(os.getenv("NEO4J_FETCH_SIZE", "1000"))
+
+# Carga masiva en Neo4j (02_load_neo4j.py): filas por transacción y transacciones en paralelo
+NEO4J_BATCH_SIZE = int(os.getenv("NEO4J_BATCH_SIZE", "1000"))
+NEO4J_LOAD_WORKERS = int(os.getenv("NEO4J_LOAD_WORKERS", "4"))
 
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "phi3:mini") 
 OLLAMA_EMBED_MODEL = os.getenv("OLLAMA_EMBED_MODEL", "nomic-embed-text")
+
+# Residencia de los modelos en Ollama: tiempo sin uso antes de descargarlos ("10m", "1h",
+# segundos; "0" = descargar tras cada respuesta, -1 = nunca), memoria libre mínima en MB por
+# debajo de la cual se descargan los que no se usan (0 = no vigilar), cada cuántos segundos
+# se comprueba y si el servidor los precarga al arrancar
+MODEL_KEEP_ALIVE = os.getenv("MODEL_KEEP_ALIVE") or os.getenv("OLLAMA_KEEP_ALIVE") or "10m"
+MODEL_MIN_FREE_MB = float(os.getenv("MODEL_MIN_FREE_MB", "0"))
+MODEL_CHECK_INTERVAL = float(os.getenv("MODEL_CHECK_INTERVAL", "30"))
+MODEL_PREWARM = os.getenv("MODEL_PREWARM", "1") == "1"
+
+# Embeddings por lotes (03_build_rag.py): tamaño de lote, peticiones simultáneas y reintentos
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "3"))
+EMBED_TIMEOUT = float(os.getenv("EMBED_TIMEOUT", "60"))
+
+# Caché persistente de embeddings (documentos y preguntas)
+EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE", "1") == "1"
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", str(PROJECT_ROOT / "cache" / "embeddings.sqlite"))
+EMBED_CACHE_MAX_MB = float(os.getenv("EMBED_CACHE_MAX_MB", "256"))
+
+# Reconstrucción completa del índice en streaming: teléfonos por página (lote confirmado en disco)
+INDEX_PAGE_SIZE = int(os.getenv("INDEX_PAGE_SIZE", "512"))
+
+# Precisión de la matriz de embeddings persistida (float32 o float16, la mitad de memoria)
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float32")
+# Búsqueda sobre códigos int8 ("int8", la cuarta parte que float32) o exacta ("none"); con
+# int8, los VECTOR_RERANK * top_k mejores candidatos se reordenan con los vectores exactos
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")
+VECTOR_RERANK = int(os.getenv("VECTOR_RERANK", "4"))
+
+# Recuperación híbrida BM25 + vectorial (RRF) y nodos que llegan al LLM
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"
+HYBRID_TOP_K = int(os.getenv("HYBRID_TOP_K", "6"))
+
+# Vecinos precalculados por teléfono ("alternativas al X"): cuántos, peso de las
+# especificaciones frente al embedding en la similitud y si se usan al responder
+SIMILAR_PHONES = os.getenv("SIMILAR_PHONES", "1") == "1"
+SIMILAR_K = int(os.getenv("SIMILAR_K", "10"))
+SIMILAR_SPEC_WEIGHT = float(os.getenv("SIMILAR_SPEC_WEIGHT", "0.3"))
+
+# Rankings y agregados ("top 5 por batería", "precio medio por marca") calculados sobre la
+# instantánea columnar del catálogo (index_store/catalog) en vez de con la búsqueda
+CATALOG_QUERIES = os.getenv("CATALOG_QUERIES", "1") == "1"
+
+# Contexto del LLM: tabla compacta con las columnas relevantes y presupuesto de tokens
+CONTEXT_PACKING = os.getenv("CONTEXT_PACKING", "1") == "1"
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "700"))
+
+# Consultas de un dato o comparativas de modelos concretos: respuesta directa, sin LLM
+DIRECT_ANSWERS = os.getenv("DIRECT_ANSWERS", "1") == "1"
+
+# Servidor web: llamadas simultáneas al LLM, cola de espera y tiempos máximos
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "1"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "8"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "60"))
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "180"))
+WEB_SERVER = os.getenv("WEB_SERVER", "waitress")  # "waitress" (producción) o "flask" (desarrollo)
+WEB_THREADS = int(os.getenv("WEB_THREADS", "16"))
+# Abre el puerto al instante y prepara pipeline + índice en segundo plano (/ready indica cuándo)
+BACKGROUND_BOOT = os.getenv("BACKGROUND_BOOT", "1") == "1"
+# Instantáneas versionadas del índice (index_store/snapshots): cuántas se conservan, cada
+# cuántos segundos comprueba el servidor si hay una nueva (0 = solo con /api/admin/reload)
+# y token de los endpoints de administración (sin token, solo desde localhost)
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "2"))
+SNAPSHOT_POLL_SECONDS = float(os.getenv("SNAPSHOT_POLL_SECONDS", "5"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+# Catálogos (mercados) con su CSV, moneda, base de datos de Neo4j e índice propios (catalogs.json,
+# ver app/shards.py; sin el fichero hay uno solo, "default"), el que se usa si la petición no
+# indica ninguno (vacío = el primero) y memoria para índices cargados a la vez en el servidor
+# (MB, 0 = sin límite): al pasarse se descargan los usados hace más tiempo
+CATALOGS_FILE = os.getenv("CATALOGS_FILE", str(PROJECT_ROOT / "catalogs.json"))
+DEFAULT_CATALOG = os.getenv("DEFAULT_CATALOG", "")
+CATALOG_MEMORY_MB = float(os.getenv("CATALOG_MEMORY_MB", "0"))
+# Modo lote (/api/chat/batch y 05_batch_chat.py): preguntas como máximo por petición e hilos
+# de generación (en el servidor pasan por la cola del LLM, así que el paralelismo real lo marca LLM_CONCURRENCY)
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "1000"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+# Caché de respuestas del chat (exacta + semántica)
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE", "1") == "1"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_MAX = int(os.getenv("ANSWER_CACHE_MAX", "1000"))
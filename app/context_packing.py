@@ -0,0 +1,178 @@
+# app/context_packing.py
+import re
+from typing import List, Optional
+
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+
+from app.direct_answer import FIELD_PATTERNS
+from app.hybrid import NETWORK_SUFFIX, tokenize
+from app.ingest_utils import TEXT_FIELDS
+from app.metrics import CONTEXT_TOKENS, CONTEXT_TOKENS_SAVED, current_timings, timed
+from app.query_planner import extract_question, plan_query
+
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+LABELS = {key: label for label, key, _ in TEXT_FIELDS}
+EMPTY = {"", "None", "nan"}
+
+# Siempre en la tabla
+BASE_KEYS = ["model", "price", "rating"]
+# Pregunta abierta sin ningún campo reconocible
+DEFAULT_KEYS = [
+    "chipset", "ram_gb", "storage_gb", "battery_mah", "screen_size_in", "refresh_rate_hz",
+    "rear_camera_mp_list", "os", "network_type",
+]
+# Temas de recomendación -> campos que los deciden
+TOPICS = [
+    (r"jugar|juegos?|gaming|gamer|rendimiento|potente|potencia|rapido", ["chipset", "ram_gb", "refresh_rate_hz", "battery_mah"]),
+    (r"fotos?|camaras?|selfies?|videos?|noche", ["rear_camera_mp_list", "rear_camera_count", "front_camera_mp"]),
+    (r"pequeno|compacto|grande|manejable", ["screen_size_in", "display_type"]),
+    (r"carga|autonomia|dure|dura", ["battery_mah"]),
+    (r"microsd|tarjeta", ["memory_card_supported", "memory_card_type"]),
+]
+TOPIC_PATTERNS = [(re.compile(rf"\b(?:{p})\b"), keys) for p, keys in TOPICS]
+# Lo único en lo que pueden diferir dos variantes para ir en la misma fila
+VARIANT_KEYS = {"model", "price", "rating", "ram_gb", "storage_gb"}
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Aproximación a los tokens del LLM (palabras + signos): sirve para el presupuesto
+    y para comparar, no para contar exactamente.
+    """
+    return len(TOKEN_RE.findall(text))
+
+
+def relevant_keys(question: str) -> List[str]:
+    """
+    Campos de la tabla para esta pregunta: los que nombra, los de sus restricciones
+    (precio, RAM, NFC, 5G...) y los del tema ("para jugar", "buenas fotos").
+    """
+    text = " ".join(tokenize(question))
+    keys = [f for f, pattern in FIELD_PATTERNS.items() if pattern.search(text)]
+    for pattern, topic_keys in TOPIC_PATTERNS:
+        if pattern.search(text):
+            keys += topic_keys
+    if not set(keys) - set(BASE_KEYS):
+        # "¿qué móvil me recomiendas por menos de 300 €?": sin tema concreto, ficha resumida
+        keys += DEFAULT_KEYS
+    plan = plan_query(question)
+    keys += [f for f, _, _ in plan.numeric] + list(plan.booleans)
+    if plan.network_type or plan.excluded_network:
+        keys.append("network_type")
+    return [k for k in LABELS if k in BASE_KEYS or k in keys]
+
+
+def compact_value(key: str, value: str) -> str:
+    """
+    Menos tokens por celda: "12.0" -> "12", precio sin céntimos, "[50, 48, 32]" -> "50+48+32".
+    """
+    value = " ".join(value.split())
+    if value in EMPTY:
+        return ""
+    if key == "price":
+        try:
+            return str(round(float(value)))
+        except ValueError:
+            return value
+    if key == "rear_camera_mp_list":
+        return "+".join(re.findall(r"\d+(?:\.\d+)?", value)) or value
+    return re.sub(r"^(\d+)\.0$", r"\1", value)
+
+
+def parse_fields(text: str) -> Optional[dict]:
+    if "Model=" not in text:
+        return None
+    values = dict(pair.partition("=")[::2] for pair in text.split("; "))
+    return {key: compact_value(key, values.get(label, "")) for key, label in LABELS.items()}
+
+
+def merge_variants(rows: List[dict], keys: List[str]) -> List[dict]:
+    """
+    Une variantes casi idénticas del mismo modelo (4G/5G, distinta RAM o almacenamiento)
+    en una sola fila: "redmi note 12 4g/5g", RAM "6/8". Solo si coinciden en todas las
+    demás columnas de la tabla; si no, cada una va en su fila.
+    """
+    groups = {}
+    for r in rows:
+        base = NETWORK_SUFFIX.sub("", r["model"].lower())
+        same = tuple(r[k] for k in keys if k not in VARIANT_KEYS and k != "network_type")
+        groups.setdefault((base, same), []).append(r)
+    merged = []
+    for (base, _), group in groups.items():
+        if len(group) == 1:
+            merged.append(group[0])
+            continue
+        row = {}
+        for k in keys:
+            values = list(dict.fromkeys(r[k] for r in group if r[k]))
+            row[k] = "/".join(values)
+        suffixes = list(dict.fromkeys(r["model"].lower()[len(base):].strip() for r in group))
+        # "x 5g" + "x 4g" -> "x 4g/5g"; si alguna variante no lleva sufijo, el nombre base
+        row["model"] = base if "" in suffixes else f"{base} {'/'.join(suffixes)}"
+        merged.append(row)
+    return merged
+
+
+def pack_context(texts: List[str], question: str, token_budget: int) -> tuple:
+    """
+    (tabla compacta, filas incluidas, filas descartadas por presupuesto) a partir de los
+    textos key=value recuperados, en el orden del ranking.
+    """
+    rows = [r for r in (parse_fields(t) for t in texts) if r]
+    keys = relevant_keys(question)
+    rows = merge_variants(rows, keys)
+    # Columnas vacías en todas las filas (o booleanos siempre false sin preguntar por ellos) fuera
+    keys = [k for k in keys if k == "model" or any(r[k] and r[k] != "false" for r in rows)]
+
+    header = " | ".join(LABELS[k] for k in keys)
+    lines, used = [header], estimate_tokens(header)
+    for r in rows:
+        line = " | ".join(r[k] or "-" for k in keys)
+        cost = estimate_tokens(line)
+        # Al menos un teléfono aunque no quepa: mejor contexto corto que ninguno
+        if used + cost > token_budget and len(lines) > 1:
+            break
+        lines.append(line)
+        used += cost
+    included = len(lines) - 1
+    return "\n".join(lines), included, len(rows) - included
+
+
+class ContextPacker(BaseNodePostprocessor):
+    """
+    Entre el recuperador y el sintetizador: convierte los teléfonos recuperados en una
+    tabla compacta (solo las columnas que importan para la pregunta, variantes unidas)
+    que no pasa de token_budget tokens. Los nodos que no son fichas de teléfono (avisos
+    del planificador) pasan tal cual.
+    """
+
+    token_budget: int = 700
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ContextPacker"
+
+    def _postprocess_nodes(
+        self, nodes: List[NodeWithScore], query_bundle: Optional[QueryBundle] = None
+    ) -> List[NodeWithScore]:
+        phones = [n for n in nodes if "Model=" in n.node.get_content()]
+        if not phones:
+            return nodes
+        question = extract_question(query_bundle.query_str) if query_bundle else ""
+        with timed("context_packing"):
+            texts = [n.node.get_content() for n in phones]
+            table, included, dropped = pack_context(texts, question, self.token_budget)
+
+        raw, packed = sum(estimate_tokens(t) for t in texts), estimate_tokens(table)
+        CONTEXT_TOKENS.observe(raw, stage="raw")
+        CONTEXT_TOKENS.observe(packed, stage="packed")
+        CONTEXT_TOKENS_SAVED.inc(max(0, raw - packed))
+        timings = current_timings()
+        if timings is not None:
+            timings.set_context(
+                budget=self.token_budget, raw_tokens=raw, packed_tokens=packed,
+                saved_tokens=raw - packed, phones=included, dropped=dropped,
+            )
+        others = [n for n in nodes if "Model=" not in n.node.get_content()]
+        return others + [NodeWithScore(node=TextNode(text=table), score=phones[0].score)]
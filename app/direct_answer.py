@@ -0,0 +1,211 @@
+# app/direct_answer.py
+import re
+from typing import List, Optional
+
+import numpy as np
+
+from app.hybrid import ModelMatcher, tokenize
+from app.ingest_utils import parse_text
+
+# Preguntas abiertas (opinión, recomendación): siempre van al LLM
+RECOMMEND = re.compile(
+    r"\b(?:recomiend\w*|recomend\w*|aconsej\w*|mejor(?:es)?|peor(?:es)?|busco|quiero|necesito|deberia|"
+    r"merece|elij\w*|elegir|compro|comprar|alternativas?|parecidos?|similares?|buen[oa]s?|bien|pena|opinas?)\b"
+)
+# "¿hay algo más barato que el X?": con un solo modelo no es un dato, son alternativas
+RELATIVE = re.compile(r"\b(?:mas|menos) \w+ que\b")
+# Ficha completa: "¿qué tal es el X?", "especificaciones del X"
+SUMMARY = re.compile(
+    r"\b(?:que tal|especificaciones|caracteristicas|ficha|specs|datos|detalles|informacion|info|como es|hablame)\b"
+)
+
+# campo -> (patrón sobre la pregunta tokenizada, etiqueta)
+FIELDS = {
+    "price": (r"precio|cuesta|cuestan|vale|valen|cuanto sale|caro|barato|euros?", "Precio"),
+    "rating": (r"valoracion|puntuacion|nota|rating", "Valoración"),
+    "os": (r"sistema|so|android|ios|version", "Sistema"),
+    "network_type": (r"5g|4g|red|redes", "Red"),
+    "chipset": (r"chipset|procesador|cpu|soc|chip", "Procesador"),
+    "ram_gb": (r"ram", "RAM"),
+    "storage_gb": (r"almacenamiento|memoria interna|capacidad|rom", "Almacenamiento"),
+    "battery_mah": (r"bateria|mah|autonomia", "Batería"),
+    "screen_size_in": (r"pantalla|pulgadas|tamano", "Pantalla"),
+    "refresh_rate_hz": (r"refresco|hz|hercios|fluidez", "Refresco"),
+    "rear_camera_mp_list": (r"camaras?|megapixeles|mp|mpx|fotos?", "Cámaras traseras"),
+    "front_camera_mp": (r"frontal|selfies?", "Cámara frontal"),
+    "nfc": (r"nfc", "NFC"),
+    "volte": (r"volte", "VoLTE"),
+    "ir_blaster": (r"infrarrojos?|ir blaster", "Infrarrojos"),
+    "memory_card_supported": (r"micro sd|microsd|tarjeta|ampliable|ampliar", "Tarjeta de memoria"),
+}
+FIELD_PATTERNS = {f: re.compile(rf"\b(?:{p})\b") for f, (p, _) in FIELDS.items()}
+# Orden de la ficha completa y de las comparativas sin campo concreto
+SUMMARY_FIELDS = [
+    "price", "chipset", "ram_gb", "storage_gb", "battery_mah", "screen_size_in", "refresh_rate_hz",
+    "rear_camera_mp_list", "front_camera_mp", "os", "network_type", "nfc",
+]
+# Campos en los que más es mejor: la comparativa dice quién gana
+HIGHER_WINS = {
+    "rating": "Mejor valorado",
+    "ram_gb": "Más RAM",
+    "storage_gb": "Más almacenamiento",
+    "battery_mah": "Más batería",
+    "screen_size_in": "Pantalla más grande",
+    "refresh_rate_hz": "Pantalla más fluida",
+    "front_camera_mp": "Más megapíxeles en la frontal",
+}
+# El system prompt prohíbe dar el precio exacto: solo la franja dentro del catálogo
+PRICE_NOTE = "El precio exacto varía según la zona."
+BOOLEAN_NAMES = {
+    "nfc": "NFC",
+    "volte": "VoLTE",
+    "ir_blaster": "infrarrojos",
+    "memory_card_supported": "ranura para tarjeta de memoria",
+}
+
+
+def pretty_model(model: str) -> str:
+    """
+    "oneplus 11 5g" -> "Oneplus 11 5G" (el CSV trae los modelos en minúsculas).
+    """
+    words = []
+    for w in model.split():
+        words.append(w.upper() if re.fullmatch(r"\d+g|\(?\d+gb\)?", w) else w[:1].upper() + w[1:])
+    return " ".join(words)
+
+
+def _num(v) -> str:
+    return f"{v:g}" if isinstance(v, float) else str(v)
+
+
+class SpecTable:
+    """
+    Especificaciones de todo el catálogo en memoria (las mismas filas que el índice
+    vectorial) para responder sin LLM a consultas de un dato o comparativas.
+    """
+
+    def __init__(self, rows: List[dict]):
+        self.rows = rows
+        self.models = [r["model"] for r in rows]
+        self.matcher = ModelMatcher(self.models)
+        prices = [r["price"] for r in rows if r["price"] is not None]
+        # Terciles de precio del catálogo: "de los baratos" / "de precio medio" / "de los caros"
+        self._price_cuts = np.percentile(prices, [33, 66]).tolist() if prices else None
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @classmethod
+    def from_rows(cls, rows: List[dict]) -> "SpecTable":
+        """
+        rows: filas de NumpyVectorStore ({"id", "text", "metadata"}).
+        """
+        return cls([parse_text(r["text"]) for r in rows])
+
+    def value(self, row: dict, field: str) -> str:
+        v = row.get(field)
+        if field == "price":
+            return self._price_band(v)
+        if field in BOOLEAN_NAMES:
+            if field == "memory_card_supported" and v and row.get("memory_card_type") not in ("", "None"):
+                return f"sí ({row['memory_card_type']})"
+            return "sí" if v else "no"
+        if v is None or v == "":
+            return "sin datos"
+        if field == "ram_gb" or field == "storage_gb":
+            return f"{_num(v)} GB"
+        if field == "battery_mah":
+            return f"{_num(v)} mAh"
+        if field == "screen_size_in":
+            kind = row.get("display_type")
+            return f"{_num(v)} pulgadas" + (f" ({kind})" if kind else "")
+        if field == "refresh_rate_hz":
+            return f"{_num(v)} Hz"
+        if field == "rear_camera_mp_list":
+            mp = re.findall(r"\d+(?:\.\d+)?", v)
+            return " + ".join(f"{m} MP" for m in mp) if mp else v
+        if field == "front_camera_mp":
+            return f"{_num(v)} MP"
+        if field == "network_type":
+            return v.upper()
+        if field == "rating":
+            return f"{_num(v)}/100"
+        return str(v)
+
+    def _price_band(self, price) -> str:
+        if price is None or not self._price_cuts:
+            return "sin datos"
+        low, high = self._price_cuts
+        band = "de los baratos" if price <= low else "de precio medio" if price <= high else "de los caros"
+        return f"{band} del catálogo"
+
+    def match(self, question: str, limit: int = 4) -> List[int]:
+        return self.matcher.match(question, limit=limit)
+
+    def answer(self, question: str) -> Optional[dict]:
+        """
+        {"reply", "intent": "lookup" | "compare", "models"} si la pregunta es una consulta
+        directa sobre modelos concretos del catálogo; None si tiene que responder el LLM.
+        """
+        words = tokenize(question)
+        text = " ".join(words)
+        if RECOMMEND.search(text):
+            return None
+        found = self.match(question)
+        if not found:
+            return None
+
+        # Los campos se buscan sin los nombres de modelo ("5g" de "oneplus 11 5g" no es la red)
+        spans = self.matcher.spans(question)
+        taken = {p for i in found for a, b in spans[i] for p in range(a, b)}
+        rest = " ".join(w for p, w in enumerate(words) if p not in taken)
+        fields = [f for f, pattern in FIELD_PATTERNS.items() if pattern.search(rest)]
+        rows = [self.rows[i] for i in found]
+
+        if len(rows) == 1:
+            if RELATIVE.search(rest) or (not fields and not SUMMARY.search(rest)):
+                return None
+            reply = self._lookup(rows[0], fields or SUMMARY_FIELDS)
+            intent = "lookup"
+        else:
+            reply = self._compare(rows, fields or SUMMARY_FIELDS)
+            intent = "compare"
+        return {"reply": reply, "intent": intent, "models": [r["model"] for r in rows]}
+
+    def _lookup(self, row: dict, fields: List[str]) -> str:
+        name = pretty_model(row["model"])
+        if len(fields) == 1:
+            field = fields[0]
+            if field in BOOLEAN_NAMES:
+                what = BOOLEAN_NAMES[field]
+                v = self.value(row, field)
+                if v.startswith("sí"):
+                    return f"Sí, el {name} tiene {what}{v[2:]}."
+                return f"No, el {name} no tiene {what}."
+            if field == "price":
+                return f"El {name} es {self.value(row, field)}. {PRICE_NOTE}"
+            return f"{FIELDS[field][1]} del {name}: {self.value(row, field)}."
+        lines = [f"{name}:"]
+        lines += [f"- {FIELDS[f][1]}: {self.value(row, f)}" for f in fields]
+        if "price" in fields:
+            lines.append(PRICE_NOTE)
+        return "\n".join(lines)
+
+    def _compare(self, rows: List[dict], fields: List[str]) -> str:
+        names = [pretty_model(r["model"]) for r in rows]
+        lines = [" vs ".join(names) + ":"]
+        for f in fields:
+            values = " | ".join(f"{n}: {self.value(r, f)}" for n, r in zip(names, rows))
+            lines.append(f"- {FIELDS[f][1]}: {values}")
+        verdicts = []
+        for f in fields:
+            values = [r.get(f) for r in rows]
+            if f not in HIGHER_WINS or any(v is None for v in values) or len(set(values)) == 1:
+                continue
+            best = max(values)
+            winners = [n for n, v in zip(names, values) if v == best]
+            if len(winners) == 1:
+                verdicts.append(f"{HIGHER_WINS[f]}: {winners[0]}.")
+        if "price" in fields:
+            verdicts.append(PRICE_NOTE)
+        return "\n".join(lines + ([""] + verdicts if verdicts else []))
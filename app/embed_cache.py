@@ -0,0 +1,199 @@
+# app/embed_cache.py
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from pathlib import Path
+from typing import Any, List
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key TEXT PRIMARY KEY,
+    vec BLOB NOT NULL,
+    last_used REAL NOT NULL
+)
+"""
+
+
+class EmbeddingCache:
+    """
+    Caché persistente (SQLite) de embeddings, clave = (modelo, tipo, sha256 del texto).
+    Al superar `max_bytes` elimina primero las entradas usadas hace más tiempo.
+    """
+
+    def __init__(self, path, model_name: str, max_bytes: int):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.model_name = model_name
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(SCHEMA)
+        self._conn.commit()
+
+    def _key(self, kind: str, text: str) -> str:
+        raw = f"{self.model_name}\0{kind}\0{text}".encode("utf-8")
+        return hashlib.sha256(raw).hexdigest()
+
+    def get_many(self, kind: str, texts: List[str]) -> List[Any]:
+        keys = [self._key(kind, t) for t in texts]
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                marks = ",".join("?" * len(chunk))
+                for key, blob in self._conn.execute(
+                    f"SELECT key, vec FROM embeddings WHERE key IN ({marks})", chunk
+                ):
+                    found[key] = array("f", blob).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, k) for k in found],
+                )
+                self._conn.commit()
+            out = [found.get(k) for k in keys]
+            hits = sum(v is not None for v in out)
+            self.hits += hits
+            self.misses += len(out) - hits
+        return out
+
+    def put_many(self, kind: str, texts: List[str], vectors: List[List[float]]) -> None:
+        now = time.time()
+        rows = [
+            (self._key(kind, t), array("f", v).tobytes(), now)
+            for t, v in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vec, last_used) VALUES (?, ?, ?)", rows
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        total, count = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vec)), 0), COUNT(*) FROM embeddings"
+        ).fetchone()
+        if total <= self.max_bytes or not count:
+            return
+        # Borra las menos usadas hasta quedar en ~90% del límite
+        avg = total / count
+        n_drop = int((total - 0.9 * self.max_bytes) / avg) + 1
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+            (n_drop,),
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            total, count = self._conn.execute(
+                "SELECT COALESCE(SUM(LENGTH(vec)), 0), COUNT(*) FROM embeddings"
+            ).fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": count,
+                "bytes": total,
+            }
+
+
+def query_embeddings(embed_model: BaseEmbedding, queries: List[str]) -> List[List[float]]:
+    """
+    Embeddings de varias preguntas por el camino de get_query_embedding (con la
+    query_instruction del modelo, si tiene). Con OllamaEmbedding van en lotes de
+    embed_batch_size; con otros modelos, una a una.
+    """
+    format_query = getattr(embed_model, "_format_query", None)
+    embed_many = getattr(embed_model, "get_general_text_embeddings", None)
+    if format_query is None or embed_many is None:
+        return [embed_model.get_query_embedding(q) for q in queries]
+    size = max(1, embed_model.embed_batch_size)
+    out = []
+    for i in range(0, len(queries), size):
+        out += embed_many([format_query(q) for q in queries[i:i + size]])
+    return out
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    Envuelve un modelo de embeddings y consulta la caché antes de llamar a Ollama,
+    tanto para documentos como para preguntas.
+    """
+
+    _inner: BaseEmbedding = PrivateAttr()
+    _cache: EmbeddingCache = PrivateAttr()
+
+    def __init__(self, inner: BaseEmbedding, cache: EmbeddingCache, **kwargs: Any):
+        super().__init__(
+            model_name=inner.model_name,
+            embed_batch_size=inner.embed_batch_size,
+            **kwargs,
+        )
+        self._inner = inner
+        self._cache = cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def cache(self) -> EmbeddingCache:
+        return self._cache
+
+    def _lookup(self, kind: str, texts: List[str], compute):
+        cached = self._cache.get_many(kind, texts)
+        missing = [i for i, v in enumerate(cached) if v is None]
+        if missing:
+            vectors = compute([texts[i] for i in missing])
+            self._cache.put_many(kind, [texts[i] for i in missing], vectors)
+            for i, v in zip(missing, vectors):
+                cached[i] = v
+        return cached
+
+    async def _alookup(self, kind: str, texts: List[str], acompute):
+        cached = self._cache.get_many(kind, texts)
+        missing = [i for i, v in enumerate(cached) if v is None]
+        if missing:
+            vectors = await acompute([texts[i] for i in missing])
+            self._cache.put_many(kind, [texts[i] for i in missing], vectors)
+            for i, v in zip(missing, vectors):
+                cached[i] = v
+        return cached
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._lookup("query", [query], lambda qs: [self._inner.get_query_embedding(qs[0])])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        async def compute(qs):
+            return [await self._inner.aget_query_embedding(qs[0])]
+
+        return (await self._alookup("query", [query], compute))[0]
+
+    def get_query_embedding_batch(self, queries: List[str]) -> List[List[float]]:
+        """
+        Varias preguntas de una vez: las que faltan en la caché van a Ollama en lotes.
+        """
+        return self._lookup("query", queries, lambda qs: query_embeddings(self._inner, qs))
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._lookup("text", texts, self._inner.get_text_embedding_batch)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return await self._alookup("text", texts, self._inner.aget_text_embedding_batch)
@@ -0,0 +1,115 @@
+# app/embed_utils.py
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import httpx
+from llama_index.core.schema import MetadataMode
+
+from app.config import EMBED_BATCH_SIZE, EMBED_CONCURRENCY, EMBED_MAX_RETRIES
+
+# Errores transitorios de red/timeout contra Ollama que merece la pena reintentar
+RETRYABLE_ERRORS = (httpx.TransportError, TimeoutError, ConnectionError)
+
+
+def percentile(values, p: float) -> float:
+    """
+    Percentil por rango más cercano (p en 0-100). 0.0 si no hay valores.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1))
+    return ordered[k]
+
+
+class EmbedStats:
+    def __init__(self):
+        self.docs = 0
+        self.retries = 0
+        # Los lotes se reintentan desde los hilos del pool
+        self._lock = threading.Lock()
+        self.batch_latencies = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def add_retry(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+    @property
+    def docs_per_s(self) -> float:
+        return self.docs / self.elapsed if self.elapsed else 0.0
+
+    def summary(self) -> str:
+        lat = self.batch_latencies
+        return (
+            f"{self.docs} docs en {self.elapsed:.1f}s ({self.docs_per_s:.1f} docs/s) | "
+            f"lotes={len(lat)} p50={percentile(lat, 50) * 1000:.0f}ms "
+            f"p95={percentile(lat, 95) * 1000:.0f}ms | reintentos={self.retries}"
+        )
+
+
+def _embed_batch(embed_model, texts, max_retries: int, stats: EmbedStats):
+    delay = 1.0
+    for attempt in range(max_retries + 1):
+        t0 = time.perf_counter()
+        try:
+            vectors = embed_model.get_text_embedding_batch(texts)
+            return vectors, time.perf_counter() - t0
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            stats.add_retry()
+            print(f"  Lote de {len(texts)} falló ({type(e).__name__}), reintento en {delay:.0f}s")
+            time.sleep(delay)
+            delay *= 2
+
+
+def embed_texts(
+    texts,
+    embed_model,
+    batch_size: int = EMBED_BATCH_SIZE,
+    concurrency: int = EMBED_CONCURRENCY,
+    max_retries: int = EMBED_MAX_RETRIES,
+    progress: bool = True,
+):
+    """
+    Calcula embeddings en lotes con como mucho `concurrency` peticiones en vuelo.
+    Devuelve (embeddings en el mismo orden que `texts`, EmbedStats).
+    """
+    texts = list(texts)
+    stats = EmbedStats()
+    out = [None] * len(texts)
+    batches = [(i, texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)]
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = {
+            pool.submit(_embed_batch, embed_model, batch, max_retries, stats): (start, len(batch))
+            for start, batch in batches
+        }
+        for n, fut in enumerate(as_completed(futures), start=1):
+            start, size = futures[fut]
+            vectors, latency = fut.result()
+            out[start:start + size] = vectors
+            stats.docs += size
+            stats.batch_latencies.append(latency)
+            stats.elapsed = time.perf_counter() - stats.started
+            if progress and (n % 10 == 0 or n == len(batches)):
+                print(f"  Embeddings: {stats.docs}/{len(texts)} docs ({stats.docs_per_s:.1f} docs/s)")
+
+    stats.elapsed = time.perf_counter() - stats.started
+    return out, stats
+
+
+def embed_nodes(nodes, embed_model, **kwargs):
+    """
+    Rellena node.embedding de los nodos que aún no lo tengan.
+    """
+    pending = [n for n in nodes if n.embedding is None]
+    texts = [n.get_content(metadata_mode=MetadataMode.EMBED) for n in pending]
+    vectors, stats = embed_texts(texts, embed_model, **kwargs)
+    for node, vec in zip(pending, vectors):
+        node.embedding = vec
+    return stats
@@ -0,0 +1,129 @@
+# app/fingerprint.py
+import hashlib
+import json
+from pathlib import Path
+
+from app.config import NEO4J_DATABASE, OLLAMA_EMBED_MODEL
+from app.neo4j_utils import read_query
+
+# Huellas por teléfono que acompañan al docstore de index_store/
+MANIFEST_NAME = "fingerprints.json"
+# Huella de las entradas del pipeline completo (CSV + modelo de embeddings + versión del código)
+PIPELINE_STATE_NAME = "pipeline_state.json"
+# Versión del código del pipeline: súbela cuando 02_load_neo4j.py o 03_build_rag.py cambien lo
+# que escriben en el grafo o en el índice, para que se vuelvan a pasar aunque el CSV sea el mismo
+PIPELINE_VERSION = 1
+
+# Lado del grafo: 02_load_neo4j.py deja en la base de datos del catálogo el CSV que cargó y
+# cuántos teléfonos había; un grafo borrado o recargado a mano ya no coincide
+GRAPH_STATE_WRITE = """
+MATCH (p:Phone) WITH count(p) AS phones
+MERGE (s:PipelineState {name: 'pipeline'})
+SET s.csv_sha256 = $csv_sha256, s.pipeline_version = $pipeline_version, s.phones = phones
+RETURN phones;
+"""
+GRAPH_STATE_READ = """
+MATCH (p:Phone) WITH count(p) AS phones
+OPTIONAL MATCH (s:PipelineState {name: 'pipeline'})
+RETURN s.csv_sha256 AS csv_sha256, s.pipeline_version AS pipeline_version, s.phones AS recorded, phones;
+"""
+
+
+def row_fingerprint(row: dict) -> str:
+    """
+    Hash estable de una fila ya normalizada (incluye el texto de build_text()).
+    """
+    payload = json.dumps(row, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def file_fingerprint(path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _read_json(path: Path) -> dict:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _write_json(path: Path, data: dict) -> None:
+    # Escribe a un temporal y renombra: nunca deja un JSON a medias
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    tmp.replace(path)
+
+
+def load_manifest(persist_dir) -> dict:
+    """
+    Devuelve {"embed_model": str, "phones": {model: row_hash}} o {} si no hay índice previo.
+    """
+    return _read_json(Path(persist_dir) / MANIFEST_NAME)
+
+
+def save_manifest(persist_dir, phones: dict) -> None:
+    _write_json(
+        Path(persist_dir) / MANIFEST_NAME,
+        {"embed_model": OLLAMA_EMBED_MODEL, "phones": phones},
+    )
+
+
+def pipeline_inputs(csv_path) -> dict:
+    return {
+        "csv_sha256": file_fingerprint(csv_path),
+        "embed_model": OLLAMA_EMBED_MODEL,
+        "pipeline_version": PIPELINE_VERSION,
+    }
+
+
+def mark_graph_current(driver, csv_path, database=None) -> int:
+    """
+    Al final de 02_load_neo4j.py: guarda en el grafo el CSV cargado y la versión del
+    pipeline. Devuelve los teléfonos del grafo.
+    """
+    params = {"csv_sha256": file_fingerprint(csv_path), "pipeline_version": PIPELINE_VERSION}
+    records = driver.execute_query(GRAPH_STATE_WRITE, params, database_=database or NEO4J_DATABASE).records
+    return records[0]["phones"] if records else 0
+
+
+def graph_is_current(csv_path, database=None, driver=None):
+    """
+    True si el grafo tiene cargado este CSV con esta versión del pipeline y no ha perdido
+    ni ganado teléfonos desde entonces. None si Neo4j no responde (no se puede saber).
+    """
+    try:
+        rows = read_query(GRAPH_STATE_READ, driver=driver, retry=False, database=database)
+    except Exception as e:
+        print(f"Aviso: no se pudo comprobar el estado del grafo ({e})")
+        return None
+    state = rows[0] if rows else {}
+    return (
+        state.get("csv_sha256") == file_fingerprint(csv_path)
+        and state.get("pipeline_version") == PIPELINE_VERSION
+        and state.get("recorded") == state.get("phones")
+    )
+
+
+def pipeline_is_current(persist_dir, csv_path, database=None) -> bool:
+    """
+    True si el CSV, el modelo de embeddings y la versión del pipeline no han cambiado
+    desde la última ejecución completa de 02_load_neo4j.py + 03_build_rag.py, y el grafo
+    (`database`) sigue siendo el que cargó. Si Neo4j no responde se decide solo con el
+    índice: sin grafo 02_load_neo4j.py tampoco podría ejecutarse.
+    """
+    persist_dir = Path(persist_dir)
+    if not (persist_dir / MANIFEST_NAME).exists():
+        return False
+    state = _read_json(persist_dir / PIPELINE_STATE_NAME)
+    if not state or state != pipeline_inputs(csv_path):
+        return False
+    return graph_is_current(csv_path, database=database) is not False
+
+
+def mark_pipeline_current(persist_dir, csv_path) -> None:
+    _write_json(Path(persist_dir) / PIPELINE_STATE_NAME, pipeline_inputs(csv_path))
@@ -0,0 +1,336 @@
+# app/hybrid.py
+import json
+import math
+import re
+import unicodedata
+from collections import Counter
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+from llama_index.core import Settings
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.vector_stores.types import FilterOperator, MetadataFilters
+
+from app.query_planner import TOKEN, extract_question
+
+BM25_FNAME = "bm25.json"
+
+# Campos de build_text() que aportan términos (los numéricos ya los resuelve el planificador)
+TEXT_KEYS = {"Model", "OS", "Network", "Chipset", "DisplayType", "MemoryCardType"}
+# Booleanos que, si son true, se indexan con su propio nombre ("móvil con nfc")
+FLAG_KEYS = {"NFC": "nfc", "VoLTE": "volte", "IRBlaster": "infrarrojos"}
+STOPWORDS = {
+    "a", "al", "algo", "alguno", "algun", "busco", "cual", "cuanto", "cuanta", "compara", "con", "de", "del",
+    "el", "en", "entre", "es", "esta", "este", "hay", "la", "las", "lo", "los", "me", "mi", "movil", "moviles",
+    "mejor", "para", "por", "que", "quiero", "se", "su", "tal", "telefono", "tiene", "un", "una", "y", "o",
+}
+# "oneplus 11 5g" también se reconoce como "oneplus 11"
+NETWORK_SUFFIX = re.compile(r"\s+[45]g$")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Minúsculas sin tildes, separando letras de dígitos: "Gen2" y "Gen 2" dan lo mismo.
+    "5g" / "4g" sueltos se quedan enteros para no confundirse con el número de modelo.
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.findall(TOKEN, text)
+
+
+def document_terms(text: str) -> List[str]:
+    terms = []
+    for pair in text.split("; "):
+        key, _, value = pair.partition("=")
+        if key in TEXT_KEYS:
+            terms += tokenize(value)
+        elif key in FLAG_KEYS and value == "true":
+            terms.append(FLAG_KEYS[key])
+    return terms
+
+
+def _field(text: str, key: str) -> str:
+    m = re.search(rf"(?:^|; ){key}=([^;]*)", text)
+    return m.group(1).strip() if m else ""
+
+
+def model_keys(model: str) -> tuple:
+    """
+    (tokens que deben aparecer seguidos en la pregunta, nombre sin sufijo de red, nombre completo).
+    Se admite omitir la marca ("iphone 14") y el sufijo de red ("oneplus 11").
+    """
+    full = tuple(tokenize(model))
+    name = tuple(tokenize(NETWORK_SUFFIX.sub("", model.lower())))
+    key = name[1:] if len(name) >= 3 else name
+    return key, name, full
+
+
+def find_spans(words: tuple, seq: tuple) -> List[tuple]:
+    """
+    Apariciones de seq como secuencia contigua dentro de words: [(inicio, fin)].
+    "galaxy a54 o pixel 7a" no contiene "galaxy a7" aunque estén todos sus tokens.
+    """
+    n = len(seq)
+    return [(i, i + n) for i in range(len(words) - n + 1) if words[i] == seq[0] and words[i:i + n] == seq]
+
+
+class ModelMatcher:
+    """
+    Teléfonos cuyo nombre aparece entero en una pregunta. Cada nombre se indexa por su
+    token menos frecuente, así que solo se comprueban los candidatos de las palabras
+    de la pregunta en vez de todo el catálogo.
+    """
+
+    def __init__(self, models: List[str]):
+        self.keys = [model_keys(m) for m in models]
+        # Marcas del catálogo: la primera palabra de cada modelo
+        self.brands = frozenset(full[0] for _, _, full in self.keys if full)
+        freq = Counter(t for key, _, _ in self.keys for t in set(key))
+        self._by_token = {}
+        for i, (key, _, _) in enumerate(self.keys):
+            if len(key) >= 2:
+                rarest = min(key, key=lambda t: (freq[t], t))
+                self._by_token.setdefault(rarest, []).append(i)
+
+    def spans(self, question: str, mask: Optional[np.ndarray] = None) -> dict:
+        """
+        {posición del modelo: [(inicio, fin)]} con el tramo más largo que coincide de cada
+        aparición (nombre completo, sin sufijo de red, sin marca o sin ninguno de los dos),
+        sobre tokenize(question).
+        """
+        words = tuple(tokenize(question))
+        out = {}
+        for i in {i for w in set(words) for i in self._by_token.get(w, ())}:
+            if mask is not None and not mask[i]:
+                continue
+            key, name, full = self.keys[i]
+            found = find_spans(words, key)
+            if found:
+                # "galaxy s23 ultra 5g": sin marca pero con el sufijo de red
+                longer = find_spans(words, full) + find_spans(words, name) + find_spans(words, key + full[len(name):])
+                out[i] = [max((s for s in longer if s[0] <= a < s[1]), default=(a, b), key=lambda s: s[1] - s[0])
+                          for a, b in found]
+        return out
+
+    def match(self, question: str, mask: Optional[np.ndarray] = None, limit: int = 4) -> List[int]:
+        """
+        Posiciones de los modelos nombrados ("batería del oneplus 11 5g", "compara iphone 14
+        y pixel 7"), en orden de catálogo. Si un nombre va dentro de otro más largo de la
+        pregunta, gana el largo; entre variantes del mismo nombre, la que coincide entera o,
+        si no, la que no lleva sufijo de red. Con más de `limit` aciertos la pregunta no
+        nombra modelos concretos: [].
+        """
+        spans = self.spans(question, mask)
+        covered = lambda a, b, j: any(c <= a and b <= d and d - c > b - a for c, d in spans[j])
+        # Quita los que solo aparecen dentro de otro acierto (pixel 7 dentro de "pixel 7 pro")
+        found = [i for i in spans if not all(any(covered(a, b, j) for j in spans if j != i) for a, b in spans[i])]
+
+        words = tuple(tokenize(question))
+        by_key = {}
+        for i in found:
+            by_key.setdefault(self.keys[i][0], []).append(i)
+        best = []
+        for group in by_key.values():
+            full = [i for i in group if find_spans(words, self.keys[i][2])]
+            plain = [i for i in group if self.keys[i][1] == self.keys[i][2]]
+            best += full or plain or group
+        best.sort()
+        return best if len(best) <= limit else []
+
+
+class BM25Index:
+    """
+    Índice invertido BM25 sobre el texto key=value de cada teléfono, construido por
+    03_build_rag.py junto al índice vectorial y guardado en index_store/bm25.json.
+    """
+
+    def __init__(self, ids: List[str], models: List[str], chipsets: List[str], postings: dict,
+                 doc_len: List[int], k1: float = 1.2, b: float = 0.75):
+        self.ids = ids
+        self.models = models
+        self.chipsets = chipsets
+        self.k1 = k1
+        self.b = b
+        self._models = np.array(models, dtype=object)
+        dl = np.asarray(doc_len, dtype=np.float32)
+        avgdl = float(dl.mean()) if len(dl) else 1.0
+        n = len(ids)
+        # Peso BM25 precalculado por posting: la consulta solo suma
+        self._weights = {}
+        for term, (docs, tfs) in postings.items():
+            docs = np.asarray(docs, dtype=np.int32)
+            tf = np.asarray(tfs, dtype=np.float32)
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = tf + k1 * (1 - b + b * dl[docs] / avgdl)
+            self._weights[term] = (docs, (idf * tf * (k1 + 1) / norm).astype(np.float32))
+        self._postings = postings
+        self._doc_len = doc_len
+        self.matcher = ModelMatcher(models)
+        self._chipset_keys = [frozenset(tokenize(c)) for c in chipsets]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def terms(self) -> int:
+        return len(self._weights)
+
+    @classmethod
+    def from_rows(cls, rows: List[dict], **kwargs) -> "BM25Index":
+        """
+        rows: filas de NumpyVectorStore ({"id", "text", "metadata"}).
+        """
+        postings, doc_len = {}, []
+        for i, r in enumerate(rows):
+            terms = Counter(document_terms(r["text"]))
+            doc_len.append(sum(terms.values()))
+            for term, tf in terms.items():
+                docs, tfs = postings.setdefault(term, ([], []))
+                docs.append(i)
+                tfs.append(tf)
+        return cls(
+            ids=[r["id"] for r in rows],
+            models=[r["metadata"].get("model") or _field(r["text"], "Model") for r in rows],
+            chipsets=[_field(r["text"], "Chipset") for r in rows],
+            postings=postings,
+            doc_len=doc_len,
+            **kwargs,
+        )
+
+    @classmethod
+    def exists(cls, persist_dir) -> bool:
+        return (Path(persist_dir) / BM25_FNAME).exists()
+
+    @classmethod
+    def load(cls, persist_dir) -> "BM25Index":
+        data = json.loads((Path(persist_dir) / BM25_FNAME).read_text(encoding="utf-8"))
+        return cls(**data)
+
+    def persist(self, persist_dir) -> None:
+        path = Path(persist_dir) / BM25_FNAME
+        data = {
+            "ids": self.ids, "models": self.models, "chipsets": self.chipsets,
+            "postings": self._postings, "doc_len": self._doc_len, "k1": self.k1, "b": self.b,
+        }
+        tmp = path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(path)
+
+    def allowed(self, filters: Optional[MetadataFilters]) -> Optional[np.ndarray]:
+        """
+        Máscara de documentos que cumplen los filtros por modelo (None = todos).
+        """
+        if not filters or not filters.filters:
+            return None
+        mask = np.ones(len(self.ids), dtype=bool)
+        for f in filters.filters:
+            if getattr(f, "key", None) != "model":
+                continue
+            values = f.value if f.operator == FilterOperator.IN else [f.value]
+            mask &= np.isin(self._models, list(values))
+        return mask
+
+    def scores(self, terms: List[str]) -> np.ndarray:
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in set(terms):
+            if term in self._weights:
+                docs, weights = self._weights[term]
+                scores[docs] += weights
+        return scores
+
+    def search(self, query: str, top_k: int, mask: Optional[np.ndarray] = None) -> List[tuple]:
+        """
+        [(posición del documento, score)] de mayor a menor; solo documentos con score > 0.
+        """
+        terms = [t for t in tokenize(query) if t not in STOPWORDS]
+        scores = self.scores(terms)
+        if mask is not None:
+            scores[~mask] = 0
+        hits = np.flatnonzero(scores > 0)
+        if not len(hits):
+            return []
+        top = hits[np.argsort(-scores[hits], kind="stable")[:top_k]]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def exact_models(self, query: str, mask: Optional[np.ndarray] = None, limit: int = 4) -> List[int]:
+        return self.matcher.match(query, mask, limit)
+
+    def exact_chipset(self, query: str, top_k: int, mask: Optional[np.ndarray] = None) -> List[tuple]:
+        """
+        Si la pregunta nombra un chipset completo ("snapdragon 8 gen 2"), los teléfonos
+        que lo llevan, ordenados por BM25.
+        """
+        words = set(tokenize(query))
+        keys = {k for k in set(self._chipset_keys) if len(k) >= 2 and k <= words}
+        keys = {k for k in keys if not any(k < other for other in keys)}
+        if not keys:
+            return []
+        chip_mask = np.fromiter((k in keys for k in self._chipset_keys), dtype=bool, count=len(self.ids))
+        if mask is not None:
+            chip_mask &= mask
+        return self.search(query, top_k, chip_mask) or [(int(i), 0.0) for i in np.flatnonzero(chip_mask)[:top_k]]
+
+
+def rrf(rankings: List[List[str]], k: int = 60) -> dict:
+    """
+    Reciprocal rank fusion: suma de 1 / (k + posición) en cada ranking.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, node_id in enumerate(ranking, start=1):
+            fused[node_id] = fused.get(node_id, 0.0) + 1.0 / (k + rank)
+    return fused
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Recuperación híbrida: BM25 sobre el texto de especificaciones + búsqueda vectorial,
+    combinadas con RRF. Si la pregunta nombra un modelo o un chipset exacto se responde
+    solo con BM25, sin calcular el embedding de la pregunta.
+    """
+
+    def __init__(self, index, bm25: BM25Index, similarity_top_k: int = 10, final_top_k: int = 6,
+                 filters: Optional[MetadataFilters] = None, rrf_k: int = 60, **retriever_kwargs):
+        super().__init__(callback_manager=Settings.callback_manager)
+        self._index = index
+        self._bm25 = bm25
+        self._top_k = similarity_top_k
+        self._final_top_k = final_top_k
+        self._filters = filters
+        self._rrf_k = rrf_k
+        self._vector = index.as_retriever(similarity_top_k=similarity_top_k, filters=filters, **retriever_kwargs)
+
+    def _nodes(self, positions: List[int], scores: List[float]) -> List[NodeWithScore]:
+        ids = [self._bm25.ids[i] for i in positions]
+        if not ids:
+            return []  # get_nodes(node_ids=[]) devolvería todo el índice
+        vector_store = self._index.vector_store
+        if vector_store.stores_text:
+            found = {n.node_id: n for n in vector_store.get_nodes(node_ids=ids)}
+        else:
+            found = {n.node_id: n for n in self._index.docstore.get_nodes(ids, raise_error=False)}
+        return [NodeWithScore(node=found[i], score=s) for i, s in zip(ids, scores) if i in found]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        question = extract_question(query_bundle.query_str)
+        mask = self._bm25.allowed(self._filters)
+
+        exact = self._bm25.exact_models(question, mask)
+        if exact:
+            return self._nodes(exact, [1.0] * len(exact))
+        chip = self._bm25.exact_chipset(question, self._final_top_k, mask)
+        if chip:
+            return self._nodes([i for i, _ in chip], [s for _, s in chip])
+
+        lexical = self._bm25.search(question, self._top_k, mask)
+        dense = self._vector.retrieve(query_bundle)
+        by_id = {n.node.node_id: n for n in dense}
+        lexical_nodes = self._nodes([i for i, _ in lexical], [s for _, s in lexical])
+        for n in lexical_nodes:
+            by_id.setdefault(n.node.node_id, n)
+
+        fused = rrf([[n.node.node_id for n in dense], [n.node.node_id for n in lexical_nodes]], k=self._rrf_k)
+        best = sorted(fused, key=fused.get, reverse=True)[: self._final_top_k]
+        return [NodeWithScore(node=by_id[i].node, score=fused[i]) for i in best]
@@ -0,0 +1,159 @@
+# app/index_builder.py
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Iterable, List
+
+import numpy as np
+from llama_index.core.schema import BaseNode
+
+from app.vector_store import NODES_FNAME, VECTORS_FNAME, _normalize, node_row
+
+# Construcción en curso (se borra al terminar): vectores en crudo, filas y huellas en JSONL
+BUILD_DIRNAME = ".building"
+STATE_FNAME = "state.json"
+RAW_VECTORS_FNAME = "vectors.raw"
+ROWS_FNAME = "vector_nodes.jsonl"
+HASHES_FNAME = "fingerprints.jsonl"
+# Tamaño de bloque al pasar vectors.raw a vectors.npy
+COPY_BYTES = 1 << 20
+
+
+def _append(path: Path, data: bytes) -> int:
+    # Añade y fuerza a disco antes de dar el lote por confirmado
+    with open(path, "ab") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+        return f.tell()
+
+
+def _truncate(path: Path, size: int) -> None:
+    # Descarta lo escrito tras el último lote confirmado (build interrumpido a medias)
+    with open(path, "ab") as f:
+        f.truncate(size)
+
+
+def _jsonl(items: Iterable) -> bytes:
+    return "".join(json.dumps(x, ensure_ascii=False) + "\n" for x in items).encode("utf-8")
+
+
+class StreamingIndexWriter:
+    """
+    Escribe el índice vectorial lote a lote en index_store/.building/ sin tenerlo entero
+    en memoria. Tras cada lote, state.json guarda cuántas filas y bytes están confirmados
+    y la última clave leída: si el proceso se corta, el siguiente build recorta lo que
+    quedó a medias y sigue desde esa clave. finalize() genera vectors.npy y
+    vector_nodes.json (el formato de NumpyVectorStore) y borra .building/.
+    """
+
+    def __init__(self, persist_dir, embed_model: str, dtype: str = "float32", restart: bool = False):
+        self.persist_dir = Path(persist_dir)
+        self.dir = self.persist_dir / BUILD_DIRNAME
+        state = self._read_state()
+        fresh = {"embed_model": embed_model, "dtype": dtype, "dim": None, "rows": 0, "last_key": "", "sizes": {}}
+        if restart or not state or state.get("embed_model") != embed_model or state.get("dtype") != dtype:
+            shutil.rmtree(self.dir, ignore_errors=True)
+            state = fresh
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.state = state
+        for fname in (RAW_VECTORS_FNAME, ROWS_FNAME, HASHES_FNAME):
+            _truncate(self.dir / fname, state["sizes"].get(fname, 0))
+
+    @classmethod
+    def pending(cls, persist_dir) -> bool:
+        """
+        True si hay un build en streaming interrumpido que se puede reanudar.
+        """
+        return (Path(persist_dir) / BUILD_DIRNAME / STATE_FNAME).exists()
+
+    def _read_state(self) -> dict:
+        try:
+            return json.loads((self.dir / STATE_FNAME).read_text(encoding="utf-8"))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write_state(self) -> None:
+        tmp = self.dir / (STATE_FNAME + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        tmp.replace(self.dir / STATE_FNAME)
+
+    @property
+    def rows(self) -> int:
+        return self.state["rows"]
+
+    @property
+    def last_key(self) -> str:
+        return self.state["last_key"]
+
+    def append(self, nodes: List[BaseNode], hashes: dict, last_key: str) -> None:
+        """
+        Confirma un lote: nodos ya con embedding, sus huellas {clave: row_hash} y la
+        clave del último registro leído (desde donde se reanuda).
+        """
+        if nodes:
+            vectors = _normalize(np.asarray([n.get_embedding() for n in nodes], dtype=np.float32))
+            dim = self.state["dim"] or vectors.shape[1]
+            if vectors.shape[1] != dim:
+                raise ValueError(f"Dimensión de embedding {vectors.shape[1]}, se esperaba {dim}")
+            self.state["dim"] = dim
+            sizes = self.state["sizes"]
+            sizes[RAW_VECTORS_FNAME] = _append(
+                self.dir / RAW_VECTORS_FNAME, np.ascontiguousarray(vectors.astype(self.state["dtype"])).tobytes()
+            )
+            sizes[ROWS_FNAME] = _append(self.dir / ROWS_FNAME, _jsonl(node_row(n) for n in nodes))
+            self.state["rows"] += len(nodes)
+        self.state["sizes"][HASHES_FNAME] = _append(self.dir / HASHES_FNAME, _jsonl(hashes.items()))
+        self.state["last_key"] = last_key
+        self._write_state()
+
+    def finalize(self) -> dict:
+        """
+        Publica el índice en persist_dir y devuelve las huellas {clave: row_hash}.
+        """
+        n, dim, dtype = self.state["rows"], self.state["dim"] or 0, self.state["dtype"]
+        # Cabecera .npy + los bytes en crudo tal cual, por bloques (sin mmap ni copia en memoria)
+        header = {"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False, "shape": (n, dim)}
+        tmp = self.persist_dir / (VECTORS_FNAME + ".tmp")
+        with open(tmp, "wb") as out, open(self.dir / RAW_VECTORS_FNAME, "rb") as raw:
+            np.lib.format.write_array_header_1_0(out, header)
+            shutil.copyfileobj(raw, out, COPY_BYTES)
+        tmp.replace(self.persist_dir / VECTORS_FNAME)
+
+        # JSONL -> lista JSON, línea a línea
+        tmp = self.persist_dir / (NODES_FNAME + ".tmp")
+        with open(self.dir / ROWS_FNAME, encoding="utf-8") as src, open(tmp, "w", encoding="utf-8") as dst:
+            dst.write("[")
+            for i, line in enumerate(src):
+                dst.write(("," if i else "") + line.rstrip("\n"))
+            dst.write("]")
+        tmp.replace(self.persist_dir / NODES_FNAME)
+
+        hashes = {}
+        with open(self.dir / HASHES_FNAME, encoding="utf-8") as f:
+            for line in f:
+                key, row_hash = json.loads(line)
+                hashes[key] = row_hash
+        shutil.rmtree(self.dir)
+        return hashes
+
+
+def build_streaming(pages, writer: StreamingIndexWriter, to_nodes, progress=None) -> dict:
+    """
+    pages: iterable de listas de (Document, row_hash) en orden de clave (Document.id_).
+    to_nodes(docs) trocea y calcula embeddings de una página. Cada página es un lote
+    confirmado; en memoria solo vive la página en curso.
+    """
+    for page in pages:
+        if not page:
+            continue
+        docs = [doc for doc, _ in page]
+        nodes = to_nodes(docs)
+        writer.append(nodes, {doc.id_: row_hash for doc, row_hash in page}, last_key=docs[-1].id_)
+        if progress:
+            progress(writer.rows)
+    return writer.finalize()
@@ -0,0 +1,222 @@
+# app/ingest_utils.py
+import math
+
+import numpy as np
+import pandas as pd
+
+# (etiqueta en el texto, clave de la fila, formato "str" | "num" | "lower") en el orden de build_text()
+TEXT_FIELDS = [
+    ("Model", "model", "str"),
+    ("Price_EUR", "price", "num"),
+    ("Rating", "rating", "num"),
+    ("OS", "os", "str"),
+    ("Network", "network_type", "str"),
+    ("NFC", "nfc", "lower"),
+    ("VoLTE", "volte", "lower"),
+    ("IRBlaster", "ir_blaster", "lower"),
+    ("Chipset", "chipset", "str"),
+    ("RAM_GB", "ram_gb", "num"),
+    ("Storage_GB", "storage_gb", "num"),
+    ("Battery_mAh", "battery_mah", "num"),
+    ("Screen_in", "screen_size_in", "num"),
+    ("RefreshRate_Hz", "refresh_rate_hz", "num"),
+    ("DisplayType", "display_type", "str"),
+    ("RearCameras", "rear_camera_mp_list", "str"),
+    ("RearCameraCount", "rear_camera_count", "num"),
+    ("FrontCamera_MP", "front_camera_mp", "num"),
+    ("MemoryCardSupported", "memory_card_supported", "lower"),
+    ("MemoryCardType", "memory_card_type", "str"),
+]
+
+def to_bool(v) -> bool:
+    if isinstance(v, bool):
+        return v
+    if v is None or (isinstance(v, float) and math.isnan(v)):
+        return False
+    s = str(v).strip().lower()
+    return s in ("true", "1", "yes")
+
+def to_int(v):
+    if v is None or (isinstance(v, float) and math.isnan(v)):
+        return None
+    try:
+        return int(float(v))
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+def to_float(v):
+    if v is None or (isinstance(v, float) and math.isnan(v)):
+        return None
+    try:
+        return float(v)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+def build_text(row: dict) -> str:
+    # Formato estable tipo key=value (suele ir muy bien para retrieval)
+    return (
+        f"Model={row.get('model','')}; "
+        f"Price_EUR={row.get('price')}; "
+        f"Rating={row.get('rating')}; "
+        f"OS={row.get('os','')}; "
+        f"Network={row.get('network_type','')}; "
+        f"NFC={str(row.get('nfc')).lower()}; "
+        f"VoLTE={str(row.get('volte')).lower()}; "
+        f"IRBlaster={str(row.get('ir_blaster')).lower()}; "
+        f"Chipset={row.get('chipset','')}; "
+        f"RAM_GB={row.get('ram_gb')}; "
+        f"Storage_GB={row.get('storage_gb')}; "
+        f"Battery_mAh={row.get('battery_mah')}; "
+        f"Screen_in={row.get('screen_size_in')}; "
+        f"RefreshRate_Hz={row.get('refresh_rate_hz')}; "
+        f"DisplayType={row.get('display_type','')}; "
+        f"RearCameras={row.get('rear_camera_mp_list','')}; "
+        f"RearCameraCount={row.get('rear_camera_count')}; "
+        f"FrontCamera_MP={row.get('front_camera_mp')}; "
+        f"MemoryCardSupported={str(row.get('memory_card_supported')).lower()}; "
+        f"MemoryCardType={row.get('memory_card_type','')}"
+    )
+
+def parse_text(text: str) -> dict:
+    """
+    Inverso de build_text(): la fila (claves y tipos de normalize_frame) a partir del
+    texto key=value guardado en el índice.
+    """
+    values = dict(pair.partition("=")[::2] for pair in text.split("; "))
+    row = {}
+    for label, key, fmt in TEXT_FIELDS:
+        raw = values.get(label, "")
+        if fmt == "lower":
+            row[key] = raw == "true"
+        elif fmt == "num":
+            row[key] = None if raw in ("", "None") else (int(raw) if raw.isdigit() else float(raw))
+        else:
+            row[key] = raw
+    return row
+
+def normalize_rows_iter(df: pd.DataFrame, to_eur: float) -> list:
+    """
+    Normalización fila a fila con iterrows() (implementación original).
+    Se conserva como referencia para comparar con normalize_frame().
+    `to_eur`: euros por unidad de la moneda del CSV (la del catálogo).
+    """
+    rows = []
+    for _, r in df.iterrows():
+        model = r.get("model")
+        if pd.isna(model) or str(model).strip() == "":
+            continue
+
+        price_local = to_float(r.get("price"))
+        price_eur = round(price_local * to_eur, 2) if price_local is not None else None
+
+        row = {
+            "model": str(model).strip(),
+            "price": price_eur,
+            "rating": to_float(r.get("rating")),
+            "os": "" if pd.isna(r.get("os")) else str(r.get("os")).strip(),
+            "network_type": "" if pd.isna(r.get("network_type")) else str(r.get("network_type")).strip(),
+            "volte": to_bool(r.get("VoLTE")),
+            "nfc": to_bool(r.get("NFC")),
+            "ir_blaster": to_bool(r.get("ir_blaster")),
+            "chipset": "" if pd.isna(r.get("chipset")) else str(r.get("chipset")).strip(),
+            "ram_gb": to_float(r.get("ram_gb")),
+            "storage_gb": to_float(r.get("storage_gb")), 
+            "battery_mah": to_int(r.get("battery_mah")),
+            "screen_size_in": to_float(r.get("screen_size_in")),
+            "refresh_rate_hz": to_float(r.get("refresh_rate_hz")),
+            "display_type": "" if pd.isna(r.get("display_type")) else str(r.get("display_type")).strip(),
+            "rear_camera_mp_list": "" if pd.isna(r.get("rear_camera_mp_list")) else str(r.get("rear_camera_mp_list")).strip(),
+            "rear_camera_count": to_int(r.get("rear_camera_count")),
+            "front_camera_mp": to_float(r.get("front_camera_mp")),
+            "memory_card_supported": str(r.get("memory_card_supported", "")).strip() == "1",
+            "memory_card_type": "" if pd.isna(r.get("memory_card_type")) else str(r.get("memory_card_type")).strip(),
+        }
+        row["text"] = build_text(row)
+        rows.append(row)
+    return rows
+
+# --- versión columnar ---
+
+def _column(df: pd.DataFrame, name: str) -> pd.Series:
+    if name in df:
+        return df[name]
+    return pd.Series(np.nan, index=df.index, dtype=object)
+
+def _float_col(s: pd.Series) -> pd.Series:
+    v = pd.to_numeric(s, errors="coerce").astype("float64")
+    return v.astype(object).where(v.notna(), None)
+
+def _int_col(s: pd.Series) -> pd.Series:
+    v = pd.to_numeric(s, errors="coerce").astype("float64")
+    ok = np.isfinite(v)
+    ints = np.trunc(v.where(ok, 0)).astype("int64").astype(object)
+    return ints.where(ok, None)
+
+def _str_col(s: pd.Series) -> pd.Series:
+    text = s.astype(object).map(str).str.strip()
+    return text.where(s.notna(), "").astype(object)
+
+def _bool_col(s: pd.Series) -> pd.Series:
+    if s.dtype == bool:
+        return s.astype(object)
+    text = s.astype(object).map(str).str.strip().str.lower()
+    return (s.notna() & text.isin(["true", "1", "yes"])).astype(object)
+
+def build_text_column(frame: pd.DataFrame) -> pd.Series:
+    """
+    build_text() sobre columnas enteras: mismo resultado, carácter a carácter.
+    """
+    text = None
+    for i, (label, key, fmt) in enumerate(TEXT_FIELDS):
+        values = frame[key].map(str)
+        if fmt == "lower":
+            values = values.str.lower()
+        part = ("" if i == 0 else "; ") + label + "=" + values
+        text = part if text is None else text + part
+    return text.astype(object)
+
+def normalize_frame(df: pd.DataFrame, to_eur: float) -> list:
+    """
+    Igual que normalize_rows_iter() pero con operaciones por columna de pandas/NumPy.
+    Devuelve la misma lista de dicts (mismas claves, orden y tipos de Python).
+    """
+    model = _column(df, "model")
+    model_str = model.astype(object).map(str).str.strip()
+    keep = model.notna() & (model_str != "")
+    df = df[keep]
+
+    price_local = pd.to_numeric(_column(df, "price"), errors="coerce").astype("float64")
+    # round() de Python (redondeo decimal exacto): np.round puede diferir en el último céntimo
+    price_eur = pd.Series(
+        [round(p * to_eur, 2) if p == p else None for p in price_local.tolist()],
+        index=df.index,
+        dtype=object,
+    )
+
+    out = pd.DataFrame(index=df.index)
+    out["model"] = model_str[keep].astype(object)
+    out["price"] = price_eur
+    out["rating"] = _float_col(_column(df, "rating"))
+    out["os"] = _str_col(_column(df, "os"))
+    out["network_type"] = _str_col(_column(df, "network_type"))
+    out["volte"] = _bool_col(_column(df, "VoLTE"))
+    out["nfc"] = _bool_col(_column(df, "NFC"))
+    out["ir_blaster"] = _bool_col(_column(df, "ir_blaster"))
+    out["chipset"] = _str_col(_column(df, "chipset"))
+    out["ram_gb"] = _float_col(_column(df, "ram_gb"))
+    out["storage_gb"] = _float_col(_column(df, "storage_gb"))
+    out["battery_mah"] = _int_col(_column(df, "battery_mah"))
+    out["screen_size_in"] = _float_col(_column(df, "screen_size_in"))
+    out["refresh_rate_hz"] = _float_col(_column(df, "refresh_rate_hz"))
+    out["display_type"] = _str_col(_column(df, "display_type"))
+    out["rear_camera_mp_list"] = _str_col(_column(df, "rear_camera_mp_list"))
+    out["rear_camera_count"] = _int_col(_column(df, "rear_camera_count"))
+    out["front_camera_mp"] = _float_col(_column(df, "front_camera_mp"))
+    out["memory_card_supported"] = (
+        _column(df, "memory_card_supported").astype(object).map(str).str.strip() == "1"
+    ).astype(object)
+    out["memory_card_type"] = _str_col(_column(df, "memory_card_type"))
+    out["text"] = build_text_column(out)
+    # zip de listas en vez de to_dict("records"), que revisa el tipo de cada celda
+    keys = list(out.columns)
+    return [dict(zip(keys, values)) for values in zip(*(out[k].tolist() for k in keys))]
@@ -0,0 +1,108 @@
+# app/instrumentation.py
+import threading
+import time
+
+from llama_index.core.callbacks import CBEventType, EventPayload
+from llama_index.core.callbacks.base_handler import BaseCallbackHandler
+
+from app.metrics import LLM_TOKENS, current_timings, record_stage
+
+# Eventos de LlamaIndex que se miden, con el nombre de etapa de /metrics
+STAGES = {
+    CBEventType.EMBEDDING: "embedding",
+    CBEventType.RETRIEVE: "retrieve",
+    CBEventType.SYNTHESIZE: "synthesize",
+    CBEventType.TEMPLATING: "templating",
+    CBEventType.LLM: "llm",
+    CBEventType.QUERY: "query",
+}
+# Etapas que usan un modelo de Ollama (rol en ModelResidency)
+MODEL_ROLES = {"llm": "llm", "embedding": "embed"}
+# Desglose de la llamada al LLM que devuelve Ollama (ns): carga del modelo, prompt y generación
+OLLAMA_DURATIONS = {"load_duration": "llm_load", "prompt_eval_duration": "llm_prompt", "eval_duration": "llm_generate"}
+
+
+def _raw(payload) -> dict:
+    """
+    Último fragmento de la respuesta de Ollama (contadores de tokens y duraciones).
+    """
+    response = payload.get(EventPayload.COMPLETION) or payload.get(EventPayload.RESPONSE)
+    raw = getattr(response, "raw", None) or {}
+    return raw if isinstance(raw, dict) else dict(raw)
+
+
+def _token_counts(raw: dict) -> tuple:
+    """
+    (prompt, generados) según lo que devuelve Ollama en el último fragmento.
+    """
+    return raw.get("prompt_eval_count"), raw.get("eval_count")
+
+
+class StageTimingHandler(BaseCallbackHandler):
+    """
+    Mide embedding, retrieve, synthesize, llm... a partir de los eventos de LlamaIndex
+    y los vuelca en rag_stage_seconds y en el desglose de la petición en curso.
+    Los eventos anidados del mismo tipo (stream_complete -> stream_chat, un retriever
+    que envuelve a otro) solo cuentan una vez: el más externo. Con `residency`
+    (ModelResidency) avisa de cada uso del LLM y de los embeddings y separa la carga
+    del modelo del tiempo de generación.
+    """
+
+    def __init__(self, residency=None):
+        super().__init__(event_starts_to_ignore=[], event_ends_to_ignore=[])
+        self.residency = residency
+        self._lock = threading.Lock()
+        self._open = {}   # event_id -> (etapa, inicio, hilo, desglose de la petición)
+        self._depth = {}  # (hilo, etapa) -> eventos abiertos
+
+    def on_event_start(self, event_type, payload=None, event_id: str = "", parent_id: str = "", **kwargs) -> str:
+        stage = STAGES.get(event_type)
+        if stage is None:
+            return event_id
+        thread = threading.get_ident()
+        with self._lock:
+            depth = self._depth.get((thread, stage), 0)
+            self._depth[(thread, stage)] = depth + 1
+            if depth == 0:
+                self._open[event_id] = (stage, time.perf_counter(), thread, current_timings())
+            else:
+                self._open[event_id] = (stage, None, thread, None)
+        if depth == 0 and self.residency is not None and stage in MODEL_ROLES:
+            self.residency.acquire(MODEL_ROLES[stage])
+        return event_id
+
+    def on_event_end(self, event_type, payload=None, event_id: str = "", **kwargs) -> None:
+        with self._lock:
+            entry = self._open.pop(event_id, None)
+            if entry is None:
+                return
+            stage, started, thread, timings = entry
+            depth = self._depth.get((thread, stage), 1) - 1
+            if depth:
+                self._depth[(thread, stage)] = depth
+            else:
+                self._depth.pop((thread, stage), None)
+        if started is None:
+            return
+        record_stage(stage, time.perf_counter() - started, timings)
+        if self.residency is not None and stage in MODEL_ROLES:
+            self.residency.release(MODEL_ROLES[stage])
+        if stage == "llm" and payload:
+            raw = _raw(payload)
+            for field, name in OLLAMA_DURATIONS.items():
+                if raw.get(field) is not None:
+                    record_stage(name, raw[field] / 1e9, timings)
+            if self.residency is not None and raw.get("load_duration") is not None:
+                self.residency.observe_load("llm", raw["load_duration"] / 1e9)
+            tokens_in, tokens_out = _token_counts(raw)
+            for direction, n in (("in", tokens_in), ("out", tokens_out)):
+                if n:
+                    LLM_TOKENS.inc(n, direction=direction)
+                    if timings is not None:
+                        timings.add_tokens(direction, n)
+
+    def start_trace(self, trace_id=None) -> None:
+        pass
+
+    def end_trace(self, trace_id=None, trace_map=None) -> None:
+        pass
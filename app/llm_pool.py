@@ -0,0 +1,185 @@
+# app/llm_pool.py
+import contextvars
+import queue
+import threading
+import time
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+
+class QueueFullError(Exception):
+    """La cola de generación está llena (el servidor responde 429)."""
+
+
+class QueueTimeoutError(Exception):
+    """La petición esperó demasiado a un hueco libre (el servidor responde 503)."""
+
+
+class GenerationTimeout(Exception):
+    """La generación superó el tiempo máximo por petición (el servidor responde 504)."""
+
+
+class Lease:
+    """
+    Hueco de generación concedido por GenerationPool. release() es idempotente.
+    """
+
+    def __init__(self, pool: "GenerationPool"):
+        self._pool = pool
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._pool._release()
+
+
+class GenerationPool:
+    """
+    Limita las llamadas simultáneas al LLM: `concurrency` en ejecución, como mucho
+    `max_queue` esperando y el resto se rechaza en el acto (control de admisión).
+    El trabajo en segundo plano (run_background, modo lote) no ocupa la cola: solo entra
+    cuando hay un hueco libre y ninguna petición interactiva esperando.
+    """
+
+    def __init__(self, concurrency: int, max_queue: int, queue_timeout: float, request_timeout: float):
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.request_timeout = request_timeout
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._background_waiting = 0
+        self._rejected = 0
+        self._timeouts = 0
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="llm")
+
+    def acquire(self) -> Lease:
+        with self._cond:
+            if self._active >= self.concurrency and self._waiting >= self.max_queue:
+                self._rejected += 1
+                raise QueueFullError("Cola de generación llena")
+            self._waiting += 1
+            try:
+                ok = self._cond.wait_for(lambda: self._active < self.concurrency, timeout=self.queue_timeout)
+            finally:
+                self._waiting -= 1
+            if not ok:
+                self._rejected += 1
+                raise QueueTimeoutError("Tiempo de espera en cola agotado")
+            self._active += 1
+        return Lease(self)
+
+    def acquire_background(self, cancelled: Optional[threading.Event] = None) -> Optional[Lease]:
+        """
+        Hueco para trabajo en segundo plano: espera sin límite (no cuenta para max_queue ni
+        para queue_timeout) hasta que haya hueco y no espere ninguna petición interactiva.
+        None si `cancelled` se activa antes.
+        """
+        with self._cond:
+            self._background_waiting += 1
+            try:
+                while not (self._active < self.concurrency and self._waiting == 0):
+                    if cancelled is not None and cancelled.is_set():
+                        return None
+                    self._cond.wait(timeout=0.5)
+            finally:
+                self._background_waiting -= 1
+            self._active += 1
+        return Lease(self)
+
+    def _release(self) -> None:
+        with self._cond:
+            self._active -= 1
+            # Interactivas y de segundo plano esperan condiciones distintas: se despiertan todas
+            self._cond.notify_all()
+
+    def run(self, fn, *args, **kwargs):
+        """
+        Ejecuta fn en el pool y espera como mucho request_timeout segundos.
+        El hueco no se libera hasta que fn termina de verdad, aunque la petición
+        ya haya devuelto 504: así nunca hay más de `concurrency` generaciones en Ollama.
+        fn hereda el contexto de la petición (desglose de tiempos de app/metrics.py).
+        """
+        return self._run(self.acquire(), fn, *args, **kwargs)
+
+    def run_background(self, fn, cancelled: Optional[threading.Event] = None):
+        """
+        Como run() pero con prioridad baja (acquire_background). Devuelve None sin ejecutar
+        fn si `cancelled` se activa mientras espera hueco.
+        """
+        lease = self.acquire_background(cancelled)
+        if lease is None:
+            return None
+        return self._run(lease, fn)
+
+    def _run(self, lease: Lease, fn, *args, **kwargs):
+        future = self._executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+        future.add_done_callback(lambda _: lease.release())
+        try:
+            return future.result(timeout=self.request_timeout)
+        except FutureTimeout:
+            with self._cond:
+                self._timeouts += 1
+            raise GenerationTimeout(f"Generación > {self.request_timeout:.0f}s")
+
+    def stream(self, lease: Lease, fn, *args, **kwargs):
+        """
+        Generador que recorre los tokens de fn() con un hueco ya concedido. fn() se recorre
+        en un hilo del pool que deja los tokens en una cola, así que request_timeout cuenta
+        también mientras se espera el primero (recuperación, carga del modelo...). Si se
+        agota el plazo, falla o el cliente se desconecta, ese hilo deja de leer fn() y, como
+        en run(), el hueco se libera cuando fn() termina de verdad.
+        """
+        items = queue.Queue()
+        stop = threading.Event()
+
+        def read():
+            try:
+                gen = fn(*args, **kwargs)
+                try:
+                    for item in gen:
+                        if stop.is_set():
+                            break
+                        items.put(("item", item))
+                finally:
+                    close = getattr(gen, "close", None)
+                    if close is not None:
+                        close()
+                items.put(("done", None))
+            except Exception as e:
+                items.put(("error", e))
+            finally:
+                lease.release()
+
+        self._executor.submit(contextvars.copy_context().run, read)
+        deadline = time.monotonic() + self.request_timeout
+        try:
+            while True:
+                try:
+                    kind, value = items.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    with self._cond:
+                        self._timeouts += 1
+                    raise GenerationTimeout(f"Generación > {self.request_timeout:.0f}s") from None
+                if kind == "done":
+                    return
+                if kind == "error":
+                    raise value
+                yield value
+        finally:
+            stop.set()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "concurrency": self.concurrency,
+                "max_queue": self.max_queue,
+                "active": self._active,
+                "queued": self._waiting,
+                "background_queued": self._background_waiting,
+                "rejected": self._rejected,
+                "timeouts": self._timeouts,
+            }
@@ -0,0 +1,261 @@
+# app/metrics.py
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Segundos: de operaciones de milisegundos (embeddings, retrieval) a generaciones largas
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+    pairs = ",".join(f'{n}="{escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _fmt(value) -> str:
+    return f"{value:.6g}" if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {_fmt(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total, n = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, n + 1)
+
+    def totals(self) -> dict:
+        """
+        {valores de etiquetas: (nº de observaciones, suma)}.
+        """
+        with self._lock:
+            return {k: (n, total) for k, (_, total, n) in self._values.items()}
+
+    def render(self) -> list:
+        with self._lock:
+            items = sorted((k, (list(c), t, n)) for k, (c, t, n) in self._values.items())
+        lines = self.header()
+        names = self.labelnames + ("le",)
+        for key, (counts, total, n) in items:
+            for bound, c in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_labels(names, key + (_fmt(float(bound)),))} {c}")
+            lines.append(f"{self.name}_bucket{_labels(names, key + ('+Inf',))} {n}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_fmt(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {n}")
+        return lines
+
+
+class Registry:
+    """
+    Métricas del proceso en formato de texto de Prometheus. Los collectors son
+    funciones que devuelven líneas ya formateadas con valores leídos en el momento
+    del scrape (estado de la cola del LLM, cachés...).
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames=()) -> Counter:
+        return self._add(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames=()) -> Gauge:
+        return self._add(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help_text, labelnames, buckets))
+
+    def register_collector(self, fn) -> None:
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        for fn in self._collectors:
+            try:
+                lines += fn()
+            except Exception as e:
+                lines.append(f"# collector {getattr(fn, '__name__', fn)} falló: {e}")
+        return "\n".join(lines) + "\n"
+
+
+def sample(name: str, kind: str, help_text: str, values: dict, labelname: str = "") -> list:
+    """
+    Líneas de una métrica calculada al vuelo: values = {valor de etiqueta | "": número}.
+    """
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for label, value in values.items():
+        labels = _labels((labelname,), (label,)) if labelname else ""
+        lines.append(f"{name}{labels} {_fmt(value)}")
+    return lines
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram(
+    "rag_stage_seconds", "Duración por etapa (embedding, retrieve, synthesize, llm, load_index...)", ["stage"]
+)
+HTTP_REQUESTS = REGISTRY.counter("rag_http_requests_total", "Peticiones HTTP por endpoint y código", ["endpoint", "status"])
+HTTP_SECONDS = REGISTRY.histogram("rag_http_request_seconds", "Duración de las peticiones HTTP", ["endpoint"])
+TTFT_SECONDS = REGISTRY.histogram("rag_ttft_seconds", "Tiempo hasta el primer token en /api/chat/stream")
+DIRECT_REPLIES = REGISTRY.counter(
+    "rag_direct_answers_total", "Respuestas servidas desde la tabla de especificaciones, sin LLM", ["intent"]
+)
+LLM_TOKENS = REGISTRY.counter("rag_llm_tokens_total", "Tokens del LLM (in = prompt, out = generados)", ["direction"])
+CONTEXT_TOKENS = REGISTRY.histogram(
+    "rag_context_tokens", "Tokens de contexto por consulta (raw = fichas recuperadas, packed = tabla compacta)",
+    ["stage"], buckets=(64, 128, 256, 512, 768, 1024, 1536, 2048, 4096),
+)
+CONTEXT_TOKENS_SAVED = REGISTRY.counter("rag_context_tokens_saved_total", "Tokens de contexto ahorrados al empaquetar")
+MODEL_COLD_LOADS = REGISTRY.counter(
+    "rag_model_cold_loads_total", "Peticiones que pagaron la carga del modelo en Ollama (llm, embed)", ["role"]
+)
+MODEL_UNLOADS = REGISTRY.counter("rag_model_unloads_total", "Descargas de modelos por motivo", ["role", "reason"])
+INDEX_SWAPS = REGISTRY.counter(
+    "rag_index_swaps_total", "Cargas de una instantánea del índice en el servidor por catálogo (ok, error)",
+    ["catalog", "result"],
+)
+CATALOG_EVICTIONS = REGISTRY.counter(
+    "rag_catalog_evictions_total", "Índices de catálogo descargados por falta de memoria (CATALOG_MEMORY_MB)", ["catalog"]
+)
+BATCH_QUESTIONS = REGISTRY.counter(
+    "rag_batch_questions_total", "Preguntas respondidas en modo lote por origen (rag, direct, cache, error...)", ["source"]
+)
+
+
+class RequestTimings:
+    """
+    Desglose de tiempos de una petición: ms acumulados por etapa.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.tokens = {}
+        self.context = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds * 1000
+
+    def add_tokens(self, direction: str, n: int) -> None:
+        with self._lock:
+            self.tokens[direction] = self.tokens.get(direction, 0) + n
+
+    def set_context(self, **stats) -> None:
+        """
+        Presupuesto y tokens del contexto enviado al LLM (ContextPacker).
+        """
+        with self._lock:
+            self.context = stats
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            out = {"stages_ms": {k: round(v, 1) for k, v in self.stages.items()}}
+            if self.tokens:
+                out["tokens"] = dict(self.tokens)
+            if self.context:
+                out["context"] = dict(self.context)
+            return out
+
+
+_current = ContextVar("request_timings", default=None)
+
+
+def current_timings():
+    return _current.get()
+
+
+@contextmanager
+def track_request():
+    """
+    Activa el desglose de tiempos para todo lo que se ejecute dentro (y en los hilos
+    lanzados con contextvars.copy_context(), como GenerationPool.run).
+    """
+    timings = RequestTimings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+def record_stage(stage: str, seconds: float, timings=None) -> None:
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = timings or current_timings()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+@contextmanager
+def timed(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+
+def stage_report() -> str:
+    """
+    Resumen legible de STAGE_SECONDS (para los scripts de ingesta).
+    """
+    lines = ["Tiempos por etapa:"]
+    for (stage,), (n, total) in sorted(STAGE_SECONDS.totals().items(), key=lambda kv: -kv[1][1]):
+        lines.append(f"  {stage}: {total:.2f}s ({n} llamadas)")
+    return "\n".join(lines)
@@ -1,18 +1,197 @@
 # app/neo4j_utils.py
-from neo4j import GraphDatabase
-from app.config import NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD
+import asyncio
+import atexit
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from neo4j import READ_ACCESS, AsyncGraphDatabase, GraphDatabase, Query, RoutingControl
+from app.config import (
+    NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD, NEO4J_DATABASE, NEO4J_POOL_SIZE, NEO4J_CONNECTION_TIMEOUT,
+    NEO4J_ACQUIRE_TIMEOUT, NEO4J_QUERY_TIMEOUT, NEO4J_MAX_RETRY_TIME, NEO4J_FETCH_SIZE,
+)
+
+_SHARED = None
+_SHARED_LOCK = threading.Lock()
+# Un driver asíncrono por event loop: sus conexiones no se pueden usar desde otro loop
+_ASYNC = weakref.WeakKeyDictionary()
+
+
+def _driver_config() -> dict:
+    return {
+        "auth": (NEO4J_USER, NEO4J_PASSWORD),
+        "max_connection_pool_size": NEO4J_POOL_SIZE,
+        "connection_timeout": NEO4J_CONNECTION_TIMEOUT,
+        "connection_acquisition_timeout": NEO4J_ACQUIRE_TIMEOUT,
+        "max_transaction_retry_time": NEO4J_MAX_RETRY_TIME,
+        "fetch_size": NEO4J_FETCH_SIZE,
+    }
 
 def get_driver():
-    return GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+    """
+    Driver propio (los scripts lo crean y lo cierran). En el servidor, shared_driver().
+    """
+    return GraphDatabase.driver(NEO4J_URI, **_driver_config())
+
+def shared_driver():
+    """
+    Driver único para todo el proceso: el pool de conexiones (NEO4J_POOL_SIZE) se
+    reutiliza entre peticiones e hilos en vez de abrir una conexión por consulta.
+    """
+    global _SHARED
+    if _SHARED is None:
+        with _SHARED_LOCK:
+            if _SHARED is None:
+                _SHARED = get_driver()
+    return _SHARED
+
+def close_shared_driver() -> None:
+    global _SHARED
+    with _SHARED_LOCK:
+        driver, _SHARED = _SHARED, None
+    if driver is not None:
+        driver.close()
+
+atexit.register(close_shared_driver)
 
-def run_cypher(driver, query: str, params: dict | None = None):
-    with driver.session() as session:
-        return session.run(query, params or {}).consume()
+def _query(query: str) -> Query:
+    return Query(query, timeout=NEO4J_QUERY_TIMEOUT or None)
 
-def run_cypher_many(driver, multi_query: str):
+def run_cypher(driver, query: str, params: dict | None = None, database: str | None = None):
+    """
+    Una sentencia en su propia transacción gestionada (con reintentos); devuelve el resumen.
+    `database` (todas las funciones): base de datos del catálogo; por defecto NEO4J_DATABASE.
+    """
+    return driver.execute_query(_query(query), params or {}, database_=database or NEO4J_DATABASE).summary
+
+def run_cypher_many(driver, multi_query: str, database: str | None = None):
     """
     Ejecuta varias sentencias separadas por ';' (ignorando vacías).
     """
     statements = [q.strip() for q in multi_query.split(";") if q.strip()]
     for q in statements:
-        run_cypher(driver, q)
\ No newline at end of file
+        run_cypher(driver, q, database=database)
+
+def read_query(query: str, params: dict | None = None, driver=None, retry: bool = True, database: str | None = None) -> list:
+    """
+    Lectura corta (búsquedas puntuales): transacción de lectura gestionada, con reintentos
+    ante errores transitorios durante NEO4J_MAX_RETRY_TIME. Con retry=False, un único
+    intento: para peticiones web que tienen alternativa si el grafo no responde.
+    Devuelve [dict] ya materializado.
+    """
+    driver = driver or shared_driver()
+    if not retry:
+        return list(stream(query, params, driver=driver, database=database))
+    records, _, _ = driver.execute_query(
+        _query(query), params or {}, routing_=RoutingControl.READ, database_=database or NEO4J_DATABASE
+    )
+    return [r.data() for r in records]
+
+def stream(query: str, params: dict | None = None, driver=None, fetch_size: int = NEO4J_FETCH_SIZE,
+           database: str | None = None):
+    """
+    Recorre el resultado registro a registro (dicts) a medida que llega del servidor,
+    en lotes de fetch_size, sin cargarlo entero en memoria. Sin reintentos: si la
+    conexión cae a mitad, el error llega al consumidor.
+    """
+    driver = driver or shared_driver()
+    with driver.session(database=database or NEO4J_DATABASE, default_access_mode=READ_ACCESS, fetch_size=fetch_size) as s:
+        for record in s.run(_query(query), params or {}):
+            yield record.data()
+
+def read_pages(query: str, page_size: int, after="", key: str = "key", params: dict | None = None, driver=None,
+               database: str | None = None):
+    """
+    Paginación por clave (keyset): query filtra por `> $after`, ordena por la clave y
+    acaba en LIMIT $limit. Cada página es una lectura corta con reintentos, así que una
+    caída a mitad solo repite esa página, y se puede reanudar desde cualquier clave.
+    """
+    while True:
+        page = read_query(query, {**(params or {}), "after": after, "limit": page_size}, driver=driver, database=database)
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        after = page[-1][key]
+
+def read(work, *args, driver=None, database=None, **kwargs):
+    """
+    work(tx, *args, **kwargs) en una transacción de lectura con reintentos.
+    """
+    driver = driver or shared_driver()
+    with driver.session(database=database or NEO4J_DATABASE) as s:
+        return s.execute_read(work, *args, **kwargs)
+
+def write(work, *args, driver=None, database=None, **kwargs):
+    """
+    work(tx, *args, **kwargs) en una transacción de escritura con reintentos.
+    """
+    driver = driver or shared_driver()
+    with driver.session(database=database or NEO4J_DATABASE) as s:
+        return s.execute_write(work, *args, **kwargs)
+
+def write_batches(driver, work, batches: list, workers: int = 1, progress=None, database: str | None = None) -> None:
+    """
+    Ejecuta work(tx, batch) para cada lote en su propia transacción de escritura
+    (session.execute_write reintenta solo ante errores transitorios, p. ej. deadlocks).
+    Cada hilo reutiliza una única sesión para todos sus lotes.
+    """
+    workers = max(1, min(workers, len(batches)))
+
+    def worker(own):
+        with driver.session(database=database or NEO4J_DATABASE) as session:
+            for batch in own:
+                session.execute_write(work, batch)
+                if progress:
+                    progress(len(batch))
+
+    if workers == 1:
+        worker(batches)
+        return
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="neo4j") as pool:
+        # Reparto round-robin: los lotes de cada hilo quedan intercalados por igual
+        futures = [pool.submit(worker, batches[i::workers]) for i in range(workers)]
+        for f in futures:
+            f.result()
+
+# --- versión asíncrona (asyncio) ---
+
+def shared_async_driver():
+    """
+    Driver asíncrono compartido dentro del event loop en curso.
+    """
+    loop = asyncio.get_running_loop()
+    driver = _ASYNC.get(loop)
+    if driver is None:
+        driver = _ASYNC[loop] = AsyncGraphDatabase.driver(NEO4J_URI, **_driver_config())
+    return driver
+
+async def close_async_driver() -> None:
+    driver = _ASYNC.pop(asyncio.get_running_loop(), None)
+    if driver is not None:
+        await driver.close()
+
+async def aread_query(query: str, params: dict | None = None, driver=None, database: str | None = None) -> list:
+    driver = driver or shared_async_driver()
+    records, _, _ = await driver.execute_query(
+        _query(query), params or {}, routing_=RoutingControl.READ, database_=database or NEO4J_DATABASE
+    )
+    return [r.data() for r in records]
+
+async def astream(query: str, params: dict | None = None, driver=None, fetch_size: int = NEO4J_FETCH_SIZE,
+                  database: str | None = None):
+    driver = driver or shared_async_driver()
+    async with driver.session(database=database or NEO4J_DATABASE, default_access_mode=READ_ACCESS, fetch_size=fetch_size) as s:
+        result = await s.run(_query(query), params or {})
+        async for record in result:
+            yield record.data()
+
+async def aread(work, *args, driver=None, database=None, **kwargs):
+    driver = driver or shared_async_driver()
+    async with driver.session(database=database or NEO4J_DATABASE) as s:
+        return await s.execute_read(work, *args, **kwargs)
+
+async def awrite(work, *args, driver=None, database=None, **kwargs):
+    driver = driver or shared_async_driver()
+    async with driver.session(database=database or NEO4J_DATABASE) as s:
+        return await s.execute_write(work, *args, **kwargs)
@@ -0,0 +1,153 @@
+# app/quantization.py
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+# Códigos int8 (una fila por vector) + escala por dimensión, junto a vectors.npy
+CODES_FNAME = "vectors.int8.npy"
+SCALE_FNAME = "vectors.scale.npy"
+# Filas por bloque al cuantizar (acota la memoria temporal en float32) y al puntuar
+# (bloques pequeños: la conversión a float32 se queda en caché y va tan rápido como float32)
+BLOCK_ROWS = 8192
+SCORE_BLOCK_ROWS = 512
+
+
+def column_scale(vectors: np.ndarray) -> np.ndarray:
+    """
+    Escala por dimensión: máximo absoluto de la columna / 127 (recorrido por bloques).
+    """
+    dim = vectors.shape[1] if vectors.ndim == 2 else 0
+    peak = np.zeros(dim, dtype=np.float32)
+    for i in range(0, len(vectors), BLOCK_ROWS):
+        peak = np.maximum(peak, np.abs(np.asarray(vectors[i:i + BLOCK_ROWS], dtype=np.float32)).max(axis=0))
+    return np.where(peak > 0, peak / 127.0, 1.0).astype(np.float32)
+
+
+def block_dot(matrix: np.ndarray, q: np.ndarray) -> np.ndarray:
+    """
+    matrix @ q en float32 para matrices int8 o float16 (NumPy no tiene BLAS para
+    ellas): cada bloque de SCORE_BLOCK_ROWS filas se convierte a float32 y se multiplica.
+    """
+    out = np.empty(len(matrix), dtype=np.float32)
+    for i in range(0, len(matrix), SCORE_BLOCK_ROWS):
+        out[i:i + SCORE_BLOCK_ROWS] = matrix[i:i + SCORE_BLOCK_ROWS].astype(np.float32) @ q
+    return out
+
+
+def block_matmul(matrix: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """
+    Lo mismo que block_dot para varias consultas a la vez: (len(queries), len(matrix)).
+    Cada bloque de la matriz se convierte una sola vez para todo el lote.
+    """
+    out = np.empty((len(queries), len(matrix)), dtype=np.float32)
+    for i in range(0, len(matrix), SCORE_BLOCK_ROWS):
+        out[:, i:i + SCORE_BLOCK_ROWS] = queries @ matrix[i:i + SCORE_BLOCK_ROWS].astype(np.float32).T
+    return out
+
+
+def _quantize(block: np.ndarray, scale: np.ndarray) -> np.ndarray:
+    return np.clip(np.rint(np.asarray(block, dtype=np.float32) / scale), -127, 127).astype(np.int8)
+
+
+class Int8Codes:
+    """
+    Cuantización escalar int8 de la matriz de embeddings: x ≈ codes * scale, con una
+    escala por dimensión (el máximo absoluto de esa dimensión en el catálogo / 127).
+    Ocupa la cuarta parte que float32; las puntuaciones son aproximadas y se reordenan
+    después con los vectores exactos de los mejores candidatos.
+    """
+
+    def __init__(self, codes: np.ndarray, scale: np.ndarray):
+        self.codes = codes
+        self.scale = scale.astype(np.float32)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.scale.nbytes
+
+    @classmethod
+    def from_vectors(cls, vectors: np.ndarray, scale: Optional[np.ndarray] = None) -> "Int8Codes":
+        """
+        Cuantiza por bloques (vectors puede ser un mmap: no se copia entero en memoria).
+        Con `scale` se reutiliza la de un índice existente (los valores fuera de rango se recortan).
+        """
+        scale = column_scale(vectors) if scale is None else scale
+        codes = np.empty(vectors.shape if vectors.ndim == 2 else (0, 0), dtype=np.int8)
+        for i in range(0, len(codes), BLOCK_ROWS):
+            codes[i:i + BLOCK_ROWS] = _quantize(vectors[i:i + BLOCK_ROWS], scale)
+        return cls(codes, scale)
+
+    @classmethod
+    def write(cls, vectors: np.ndarray, persist_dir) -> None:
+        """
+        Lo mismo que from_vectors(vectors).persist(persist_dir), pero escribiendo los
+        códigos bloque a bloque: memoria constante aunque la matriz no quepa en RAM.
+        """
+        persist_dir = Path(persist_dir)
+        scale = column_scale(vectors)
+        # Temporal + rename, como persist(): el fichero puede ser un enlace duro a una instantánea publicada
+        tmp = persist_dir / (SCALE_FNAME + ".tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, scale)
+        tmp.replace(persist_dir / SCALE_FNAME)
+        n, dim = vectors.shape if vectors.ndim == 2 else (0, 0)
+        header = {"descr": np.lib.format.dtype_to_descr(np.dtype(np.int8)), "fortran_order": False, "shape": (n, dim)}
+        tmp = persist_dir / (CODES_FNAME + ".tmp")
+        with open(tmp, "wb") as f:
+            np.lib.format.write_array_header_1_0(f, header)
+            for i in range(0, n, BLOCK_ROWS):
+                f.write(_quantize(vectors[i:i + BLOCK_ROWS], scale).tobytes())
+        tmp.replace(persist_dir / CODES_FNAME)
+
+    @classmethod
+    def exists(cls, persist_dir, vectors_path: Path) -> bool:
+        """
+        True si hay códigos guardados y no son más antiguos que vectors.npy.
+        """
+        codes = Path(persist_dir) / CODES_FNAME
+        return (
+            codes.exists() and (Path(persist_dir) / SCALE_FNAME).exists()
+            and codes.stat().st_mtime_ns >= vectors_path.stat().st_mtime_ns
+        )
+
+    @classmethod
+    def load(cls, persist_dir, mmap: bool = True) -> "Int8Codes":
+        persist_dir = Path(persist_dir)
+        return cls(
+            np.load(persist_dir / CODES_FNAME, mmap_mode="r" if mmap else None),
+            np.load(persist_dir / SCALE_FNAME),
+        )
+
+    def persist(self, persist_dir) -> None:
+        persist_dir = Path(persist_dir)
+        for fname, array in ((SCALE_FNAME, self.scale), (CODES_FNAME, self.codes)):
+            tmp = persist_dir / (fname + ".tmp")
+            with open(tmp, "wb") as f:
+                np.save(f, np.ascontiguousarray(array))
+            tmp.replace(persist_dir / fname)
+
+    def add(self, vectors: np.ndarray) -> "Int8Codes":
+        new = Int8Codes.from_vectors(vectors, scale=self.scale)
+        codes = np.concatenate([self.codes, new.codes]) if len(self.codes) else new.codes
+        return Int8Codes(codes, self.scale)
+
+    def take(self, keep: np.ndarray) -> "Int8Codes":
+        return Int8Codes(self.codes[keep], self.scale)
+
+    def scores(self, q: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Producto escalar aproximado de q con cada fila (o con `rows`): (codes * scale) @ q
+        = codes @ (scale * q).
+        """
+        codes = self.codes if rows is None else self.codes[rows]
+        return block_dot(codes, (q * self.scale).astype(np.float32))
+
+    def scores_many(self, queries: np.ndarray) -> np.ndarray:
+        """
+        scores() de varias consultas sobre todas las filas: (len(queries), len(codes)).
+        """
+        return block_matmul(self.codes, (queries * self.scale).astype(np.float32))
@@ -0,0 +1,240 @@
+# app/query_planner.py
+import re
+import unicodedata
+from typing import List, Optional
+
+from llama_index.core import Settings
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+from llama_index.core.vector_stores.types import FilterOperator, MetadataFilter, MetadataFilters
+
+from app.metrics import timed
+from app.neo4j_utils import read_query
+
+# build_prompt() antepone el system prompt; la planificación solo mira la pregunta
+QUESTION_MARKER = "Pregunta del usuario:"
+
+NUM = r"(\d+(?:[.,]\d+)*)"
+UPPER = r"(?:menos de|por debajo de|hasta|maximo|como mucho|no mas de|inferior a|under|below|less than|up to|max|<=?)"
+LOWER = r"(?:mas de|al menos|minimo|como minimo|desde|superior a|over|above|at least|more than|min|>=?)"
+
+# campo -> (patrón de la unidad tras el número, patrón de la unidad delante, comparador por defecto)
+NUMERIC_FIELDS = {
+    "price": (r"(?:€|eur\b|euros?\b)", None, "<="),
+    "ram_gb": (r"gb\s*(?:de\s*)?ram\b", r"ram\s*(?:de\s*)?", ">="),
+    "storage_gb": (r"gb\s*(?:de\s*)?(?:almacenamiento|memoria interna|storage|rom)\b", r"(?:almacenamiento|storage)\s*(?:de\s*)?", ">="),
+    "battery_mah": (r"mah\b", r"bateria\s*(?:de\s*)?", ">="),
+    "refresh_rate_hz": (r"hz\b", None, ">="),
+    "screen_size_in": (r"(?:pulgadas|\"|inch(?:es)?\b)", None, ">="),
+}
+# Unidades que hay que añadir cuando el número va detrás del nombre (ram de 8 gb)
+TRAILING_UNIT = {"ram_gb": r"\s*gb", "storage_gb": r"\s*gb", "battery_mah": r"\s*(?:mah)?"}
+# Tras el número no puede venir la unidad de otro campo ("batería por debajo de 250 €" es el precio)
+NO_OTHER_UNIT = r"(?!\d|\s*(?:€|eur\b|euros?\b|gb\b|hz\b|mah\b|pulgadas\b))"
+
+BOOLEAN_FIELDS = {
+    "nfc": r"\bnfc\b",
+    "ir_blaster": r"\b(?:ir ?blaster|infrarrojos?)\b",
+    "volte": r"\bvolte\b",
+    "memory_card_supported": r"\b(?:micro ?sd|tarjeta (?:sd|de memoria))\b",
+}
+NEGATION = r"(?:sin|no|without)\s+(?:\w+\s+)?"
+
+NETWORKS = {"5g": r"\b5g\b", "4g": r"\b4g\b"}
+
+# Palabras de una pregunta ya sin tildes (app/hybrid.py:tokenize); "5g" / "4g" van enteros
+TOKEN = r"\b[2-5]g\b|[a-z]+|\d+"
+
+FIELD_LABELS = {
+    "price": "precio (EUR)",
+    "ram_gb": "RAM (GB)",
+    "storage_gb": "almacenamiento (GB)",
+    "battery_mah": "batería (mAh)",
+    "refresh_rate_hz": "tasa de refresco (Hz)",
+    "screen_size_in": "pantalla (pulgadas)",
+}
+
+
+def extract_question(query_str: str) -> str:
+    if QUESTION_MARKER in query_str:
+        return query_str.rsplit(QUESTION_MARKER, 1)[1].strip()
+    return query_str
+
+
+def _fold(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def _number(raw: str) -> float:
+    if re.fullmatch(r"\d{1,3}(?:\.\d{3})+", raw):
+        raw = raw.replace(".", "")  # 1.000 € = mil euros
+    return float(raw.replace(",", "."))
+
+
+def without_models(question: str, matcher) -> str:
+    """
+    La pregunta (sin tildes) con los nombres de modelo que reconoce `matcher`
+    (app/hybrid.py:ModelMatcher) en blanco: el "5g" de "oneplus 11 5g" no es una restricción.
+    """
+    spans = [span for found in matcher.spans(question).values() for span in found]
+    if not spans:
+        return question
+    text = _fold(question)
+    # spans() cuenta posiciones de tokenize(): se pasan a caracteres con los mismos tokens
+    tokens = [m.span() for m in re.finditer(TOKEN, text)]
+    chars = list(text)
+    for a, b in spans:
+        for start, end in tokens[a:b]:
+            chars[start:end] = " " * (end - start)
+    return "".join(chars)
+
+
+class QueryPlan:
+    """
+    Restricciones duras extraídas de una pregunta: numéricas (campo, op, valor),
+    booleanas, tipo de red y red excluida ("que no sea 5g").
+    """
+
+    def __init__(self):
+        self.numeric = []
+        self.booleans = {}
+        self.network_type = None
+        self.excluded_network = None
+
+    def __bool__(self) -> bool:
+        return bool(self.numeric or self.booleans or self.network_type or self.excluded_network)
+
+    def describe(self) -> str:
+        parts = [f"{FIELD_LABELS[f]} {op} {v:g}" for f, op, v in self.numeric]
+        parts += [f"{f}={'sí' if v else 'no'}" for f, v in self.booleans.items()]
+        if self.network_type:
+            parts.append(f"red {self.network_type}")
+        if self.excluded_network:
+            parts.append(f"sin red {self.excluded_network}")
+        return ", ".join(parts)
+
+    def to_cypher(self):
+        where, params = [], {}
+        for i, (field, op, value) in enumerate(self.numeric):
+            where.append(f"p.{field} {op} $v{i}")
+            params[f"v{i}"] = value
+        for field, value in self.booleans.items():
+            where.append(f"p.{field} = ${field}")
+            params[field] = value
+        if self.excluded_network:
+            where.append("NOT (p)-[:SUPPORTS_NETWORK]->(:Network {name: $excluded_network})")
+            params["excluded_network"] = self.excluded_network
+
+        query = "MATCH (p:Phone)\n"
+        if self.network_type:
+            # Network.name tiene constraint único: el patrón entra por índice
+            query = "MATCH (:Network {name: $network_type})<-[:SUPPORTS_NETWORK]-(p:Phone)\n"
+            params["network_type"] = self.network_type
+        if where:
+            query += "WHERE " + " AND ".join(where) + "\n"
+        query += "RETURN p.model_raw AS model"
+        return query, params
+
+
+def plan_query(question: str, matcher=None) -> QueryPlan:
+    """
+    Restricciones de la pregunta. Con `matcher` (ModelMatcher del catálogo), sin mirar
+    los nombres de modelo que contiene.
+    """
+    q = _fold(without_models(question, matcher) if matcher is not None else question)
+    plan = QueryPlan()
+
+    for field, (suffix, prefix, default_op) in NUMERIC_FIELDS.items():
+        # "entre 200 y 400 €"
+        m = re.search(rf"entre\s+{NUM}\s*(?:{suffix})?\s*y\s+{NUM}\s*{suffix}", q)
+        if m:
+            plan.numeric += [(field, ">=", _number(m.group(1))), (field, "<=", _number(m.group(2)))]
+            continue
+        patterns = [rf"(?:({UPPER}|{LOWER})\s*(?:de\s+)?)?{NUM}\s*{suffix}"]
+        if prefix:
+            patterns.append(rf"{prefix}(?:({UPPER}|{LOWER})\s*(?:de\s+)?)?{NUM}{TRAILING_UNIT.get(field, '')}{NO_OTHER_UNIT}")
+        for pattern in patterns:
+            m = re.search(pattern, q)
+            if m:
+                cmp_word, value = m.group(1), _number(m.group(2))
+                if cmp_word is None:
+                    op = default_op
+                else:
+                    op = "<=" if re.fullmatch(UPPER, cmp_word) else ">="
+                plan.numeric.append((field, op, value))
+                break
+
+    for field, pattern in BOOLEAN_FIELDS.items():
+        if re.search(NEGATION + pattern, q):
+            plan.booleans[field] = False
+        elif re.search(pattern, q):
+            plan.booleans[field] = True
+
+    for network, pattern in NETWORKS.items():
+        if re.search(NEGATION + pattern, q):
+            plan.excluded_network = plan.excluded_network or network
+        elif plan.network_type is None and re.search(pattern, q):
+            plan.network_type = network
+    return plan
+
+
+class PlannedRetriever(BaseRetriever):
+    """
+    Antes de la búsqueda vectorial, resuelve las restricciones duras de la pregunta
+    (precio, RAM, batería, NFC, 5G...) con una consulta Cypher indexada y limita el
+    ranking vectorial a los teléfonos que las cumplen.
+    """
+
+    def __init__(self, index, driver=None, similarity_top_k: int = 10, make_retriever=None, database=None,
+                 matcher=None, **retriever_kwargs):
+        super().__init__(callback_manager=Settings.callback_manager)
+        self._index = index
+        self._driver = driver
+        # Base de datos del catálogo del índice (None = NEO4J_DATABASE)
+        self._database = database
+        # Nombres de modelo del catálogo: no se leen como restricciones
+        self._matcher = matcher
+        self._top_k = similarity_top_k
+        # make_retriever(filters) -> retriever de base (vectorial o híbrido)
+        self._make_retriever = make_retriever or (
+            lambda filters=None: index.as_retriever(
+                similarity_top_k=similarity_top_k, filters=filters, **retriever_kwargs
+            )
+        )
+        self._base = self._make_retriever()
+
+    def _candidates(self, plan: QueryPlan) -> Optional[List[str]]:
+        query, params = plan.to_cypher()
+        try:
+            # Driver compartido del proceso (pool de conexiones); un solo intento, sin reintentos
+            with timed("cypher_prefilter"):
+                return [r["model"] for r in read_query(
+                    query, params, driver=self._driver, retry=False, database=self._database
+                )]
+        except Exception as e:
+            # Sin grafo no hay prefiltrado: se busca en todo el índice
+            print(f"Aviso: no se pudo prefiltrar en Neo4j ({e})")
+            return None
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        plan = plan_query(extract_question(query_bundle.query_str), self._matcher)
+        if not plan:
+            return self._base.retrieve(query_bundle)
+
+        models = self._candidates(plan)
+        if models is None:
+            return self._base.retrieve(query_bundle)
+        if not models:
+            note = f"Ningún teléfono del catálogo cumple estas condiciones: {plan.describe()}."
+            return [NodeWithScore(node=TextNode(text=note), score=1.0)]
+
+        filters = MetadataFilters(
+            filters=[MetadataFilter(key="model", value=models, operator=FilterOperator.IN)]
+        )
+        vector_store = self._index.vector_store
+        if len(models) <= self._top_k and vector_store.stores_text:
+            # Caben todos en el contexto: no hace falta ni embeber la pregunta
+            return [NodeWithScore(node=n, score=1.0) for n in vector_store.get_nodes(filters=filters)]
+
+        return self._make_retriever(filters).retrieve(query_bundle)
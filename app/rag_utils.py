@@ -1,40 +1,312 @@
 from llama_index.core import VectorStoreIndex, StorageContext, load_index_from_storage, Settings
+from llama_index.core.callbacks import CallbackManager
+from llama_index.core.ingestion import run_transformations
+from llama_index.core.query_engine import RetrieverQueryEngine
 from llama_index.embeddings.ollama import OllamaEmbedding
 from llama_index.llms.ollama import Ollama
-from app.config import OLLAMA_BASE_URL, OLLAMA_MODEL, OLLAMA_EMBED_MODEL
+from app.config import (
+    OLLAMA_BASE_URL, OLLAMA_MODEL, OLLAMA_EMBED_MODEL, MODEL_KEEP_ALIVE, MODEL_MIN_FREE_MB, MODEL_CHECK_INTERVAL, EMBED_BATCH_SIZE, EMBED_TIMEOUT,
+    EMBED_CACHE_ENABLED, EMBED_CACHE_PATH, EMBED_CACHE_MAX_MB, VECTOR_DTYPE, VECTOR_QUANTIZATION, VECTOR_RERANK, HYBRID_SEARCH, HYBRID_TOP_K,
+    DIRECT_ANSWERS, CATALOG_QUERIES, CONTEXT_PACKING, CONTEXT_TOKEN_BUDGET, SIMILAR_PHONES, SIMILAR_K, SIMILAR_SPEC_WEIGHT,
+)
+from app.catalog import CATALOG_DIRNAME, Catalog, CatalogRetriever
+from app.context_packing import ContextPacker
+from app.direct_answer import SpecTable
+from app.embed_cache import CachedEmbedding, EmbeddingCache, query_embeddings
+from app.embed_utils import embed_nodes
+from app.hybrid import BM25Index, HybridRetriever
+from app.index_builder import StreamingIndexWriter, build_streaming
+from app.ingest_utils import parse_text
+from app.instrumentation import StageTimingHandler
+from app.metrics import timed
+from app.quantization import Int8Codes
+from app.query_planner import PlannedRetriever
+from app.residency import ModelResidency
+from app.similar import SimilarPhones, SimilarRetriever
+from app.vector_store import VECTORS_FNAME, NumpyVectorStore
+import numpy as np
 import os
+import threading
+
+_EMBED_CACHE = None
+_EMBED_CACHE_LOCK = threading.Lock()
+_RESIDENCY = None
+_TIMING_HANDLER = StageTimingHandler()
+
+def get_residency():
+    """
+    Gestor de residencia del LLM y del modelo de embeddings, compartido por todo el proceso.
+    """
+    global _RESIDENCY
+    if _RESIDENCY is None:
+        _RESIDENCY = ModelResidency(
+            OLLAMA_BASE_URL,
+            {"llm": OLLAMA_MODEL, "embed": OLLAMA_EMBED_MODEL},
+            keep_alive=MODEL_KEEP_ALIVE,
+            min_free_mb=MODEL_MIN_FREE_MB,
+            check_interval=MODEL_CHECK_INTERVAL,
+        )
+    return _RESIDENCY
+
+def get_embed_cache():
+    """
+    Caché de embeddings compartida por todo el proceso (None si está desactivada).
+    """
+    global _EMBED_CACHE
+    if EMBED_CACHE_ENABLED and _EMBED_CACHE is None:
+        # Los hilos del servidor pueden llegar a la vez: una sola conexión SQLite
+        with _EMBED_CACHE_LOCK:
+            if _EMBED_CACHE is None:
+                _EMBED_CACHE = EmbeddingCache(
+                    EMBED_CACHE_PATH,
+                    model_name=OLLAMA_EMBED_MODEL,
+                    max_bytes=int(EMBED_CACHE_MAX_MB * 1024 * 1024),
+                )
+    return _EMBED_CACHE
 
 def get_embed_model():
-    return OllamaEmbedding(base_url=OLLAMA_BASE_URL, model_name=OLLAMA_EMBED_MODEL)
+    embed_model = OllamaEmbedding(
+        base_url=OLLAMA_BASE_URL,
+        model_name=OLLAMA_EMBED_MODEL,
+        embed_batch_size=EMBED_BATCH_SIZE,  # una petición a Ollama por lote
+        client_kwargs={"timeout": EMBED_TIMEOUT},
+        keep_alive=MODEL_KEEP_ALIVE,  # cargado mientras haya tráfico (ModelResidency)
+    )
+    cache = get_embed_cache()
+    return CachedEmbedding(embed_model, cache) if cache is not None else embed_model
 
 def get_llm():
     # num_ctx pequeño = mucha menos RAM
-    keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "0")
     return Ollama(
         base_url=OLLAMA_BASE_URL,
         model=OLLAMA_MODEL,
         additional_kwargs={
             "num_ctx": 2048,      # prueba 1024 si sigue alto
             "num_predict": 512,   # limita tokens de salida
-            "keep_alive": keep_alive,
         },
+        # Fuera de additional_kwargs (son "options" y Ollama ignora ahí el keep_alive)
+        keep_alive=MODEL_KEEP_ALIVE,
         request_timeout=120.0,
+        callback_manager=Settings.callback_manager,
     )
 
 def configure_llamaindex_defaults():
     """
     Evita que LlamaIndex intente usar OpenAI por defecto.
     """
+    # Tiempos por etapa (embedding, retrieve, llm...) para /metrics y uso de los modelos
+    _TIMING_HANDLER.residency = get_residency()
+    Settings.callback_manager = CallbackManager([_TIMING_HANDLER])
     Settings.embed_model = get_embed_model()
     Settings.llm = get_llm()
 
+def documents_to_nodes(docs):
+    """
+    Trocea los documentos y calcula sus embeddings en lotes concurrentes.
+    """
+    nodes = run_transformations(docs, Settings.transformations)
+    stats = embed_nodes(nodes, Settings.embed_model)
+    print(f"Embeddings: {stats.summary()}")
+    return nodes
+
+def insert_documents(index, docs):
+    index.insert_nodes(documents_to_nodes(docs))
+    for doc in docs:
+        index.docstore.set_document_hash(doc.id_, doc.hash)
+
 def build_index(docs, persist_dir: str):
     configure_llamaindex_defaults()
-    index = VectorStoreIndex.from_documents(docs)  # usa Settings.embed_model
+    storage = StorageContext.from_defaults(
+        vector_store=NumpyVectorStore(dtype=VECTOR_DTYPE, quantization=VECTOR_QUANTIZATION)
+    )
+    index = VectorStoreIndex(nodes=[], storage_context=storage)
+    insert_documents(index, docs)  # los nodos ya llevan embedding: no se recalculan
     index.storage_context.persist(persist_dir=persist_dir)
     return index
 
+def build_index_streaming(read_pages, persist_dir: str, restart: bool = False) -> dict:
+    """
+    Índice completo por páginas: read_pages(after) devuelve páginas de (Document, row_hash)
+    con clave mayor que `after`. Si un build anterior se cortó, sigue desde su último lote
+    confirmado (salvo restart=True). Devuelve las huellas {clave: row_hash}.
+    """
+    configure_llamaindex_defaults()
+    writer = StreamingIndexWriter(persist_dir, OLLAMA_EMBED_MODEL, dtype=VECTOR_DTYPE, restart=restart)
+    if writer.rows:
+        print(f"Reanudando build interrumpido: {writer.rows} documentos ya indexados (último: {writer.last_key})")
+
+    def to_nodes(docs):
+        nodes = run_transformations(docs, Settings.transformations)
+        embed_nodes(nodes, Settings.embed_model, progress=False)
+        return nodes
+
+    hashes = build_streaming(
+        read_pages(writer.last_key), writer, to_nodes,
+        progress=lambda rows: print(f"  Indexados: {rows} documentos"),
+    )
+    if VECTOR_QUANTIZATION == "int8":
+        Int8Codes.write(np.load(os.path.join(persist_dir, VECTORS_FNAME), mmap_mode="r"), persist_dir)
+    # docstore e index_store vacíos: el texto y los vectores ya están en el NumpyVectorStore
+    storage = StorageContext.from_defaults(vector_store=NumpyVectorStore(dtype=VECTOR_DTYPE))
+    VectorStoreIndex(nodes=[], storage_context=storage)
+    storage.persist(persist_dir=persist_dir)
+    return hashes
+
 def load_index(persist_dir: str):
     configure_llamaindex_defaults()
-    storage = StorageContext.from_defaults(persist_dir=persist_dir)
+    with timed("load_index"):
+        return _load_index(persist_dir)
+
+def _load_index(persist_dir: str):
+    if NumpyVectorStore.exists(persist_dir):
+        # Matriz .npy abierta con mmap: la carga no copia los embeddings
+        storage = StorageContext.from_defaults(
+            persist_dir=persist_dir,
+            vector_store=NumpyVectorStore.from_persist_dir(
+                persist_dir, quantization=VECTOR_QUANTIZATION, rerank=VECTOR_RERANK
+            ),
+        )
+    else:
+        # Índices antiguos en JSON (SimpleVectorStore)
+        storage = StorageContext.from_defaults(persist_dir=persist_dir)
     return load_index_from_storage(storage)
+
+def embed_question(text: str):
+    return Settings.embed_model.get_query_embedding(text)
+
+def embed_questions(texts):
+    """
+    Embeddings de varias preguntas en una sola llamada (lotes de EMBED_BATCH_SIZE a Ollama),
+    por el mismo camino que embed_question: los dos dan el mismo vector.
+    """
+    embed_model = Settings.embed_model
+    with timed("embedding_batch"):
+        if isinstance(embed_model, CachedEmbedding):
+            return embed_model.get_query_embedding_batch(list(texts))
+        return query_embeddings(embed_model, list(texts))
+
+def build_bm25(persist_dir: str):
+    """
+    Índice BM25 a partir de las filas del índice vectorial ya guardado.
+    """
+    store = NumpyVectorStore.from_persist_dir(persist_dir)
+    bm25 = BM25Index.from_rows(store.rows)
+    bm25.persist(persist_dir)
+    return bm25
+
+def build_similar(persist_dir: str, changed=None, removed=None):
+    """
+    Tabla de vecinos a partir del índice vectorial ya guardado: completa, o solo lo que
+    afecta a los teléfonos cambiados/eliminados si ya existía una con el mismo k y peso.
+    Devuelve (tabla, claves recalculadas o None si se ha recalculado entera).
+    """
+    store = NumpyVectorStore.from_persist_dir(persist_dir)
+    table = SimilarPhones.load(persist_dir) if SimilarPhones.exists(persist_dir) else None
+    if (
+        changed is None or table is None
+        or (table.k, table.spec_weight) != (SIMILAR_K, SIMILAR_SPEC_WEIGHT)
+    ):
+        table, keys = SimilarPhones.from_store(store, k=SIMILAR_K, spec_weight=SIMILAR_SPEC_WEIGHT), None
+    else:
+        keys = table.refresh(store, changed, removed or [])
+    table.persist(persist_dir)
+    return table, keys
+
+def load_similar(persist_dir: str):
+    if SIMILAR_PHONES and SimilarPhones.exists(persist_dir):
+        with timed("load_similar"):
+            return SimilarPhones.load(persist_dir)
+    return None
+
+def load_bm25(persist_dir: str):
+    if HYBRID_SEARCH and BM25Index.exists(persist_dir):
+        return BM25Index.load(persist_dir)
+    return None
+
+def load_spec_table(persist_dir: str):
+    """
+    Tabla de especificaciones para las respuestas directas (None si están desactivadas).
+    Sale de las mismas filas que el índice, así que siempre coincide con lo que recupera el RAG.
+    """
+    if not DIRECT_ANSWERS or not NumpyVectorStore.exists(persist_dir):
+        return None
+    with timed("load_spec_table"):
+        return SpecTable.from_rows(NumpyVectorStore.from_persist_dir(persist_dir).rows)
+
+def _catalog_from_index(persist_dir: str):
+    if not NumpyVectorStore.exists(persist_dir):
+        return None
+    rows = NumpyVectorStore.from_persist_dir(persist_dir).rows
+    return Catalog.from_rows([parse_text(r["text"]) for r in rows])
+
+def build_catalog(persist_dir: str):
+    """
+    Instantánea columnar a partir de las filas del índice ya guardado (03_build_rag.py, en
+    staging, cuando 02_load_neo4j.py no la ha dejado). None si no hay índice.
+    """
+    catalog = _catalog_from_index(persist_dir)
+    if catalog is not None:
+        catalog.persist(os.path.join(persist_dir, CATALOG_DIRNAME))
+    return catalog
+
+def load_catalog(persist_dir: str):
+    """
+    Instantánea columnar del catálogo (la escriben 02_load_neo4j.py o 03_build_rag.py). Si
+    no existe se construye en memoria a partir de las filas del índice, sin escribir en el
+    directorio, que puede ser una instantánea publicada. None si está desactivada.
+    """
+    if not CATALOG_QUERIES:
+        return None
+    catalog_dir = os.path.join(persist_dir, CATALOG_DIRNAME)
+    with timed("load_catalog"):
+        if not Catalog.exists(catalog_dir):
+            return _catalog_from_index(persist_dir)
+        return Catalog.load(catalog_dir)
+
+def create_retriever(index, bm25=None, similar=None, catalog=None, database=None):
+    kwargs = dict(similarity_top_k=10, vector_store_query_mode="mmr", alpha=0.7)
+    if bm25 is not None:
+        # BM25 + vectorial con RRF: menos nodos al LLM (HYBRID_TOP_K) y sin embedding
+        # de la pregunta cuando nombra un modelo o chipset exacto
+        def make_retriever(filters=None):
+            return HybridRetriever(index, bm25, final_top_k=HYBRID_TOP_K, filters=filters, **kwargs)
+    else:
+        def make_retriever(filters=None):
+            return index.as_retriever(filters=filters, **kwargs)
+
+    if os.getenv("QUERY_PLANNER", "1") == "1":
+        # Restricciones duras (precio, RAM, NFC, 5G...) resueltas antes en Neo4j
+        # Sin leer como restricción el "5g" de "oneplus 11 5g"
+        matcher = bm25.matcher if bm25 is not None else catalog.matcher if catalog is not None else None
+        retriever = PlannedRetriever(
+            index, similarity_top_k=kwargs["similarity_top_k"], make_retriever=make_retriever, database=database,
+            matcher=matcher,
+        )
+    else:
+        retriever = make_retriever()
+    if similar is not None:
+        # "Alternativas al X": vecinos precalculados, sin búsqueda
+        retriever = SimilarRetriever(index, similar, retriever, top_k=HYBRID_TOP_K)
+    if catalog is not None:
+        # Rankings y agregados ("top 5 por batería", "precio medio por marca"): exactos, sin búsqueda
+        retriever = CatalogRetriever(catalog, retriever)
+    return retriever
+
+def create_query_engine(persist_dir: str, streaming: bool = True, database=None):
+    """
+    Con streaming=True, query() devuelve un StreamingResponse: response_gen va
+    entregando tokens y str(resp) sigue devolviendo la respuesta completa.
+    `database`: base de datos de Neo4j del catálogo del índice (prefiltrado).
+    """
+    with timed("create_query_engine"):
+        index = load_index(persist_dir)
+        llm = get_llm()
+        retriever = create_retriever(
+            index, bm25=load_bm25(persist_dir), similar=load_similar(persist_dir), catalog=load_catalog(persist_dir),
+            database=database,
+        )
+        # Fichas recuperadas -> tabla compacta dentro de CONTEXT_TOKEN_BUDGET
+        postprocessors = [ContextPacker(token_budget=CONTEXT_TOKEN_BUDGET)] if CONTEXT_PACKING else []
+        return RetrieverQueryEngine.from_args(
+            retriever, llm=llm, streaming=streaming, node_postprocessors=postprocessors
+        )
@@ -0,0 +1,240 @@
+# app/residency.py
+import re
+import threading
+import time
+
+import httpx
+
+from app.metrics import MODEL_COLD_LOADS, MODEL_UNLOADS, record_stage
+
+# Una carga de más de esto (s, load_duration de Ollama) cuenta como arranque en frío
+COLD_LOAD_SECONDS = 0.5
+DURATION_RE = re.compile(r"(-?\d+(?:\.\d+)?)(ms|s|m|h)?")
+UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "": 1}
+
+
+def parse_duration(value) -> float:
+    """
+    Segundos de un keep_alive de Ollama ("10m", "1h30m", "600", -1). Negativo = sin límite.
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip()
+    if not re.fullmatch(r"(?:-?\d+(?:\.\d+)?(?:ms|s|m|h)?)+", text):
+        raise ValueError(f"Duración no válida: {value!r}")
+    return sum(float(n) * UNITS[unit] for n, unit in DURATION_RE.findall(text))
+
+
+def available_memory_mb():
+    """
+    Memoria disponible del sistema (MB): psutil si está instalado, si no /proc/meminfo.
+    None si no hay forma de saberlo (la vigilancia de memoria queda desactivada).
+    """
+    try:
+        import psutil
+
+        return psutil.virtual_memory().available / 2**20
+    except ImportError:
+        pass
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _ollama_name(model: str) -> str:
+    # /api/ps devuelve los nombres con etiqueta: "nomic-embed-text" -> "nomic-embed-text:latest"
+    return model if ":" in model else f"{model}:latest"
+
+
+class ModelResidency:
+    """
+    Mantiene cargados en Ollama el LLM y el modelo de embeddings mientras hay tráfico.
+    Cada petición lleva keep_alive = ventana de inactividad, así que Ollama solo los
+    descarga tras `keep_alive` sin uso; un hilo vigila además la memoria libre y, si
+    baja de `min_free_mb`, descarga (el menos usado primero) los que no estén en uso.
+    Con prewarm() se cargan los dos al arrancar y observe_load() cuenta las cargas en frío.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        models: dict,
+        keep_alive="10m",
+        min_free_mb: float = 0.0,
+        check_interval: float = 30.0,
+        timeout: float = 120.0,
+        memory_fn=available_memory_mb,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.models = dict(models)  # rol ("llm", "embed") -> nombre del modelo en Ollama
+        self.keep_alive = keep_alive  # tal cual se envía a Ollama
+        self.idle_seconds = parse_duration(keep_alive)
+        self.min_free_mb = min_free_mb
+        self.check_interval = check_interval
+        self.timeout = timeout
+        self.memory_fn = memory_fn
+        self._lock = threading.Lock()
+        self._last_use = {}    # rol -> time.monotonic() del último uso
+        self._in_use = {}      # rol -> llamadas en curso
+        self._loaded = set()   # roles que el gestor cree cargados
+        self._cold_loads = {}  # rol -> cargas en frío observadas
+        self._unloads = {}     # motivo (idle, memory) -> descargas
+        self._prewarm_s = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def acquire(self, role: str) -> None:
+        with self._lock:
+            self._in_use[role] = self._in_use.get(role, 0) + 1
+            self._last_use[role] = time.monotonic()
+            self._loaded.add(role)
+
+    def release(self, role: str) -> None:
+        with self._lock:
+            self._in_use[role] = max(0, self._in_use.get(role, 0) - 1)
+            self._last_use[role] = time.monotonic()
+            if self.idle_seconds == 0 and not self._in_use[role]:
+                self._loaded.discard(role)  # keep_alive=0: Ollama lo descarga al terminar
+
+    def observe_load(self, role: str, seconds: float) -> None:
+        """
+        load_duration de una respuesta de Ollama: más de COLD_LOAD_SECONDS = el modelo no estaba cargado.
+        """
+        if seconds >= COLD_LOAD_SECONDS:
+            MODEL_COLD_LOADS.inc(role=role)
+            with self._lock:
+                self._cold_loads[role] = self._cold_loads.get(role, 0) + 1
+
+    def _post(self, role: str, keep_alive) -> dict:
+        model = self.models[role]
+        if role == "embed" and keep_alive != 0:
+            path, body = "/api/embed", {"model": model, "input": "ok"}
+        else:
+            # Prompt vacío: Ollama solo carga (o descarga, con keep_alive=0) el modelo
+            path, body = "/api/generate", {"model": model, "prompt": "", "stream": False}
+        resp = httpx.post(f"{self.base_url}{path}", json={**body, "keep_alive": keep_alive}, timeout=self.timeout)
+        resp.raise_for_status()
+        return resp.json()
+
+    def prewarm(self) -> dict:
+        """
+        Carga los modelos con una petición mínima para que la primera pregunta no pague
+        la carga desde disco. Devuelve los segundos de cada uno (los que fallan se omiten).
+        """
+        for role, model in self.models.items():
+            started = time.perf_counter()
+            try:
+                raw = self._post(role, self.keep_alive)
+            except httpx.HTTPError as e:
+                print(f"Aviso: no se pudo precargar {model} ({e})")
+                continue
+            seconds = time.perf_counter() - started
+            record_stage(f"prewarm:{role}", seconds)
+            self.observe_load(role, (raw.get("load_duration") or 0) / 1e9)
+            with self._lock:
+                self._prewarm_s[role] = round(seconds, 3)
+                self._last_use[role] = time.monotonic()
+                self._loaded.add(role)
+        return dict(self._prewarm_s)
+
+    def unload(self, role: str, reason: str) -> bool:
+        try:
+            self._post(role, 0)
+        except httpx.HTTPError as e:
+            print(f"Aviso: no se pudo descargar {self.models[role]} ({e})")
+            return False
+        MODEL_UNLOADS.inc(role=role, reason=reason)
+        with self._lock:
+            self._loaded.discard(role)
+            self._unloads[reason] = self._unloads.get(reason, 0) + 1
+        return True
+
+    def check(self) -> list:
+        """
+        Una pasada del vigilante. Marca como descargados los modelos que llevan la ventana
+        entera sin uso (Ollama ya los ha soltado) y, con poca memoria libre, descarga los
+        que no están en uso, del menos reciente al más reciente, hasta recuperar el mínimo.
+        Devuelve los roles descargados por memoria.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self.idle_seconds > 0:
+                for role in list(self._loaded):
+                    if not self._in_use.get(role) and now - self._last_use.get(role, now) > self.idle_seconds:
+                        self._loaded.discard(role)
+            idle = sorted(
+                (r for r in self._loaded if not self._in_use.get(r)),
+                key=lambda r: self._last_use.get(r, 0),
+            )
+        if not self.min_free_mb:
+            return []
+        unloaded = []
+        for role in idle:
+            free = self.memory_fn()
+            if free is None or free >= self.min_free_mb:
+                break
+            if self.unload(role, "memory"):
+                print(f"Memoria libre {free:.0f} MB < {self.min_free_mb:.0f} MB: descargado {self.models[role]}")
+                unloaded.append(role)
+        return unloaded
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.check_interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Aviso: fallo vigilando los modelos ({e})")
+
+    def start(self) -> "ModelResidency":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, name="model-residency", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def running(self):
+        """
+        {nombre: entrada de /api/ps} de lo que Ollama tiene cargado ahora (None si no responde).
+        """
+        try:
+            resp = httpx.get(f"{self.base_url}/api/ps", timeout=2.0)
+            resp.raise_for_status()
+        except httpx.HTTPError:
+            return None
+        return {m.get("name"): m for m in resp.json().get("models") or []}
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        running = self.running()
+        with self._lock:
+            models = {}
+            for role, model in self.models.items():
+                last = self._last_use.get(role)
+                models[role] = {
+                    "model": model,
+                    "loaded": role in self._loaded,
+                    "in_use": self._in_use.get(role, 0),
+                    "idle_s": round(now - last, 1) if last is not None else None,
+                    "cold_loads": self._cold_loads.get(role, 0),
+                    "prewarm_s": self._prewarm_s.get(role),
+                }
+                if running is not None:
+                    entry = running.get(_ollama_name(model)) or running.get(model)
+                    models[role]["loaded"] = entry is not None
+                    models[role]["resident_mb"] = round((entry or {}).get("size", 0) / 2**20, 1)
+            unloads = dict(self._unloads)
+        free = self.memory_fn()
+        return {
+            "keep_alive": self.keep_alive,
+            "min_free_mb": self.min_free_mb,
+            "available_mb": round(free, 1) if free is not None else None,
+            "unloads": unloads,
+            "models": models,
+        }
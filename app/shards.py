@@ -0,0 +1,260 @@
+# app/shards.py
+import json
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from app.config import CATALOGS_FILE, DEFAULT_CATALOG, NEO4J_DATABASE, PROJECT_ROOT
+from app.metrics import CATALOG_EVICTIONS, INDEX_SWAPS, timed
+from app.snapshots import ServingSnapshot, current_dir, release_lease, snapshot_version, take_lease
+
+# Catálogo único cuando no hay catalogs.json: el CSV original, con precios en rupias
+DEFAULT_NAME = "default"
+DEFAULT_CSV = "data/smartphone-specification.csv"
+DEFAULT_INDEX_DIR = "index_store"
+INR_TO_EUR = 0.0094
+
+
+class UnknownCatalogError(KeyError):
+    """Catálogo que no está en catalogs.json (el servidor responde 404)."""
+
+
+class CatalogUnavailableError(Exception):
+    """No se pudo cargar el índice del catálogo (el servidor responde 503)."""
+
+
+def _resolve(path) -> Path:
+    path = Path(path)
+    return path if path.is_absolute() else PROJECT_ROOT / path
+
+
+class CatalogSpec:
+    """
+    Un catálogo (mercado): CSV, euros por unidad de su moneda, base de datos de Neo4j
+    donde lo carga 02_load_neo4j.py y raíz de instantáneas de su índice (app/snapshots.py).
+    """
+
+    def __init__(self, name: str, csv: str = DEFAULT_CSV, to_eur: float = INR_TO_EUR, currency: str = "INR",
+                 database: Optional[str] = None, index_dir: Optional[str] = None):
+        if not re.fullmatch(r"[\w-]+", name):
+            raise ValueError(f"Nombre de catálogo no válido: '{name}' (letras, números, '_' y '-')")
+        self.name = name
+        self.csv_path = _resolve(csv)
+        self.to_eur = float(to_eur)
+        self.currency = currency
+        self.database = database or NEO4J_DATABASE
+        self.persist_dir = _resolve(index_dir or (DEFAULT_INDEX_DIR if name == DEFAULT_NAME else f"index_stores/{name}"))
+
+    def describe(self) -> dict:
+        return {
+            "csv": str(self.csv_path),
+            "currency": self.currency,
+            "to_eur": self.to_eur,
+            "database": self.database,
+            "index_dir": str(self.persist_dir),
+        }
+
+
+def load_catalogs(path=CATALOGS_FILE) -> "OrderedDict[str, CatalogSpec]":
+    """
+    Catálogos de catalogs.json, en su orden:
+        {"in": {"csv": "data/in.csv", "currency": "INR", "to_eur": 0.0094, "database": "phonesin"},
+         "es": {"csv": "data/es.csv", "currency": "EUR", "to_eur": 1, "database": "phoneses"}}
+    index_dir es opcional (por defecto index_stores/<nombre>, index_store para "default").
+    Sin el fichero, un único catálogo "default" con el CSV y el índice de siempre.
+    """
+    path = Path(path)
+    if not path.is_file():
+        return OrderedDict([(DEFAULT_NAME, CatalogSpec(DEFAULT_NAME))])
+    data = json.loads(path.read_text(encoding="utf-8"), object_pairs_hook=OrderedDict)
+    if not isinstance(data, dict) or not data:
+        raise ValueError(f"{path}: se esperaba un objeto {{nombre: opciones}} con al menos un catálogo")
+    specs = OrderedDict()
+    for name, options in data.items():
+        try:
+            specs[name] = CatalogSpec(name, **(options or {}))
+        except TypeError as e:
+            raise ValueError(f"{path}: opciones no válidas en el catálogo '{name}' ({e})") from None
+    # Cada catálogo en su base de datos y su índice: 02_load_neo4j.py borra del grafo los
+    # teléfonos que no están en su CSV, así que dos catálogos no pueden compartirla
+    for attr, what in (("database", "base de datos de Neo4j"), ("persist_dir", "index_dir")):
+        seen = {}
+        for spec in specs.values():
+            other = seen.setdefault(getattr(spec, attr), spec.name)
+            if other != spec.name:
+                raise ValueError(f"{path}: los catálogos '{other}' y '{spec.name}' comparten {what}")
+    return specs
+
+
+def default_catalog(specs: dict) -> str:
+    """
+    Catálogo de las peticiones que no indican ninguno: DEFAULT_CATALOG o el primero.
+    """
+    if DEFAULT_CATALOG:
+        if DEFAULT_CATALOG not in specs:
+            raise ValueError(f"DEFAULT_CATALOG='{DEFAULT_CATALOG}' no está entre los catálogos ({', '.join(specs)})")
+        return DEFAULT_CATALOG
+    return next(iter(specs))
+
+
+def get_catalog(name: Optional[str] = None) -> CatalogSpec:
+    """
+    Catálogo de catalogs.json por nombre (por defecto, DEFAULT_CATALOG o el primero).
+    """
+    specs = load_catalogs()
+    try:
+        return specs[name or default_catalog(specs)]
+    except KeyError:
+        raise UnknownCatalogError(name) from None
+
+
+class ShardPool:
+    """
+    Índices de varios catálogos en un mismo proceso. Cada uno se carga la primera vez que
+    se pide (load_fn) y, si entre todos pasan de `budget_bytes`, se descargan los usados
+    hace más tiempo (LRU), que vuelven a cargarse cuando se pidan. La memoria de cada uno se
+    estima por lo que ocupa su instantánea en disco (vectores, BM25, docstore, catálogo).
+    Las cargas de un catálogo no bloquean las peticiones de los demás. Lo que sale de
+    servicio (recargado o descargado) pasa a retire_fn en un hilo aparte, que espera a que
+    terminen sus peticiones antes de liberarlo.
+    """
+
+    def __init__(self, specs: dict, load_fn, retire_fn, budget_bytes: int = 0, default: Optional[str] = None):
+        self.specs = specs
+        self.default = default or default_catalog(specs)
+        self.budget_bytes = budget_bytes
+        # load_fn(spec, path) -> (motor, tabla de especificaciones); retire_fn(spec, snapshot)
+        self._load_fn = load_fn
+        self._retire_fn = retire_fn
+        self._lock = threading.Lock()
+        self._loaded = OrderedDict()  # nombre -> ServingSnapshot, del usado hace más tiempo al último
+        self._loading = {}  # nombre -> Lock: una sola carga a la vez por catálogo
+        self.loads = 0
+        self.evictions = 0
+
+    def spec(self, name: Optional[str] = None) -> CatalogSpec:
+        try:
+            return self.specs[name or self.default]
+        except KeyError:
+            raise UnknownCatalogError(name) from None
+
+    def peek(self, name: Optional[str] = None) -> Optional[ServingSnapshot]:
+        """
+        Instantánea cargada del catálogo, sin cargarla ni contarla como uso.
+        """
+        with self._lock:
+            return self._loaded.get(name or self.default)
+
+    def loaded(self) -> list:
+        with self._lock:
+            return list(self._loaded.values())
+
+    def get(self, name: Optional[str] = None) -> ServingSnapshot:
+        """
+        Instantánea en servicio del catálogo (la carga si no lo está).
+        """
+        spec = self.spec(name)
+        with self._lock:
+            serving = self._loaded.get(spec.name)
+            if serving is not None:
+                self._loaded.move_to_end(spec.name)
+                return serving
+        return self.load(spec.name)
+
+    def load(self, name: Optional[str] = None) -> ServingSnapshot:
+        """
+        Carga la instantánea actual del catálogo (si no es ya la que está en servicio) y
+        la pone en servicio con una sola asignación. Devuelve la instantánea en servicio.
+        """
+        spec = self.spec(name)
+        with self._lock:
+            gate = self._loading.setdefault(spec.name, threading.Lock())
+        with gate:
+            version = snapshot_version(spec.persist_dir)
+            with self._lock:
+                serving = self._loaded.get(spec.name)
+                if serving is not None and serving.version == version:
+                    self._loaded.move_to_end(spec.name)
+                    return serving
+            path = current_dir(spec.persist_dir)
+            lease = take_lease(path)  # antes de cargar: collect_garbage() ya no la borra
+            try:
+                with timed("load_snapshot"):
+                    engine, spec_table = self._load_fn(spec, path)
+            except Exception as e:
+                release_lease(lease)
+                INDEX_SWAPS.inc(catalog=spec.name, result="error")
+                raise CatalogUnavailableError(f"{spec.name}: {e}") from e
+            serving = ServingSnapshot(version, path, engine, spec_table, lease=lease, catalog=spec.name)
+            with self._lock:
+                previous = self._loaded.pop(spec.name, None)
+                self._loaded[spec.name] = serving
+                evicted = self._evict(keep=spec.name)
+                self.loads += 1
+            INDEX_SWAPS.inc(catalog=spec.name, result="ok")
+        if previous is not None:
+            print(f"Índice {spec.name}@{version} en servicio (antes {previous.version})")
+            self._retire(previous)
+        for snapshot in evicted:
+            print(f"Índice {snapshot.catalog}@{snapshot.version} descargado (sin memoria para {spec.name})")
+            CATALOG_EVICTIONS.inc(catalog=snapshot.catalog)
+            self._retire(snapshot)
+        return serving
+
+    def _evict(self, keep: str) -> list:
+        """
+        Saca de servicio los menos usados hasta quedar dentro del presupuesto (con _lock).
+        Primero los que no tienen peticiones en curso; el recién cargado nunca.
+        """
+        if self.budget_bytes <= 0:
+            return []
+        evicted = []
+        while self.memory_bytes() > self.budget_bytes:
+            names = [n for n in self._loaded if n != keep]
+            if not names:
+                break  # uno solo ya no cabe: se sirve igualmente
+            idle = [n for n in names if self._loaded[n].active == 0]
+            evicted.append(self._loaded.pop((idle or names)[0]))
+            self.evictions += 1
+        return evicted
+
+    def _retire(self, snapshot: ServingSnapshot) -> None:
+        threading.Thread(
+            target=self._retire_fn, args=(self.specs[snapshot.catalog], snapshot),
+            name=f"retire-{snapshot.catalog}", daemon=True,
+        ).start()
+
+    def refresh(self) -> list:
+        """
+        Recarga los catálogos cargados que tienen una instantánea nueva publicada.
+        Los que no están cargados ya tomarán la actual cuando se pidan. Devuelve los recargados.
+        """
+        reloaded = []
+        for serving in self.loaded():
+            spec = self.specs[serving.catalog]
+            if snapshot_version(spec.persist_dir) == serving.version:
+                continue
+            try:
+                self.load(spec.name)
+                reloaded.append(spec.name)
+            except CatalogUnavailableError as e:
+                print(f"Aviso: no se pudo cargar la instantánea nueva ({e}); se sigue con {serving.version}")
+        return reloaded
+
+    def memory_bytes(self) -> int:
+        return sum(s.size_bytes for s in self._loaded.values())
+
+    def stats(self) -> dict:
+        with self._lock:
+            loaded = {name: s.stats() for name, s in self._loaded.items()}
+            memory = self.memory_bytes()
+        return {
+            "default": self.default,
+            "budget_mb": round(self.budget_bytes / (1024 * 1024), 1) if self.budget_bytes else None,
+            "memory_mb": round(memory / (1024 * 1024), 1),
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "catalogs": {name: {**spec.describe(), "loaded": loaded.get(name)} for name, spec in self.specs.items()},
+        }
@@ -0,0 +1,354 @@
+# app/similar.py
+import json
+import re
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+import numpy as np
+from llama_index.core import Settings
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+from llama_index.core.vector_stores.types import FilterOperator, MetadataFilter, MetadataFilters
+
+from app.hybrid import NETWORK_SUFFIX, ModelMatcher, tokenize
+from app.ingest_utils import parse_text
+from app.metrics import timed
+from app.neo4j_utils import read_query, shared_driver, write_batches
+from app.query_planner import extract_question, plan_query
+
+SIMILAR_FNAME = "similar.json"
+
+# Especificaciones numéricas que entran en la similitud (escala log para las que crecen a saltos)
+SPEC_FEATURES = [
+    ("price", np.log1p), ("rating", None), ("ram_gb", np.log2), ("storage_gb", np.log2),
+    ("battery_mah", None), ("screen_size_in", None), ("refresh_rate_hz", None),
+    ("front_camera_mp", None), ("rear_camera_max_mp", None), ("is_5g", None), ("nfc", None),
+]
+
+# "alternativas al X", "algo parecido al X", "más barato que el X", "mejor que el X"
+ALTERNATIVES = re.compile(
+    r"\b(?:alternativas?|parecid[oa]s?|similar(?:es)?|equivalentes?|rivales?|competidor(?:es)?|"
+    r"en vez del?|en lugar del?|(?:mas|menos) \w+ que|mejor(?:es)? que)\b"
+)
+CHEAPER = re.compile(r"\b(?:mas barat[oa]s?|menos car[oa]s?|mas economic[oa]s?|por menos)\b")
+BETTER = re.compile(r"\b(?:mejor(?:es)?|superior(?:es)?|mas potentes?|mejor valorad[oa]s?)\b")
+
+# Vecinos de cada teléfono como relaciones SIMILAR_TO (se reescriben las salientes de cada uno)
+SIMILAR_EDGES = """
+UNWIND $rows AS row
+MATCH (p:Phone {model: row.key})
+OPTIONAL MATCH (p)-[old:SIMILAR_TO]->()
+DELETE old
+WITH DISTINCT p, row
+UNWIND row.neighbors AS nb
+MATCH (q:Phone {model: nb.key})
+MERGE (p)-[s:SIMILAR_TO]->(q)
+SET s.score = nb.score, s.rank = nb.rank
+"""
+SIMILAR_EDGE_COUNT = "MATCH ()-[s:SIMILAR_TO]->() RETURN count(s) AS n"
+
+
+def spec_values(text: str) -> List[float]:
+    """
+    Vector de especificaciones de un teléfono (NaN donde falta el dato).
+    """
+    row = parse_text(text)
+    mp = [float(m) for m in re.findall(r"\d+(?:\.\d+)?", str(row.get("rear_camera_mp_list") or ""))]
+    row["rear_camera_max_mp"] = max(mp) if mp else None
+    row["is_5g"] = 1.0 if str(row.get("network_type", "")).lower() == "5g" else 0.0
+    row["nfc"] = 1.0 if row.get("nfc") else 0.0
+    out = []
+    for field, transform in SPEC_FEATURES:
+        v = row.get(field)
+        if v is None or v == "":
+            out.append(np.nan)
+            continue
+        v = float(v)
+        out.append(float(transform(v)) if transform and v > 0 else v)
+    return out
+
+
+def spec_matrix(specs: np.ndarray, stats: dict) -> np.ndarray:
+    """
+    Especificaciones estandarizadas (z-score con la media y desviación del catálogo);
+    un dato que falta cuenta como la media.
+    """
+    z = (specs - np.asarray(stats["mean"])) / np.asarray(stats["std"])
+    return np.nan_to_num(z, nan=0.0).astype(np.float32)
+
+
+def _unit(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def knn(features: np.ndarray, groups: np.ndarray, k: int, rows: Optional[np.ndarray] = None, block: int = 1024):
+    """
+    k vecinos más cercanos (coseno) de las filas `rows` de `features` (filas unitarias),
+    por bloques de `block` filas: cada bloque es un único producto de matrices. Se excluye
+    el propio teléfono y sus variantes (mismo grupo). Devuelve (posiciones, similitudes)
+    de forma (len(rows), k), con -1 / -inf si no hay suficientes candidatos.
+    """
+    n = len(features)
+    rows = np.arange(n) if rows is None else np.asarray(rows, dtype=np.int64)
+    idx = np.full((len(rows), k), -1, dtype=np.int64)
+    sims = np.full((len(rows), k), -np.inf, dtype=np.float32)
+    kk = min(k, n)
+    if not kk:
+        return idx, sims
+    for start in range(0, len(rows), block):
+        r = rows[start:start + block]
+        s = features[r] @ features.T
+        s[groups[r][:, None] == groups[None, :]] = -np.inf
+        top = np.argpartition(-s, kk - 1, axis=1)[:, :kk]
+        top_s = np.take_along_axis(s, top, axis=1)
+        order = np.argsort(-top_s, axis=1)
+        idx[start:start + len(r), :kk] = np.take_along_axis(top, order, axis=1)
+        sims[start:start + len(r), :kk] = np.take_along_axis(top_s, order, axis=1)
+    idx[~np.isfinite(sims)] = -1
+    return idx, sims
+
+
+class SimilarPhones:
+    """
+    Tabla de vecinos precalculada por 03_build_rag.py (index_store/similar.json): para
+    cada teléfono, sus k más parecidos combinando el embedding y las especificaciones
+    numéricas. "Alternativas al X" o "más barato que el X" se resuelven con una consulta
+    a esta tabla en vez de una recuperación semántica.
+    """
+
+    def __init__(self, phones: dict, k: int, spec_weight: float, stats: dict):
+        # phones: {clave: {"model", "price", "rating", "neighbors": [[clave, similitud], ...]}}
+        self.phones = phones
+        self.k = k
+        self.spec_weight = spec_weight
+        self.stats = stats
+        self._keys = list(phones)
+        self._matcher = ModelMatcher([phones[key]["model"] for key in self._keys])
+
+    def __len__(self) -> int:
+        return len(self.phones)
+
+    @property
+    def edges(self) -> int:
+        return sum(len(p["neighbors"]) for p in self.phones.values())
+
+    # --- cálculo ---
+
+    @staticmethod
+    def _catalog(store) -> tuple:
+        """
+        (claves, nombres, posición en la matriz, especificaciones) de cada teléfono del
+        NumpyVectorStore (el primer nodo de cada documento).
+        """
+        keys, models, positions, specs = [], [], [], []
+        seen = set()
+        for i, r in enumerate(store.rows):
+            key = r["ref_doc_id"] or r["id"]
+            if key in seen:
+                continue
+            seen.add(key)
+            keys.append(key)
+            models.append(r["metadata"].get("model") or key)
+            positions.append(i)
+            specs.append(spec_values(r["text"]))
+        return keys, models, np.asarray(positions, dtype=np.int64), np.asarray(specs, dtype=np.float64).reshape(len(keys), len(SPEC_FEATURES))
+
+    def _features(self, store, positions: np.ndarray, specs: np.ndarray) -> np.ndarray:
+        # Coseno combinado = (1 - w) * coseno(embedding) + w * coseno(especificaciones)
+        w = self.spec_weight
+        dense = _unit(np.asarray(store.vectors[positions], dtype=np.float32))
+        spec = _unit(spec_matrix(specs, self.stats))
+        return np.hstack([dense * np.sqrt(1 - w), spec * np.sqrt(w)]).astype(np.float32)
+
+    @staticmethod
+    def _groups(models: List[str]) -> np.ndarray:
+        # Variantes del mismo modelo (4G/5G) no cuentan como alternativa
+        _, groups = np.unique([NETWORK_SUFFIX.sub("", m.lower()) for m in models], return_inverse=True)
+        return groups
+
+    def _entry(self, model: str, spec: np.ndarray, keys: List[str], idx: np.ndarray, sims: np.ndarray) -> dict:
+        price, rating = spec[0], spec[1]
+        return {
+            "model": model,
+            "price": None if np.isnan(price) else round(float(np.expm1(price)), 2),
+            "rating": None if np.isnan(rating) else float(rating),
+            "neighbors": [[keys[j], round(float(s), 4)] for j, s in zip(idx, sims) if j >= 0],
+        }
+
+    @classmethod
+    def from_store(cls, store, k: int = 10, spec_weight: float = 0.3) -> "SimilarPhones":
+        """
+        Tabla completa a partir del índice vectorial ya guardado.
+        """
+        keys, models, positions, specs = cls._catalog(store)
+        std = np.nanstd(specs, axis=0) if len(keys) else np.ones(len(SPEC_FEATURES))
+        stats = {
+            "mean": np.nan_to_num(np.nanmean(specs, axis=0) if len(keys) else np.zeros(len(SPEC_FEATURES))).tolist(),
+            "std": np.where(np.nan_to_num(std) > 0, np.nan_to_num(std), 1.0).tolist(),
+        }
+        table = cls({}, k=k, spec_weight=spec_weight, stats=stats)
+        features = table._features(store, positions, specs)
+        idx, sims = knn(features, cls._groups(models), k)
+        phones = {key: table._entry(models[i], specs[i], keys, idx[i], sims[i]) for i, key in enumerate(keys)}
+        return cls(phones, k=k, spec_weight=spec_weight, stats=stats)
+
+    def refresh(self, store, changed: Iterable[str], removed: Iterable[str]) -> List[str]:
+        """
+        Actualiza la tabla tras una reindexación incremental. Se recalculan los teléfonos
+        nuevos o modificados, los que tenían alguno de ellos (o uno eliminado) entre sus
+        vecinos y aquellos para los que un teléfono nuevo o modificado supera ahora a su
+        k-ésimo vecino. Devuelve las claves recalculadas.
+        """
+        changed, removed = set(changed), set(removed)
+        keys, models, positions, specs = self._catalog(store)
+        pos = {key: i for i, key in enumerate(keys)}
+        for key in removed:
+            self.phones.pop(key, None)
+        touched = changed | removed
+        affected = {key for key in changed if key in pos}
+        affected |= {key for key, p in self.phones.items() if any(nb in touched for nb, _ in p["neighbors"])}
+
+        features = self._features(store, positions, specs)
+        groups = self._groups(models)
+        new = np.array([pos[key] for key in changed if key in pos], dtype=np.int64)
+        if len(new):
+            s = features[new] @ features.T
+            s[groups[new][:, None] == groups[None, :]] = -np.inf
+            best = s.max(axis=0)
+            kth = np.full(len(keys), -np.inf, dtype=np.float32)
+            for key, p in self.phones.items():
+                if key in pos and len(p["neighbors"]) >= self.k:
+                    kth[pos[key]] = p["neighbors"][-1][1]
+            affected |= {keys[j] for j in np.flatnonzero(best > kth)}
+
+        rows = np.array(sorted(pos[key] for key in affected if key in pos), dtype=np.int64)
+        idx, sims = knn(features, groups, self.k, rows=rows)
+        for n, i in enumerate(rows):
+            self.phones[keys[i]] = self._entry(models[i], specs[i], keys, idx[n], sims[n])
+        self._keys = list(self.phones)
+        self._matcher = ModelMatcher([self.phones[key]["model"] for key in self._keys])
+        return [keys[i] for i in rows]
+
+    # --- persistencia ---
+
+    @classmethod
+    def exists(cls, persist_dir) -> bool:
+        return (Path(persist_dir) / SIMILAR_FNAME).exists()
+
+    @classmethod
+    def load(cls, persist_dir) -> "SimilarPhones":
+        data = json.loads((Path(persist_dir) / SIMILAR_FNAME).read_text(encoding="utf-8"))
+        return cls(**data)
+
+    def persist(self, persist_dir) -> None:
+        path = Path(persist_dir) / SIMILAR_FNAME
+        data = {"phones": self.phones, "k": self.k, "spec_weight": self.spec_weight, "stats": self.stats}
+        tmp = path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(path)
+
+    # --- grafo ---
+
+    def write_edges(self, keys: Optional[Iterable[str]] = None, driver=None, batch_size: int = 500,
+                    database: Optional[str] = None) -> int:
+        """
+        Escribe en Neo4j las relaciones SIMILAR_TO (score, rank) de `keys` (por defecto,
+        todos). Devuelve cuántas relaciones se han escrito.
+        """
+        keys = list(self.phones) if keys is None else [k for k in keys if k in self.phones]
+        rows = [
+            {"key": key, "neighbors": [
+                {"key": nb, "score": s, "rank": r} for r, (nb, s) in enumerate(self.phones[key]["neighbors"], start=1)
+            ]}
+            for key in keys
+        ]
+        batches = [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+        write_batches(
+            driver or shared_driver(), lambda tx, batch: tx.run(SIMILAR_EDGES, rows=batch).consume(), batches,
+            database=database,
+        )
+        return sum(len(r["neighbors"]) for r in rows)
+
+    def edges_in_graph(self, driver=None, database: Optional[str] = None) -> int:
+        return read_query(SIMILAR_EDGE_COUNT, driver=driver, database=database)[0]["n"]
+
+    # --- consulta ---
+
+    def alternatives(self, question: str, limit: int) -> Optional[tuple]:
+        """
+        (modelo de referencia, [(modelo alternativo, similitud)], relación) si la pregunta
+        pide alternativas a un modelo concreto del catálogo; None en otro caso o si además
+        lleva restricciones duras (precio, RAM, NFC...), que resuelve el planificador.
+        relación: "cheaper", "better" o None; con relación, solo los vecinos que la cumplen.
+        """
+        words = tokenize(question)
+        text = " ".join(words)
+        if not ALTERNATIVES.search(text):
+            return None
+        found = self._matcher.match(question, limit=1)
+        if not found:
+            return None
+        # Las restricciones se buscan sin los nombres de modelo ("5g" de "oneplus 11 5g")
+        if plan_query(question, self._matcher):
+            return None
+        phone = self.phones[self._keys[found[0]]]
+        relation = "cheaper" if CHEAPER.search(text) else "better" if BETTER.search(text) else None
+
+        out = []
+        for key, score in phone["neighbors"]:
+            other = self.phones.get(key)
+            if other is None:
+                continue
+            if relation == "cheaper" and not (
+                other["price"] is not None and phone["price"] is not None and other["price"] < phone["price"]
+            ):
+                continue
+            if relation == "better" and not (
+                other["rating"] is not None and phone["rating"] is not None and other["rating"] > phone["rating"]
+            ):
+                continue
+            out.append((other["model"], score))
+        return phone["model"], out[:limit], relation
+
+
+RELATION_NOTES = {"cheaper": "más barato", "better": "mejor valorado"}
+
+
+class SimilarRetriever(BaseRetriever):
+    """
+    Delante del resto de recuperadores: si la pregunta pide alternativas a un modelo
+    concreto, devuelve su ficha y las de sus vecinos precalculados (sin embedding de la
+    pregunta ni búsqueda). Si no, decide el recuperador normal.
+    """
+
+    def __init__(self, index, similar: SimilarPhones, base: BaseRetriever, top_k: int = 6):
+        super().__init__(callback_manager=Settings.callback_manager)
+        self._index = index
+        self._similar = similar
+        self._base = base
+        self._top_k = top_k
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        question = extract_question(query_bundle.query_str)
+        with timed("similar_lookup"):
+            found = self._similar.alternatives(question, self._top_k - 1)
+        if found is None:
+            return self._base.retrieve(query_bundle)
+
+        model, others, relation = found
+        wanted = [model] + [m for m, _ in others]
+        filters = MetadataFilters(filters=[MetadataFilter(key="model", value=wanted, operator=FilterOperator.IN)])
+        by_model = {}
+        for n in self._index.vector_store.get_nodes(filters=filters):
+            by_model.setdefault(n.metadata.get("model"), n)
+        scores = [1.0] + [s for _, s in others]
+        nodes = [NodeWithScore(node=by_model[m], score=s) for m, s in zip(wanted, scores) if m in by_model]
+        if relation and not others:
+            note = (
+                f"Ninguno de los {self._similar.k} teléfonos más parecidos al {model} "
+                f"es {RELATION_NOTES[relation]} que él."
+            )
+            nodes.append(NodeWithScore(node=TextNode(text=note), score=1.0))
+        return nodes
@@ -0,0 +1,288 @@
+# app/snapshots.py
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+from app.quantization import CODES_FNAME, SCALE_FNAME
+from app.vector_store import NODES_FNAME, VECTORS_FNAME
+
+# index_store/ = raíz de instantáneas versionadas:
+#   CURRENT              nombre de la instantánea en servicio (se cambia con un rename atómico)
+#   snapshots/<versión>/ índice completo (vectores, BM25, vecinos, catálogo, huellas)
+#   staging/             la que están escribiendo 02_load_neo4j.py y 03_build_rag.py
+# Sin CURRENT (índices anteriores), la propia raíz es el índice.
+CURRENT_NAME = "CURRENT"
+SNAPSHOTS_DIRNAME = "snapshots"
+STAGING_DIRNAME = "staging"
+# Instantánea de la que se copió staging/ (si ya no es la actual, staging/ se rehace)
+BASE_NAME = "BASE"
+LEASE_PREFIX = ".lease-"
+# Ficheros que nuestros escritores siempre sustituyen (temporal + rename): se enlazan en
+# vez de copiarse. Cualquier otro (JSON de LlamaIndex, estado de un build a medias...) puede
+# reescribirse en el sitio y se copia, para no modificar a través del enlace la instantánea publicada.
+LINKED_NAMES = (VECTORS_FNAME, NODES_FNAME, CODES_FNAME, SCALE_FNAME)
+
+
+def _read(path: Path) -> Optional[str]:
+    try:
+        return path.read_text(encoding="utf-8").strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _write(path: Path, text: str) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    tmp.replace(path)
+
+
+def current_version(root) -> Optional[str]:
+    """
+    Nombre de la instantánea en servicio, o None con el formato antiguo (sin CURRENT).
+    """
+    version = _read(Path(root) / CURRENT_NAME)
+    if version and (Path(root) / SNAPSHOTS_DIRNAME / version).is_dir():
+        return version
+    return None
+
+
+def current_dir(root) -> Path:
+    """
+    Directorio del índice en servicio: la instantánea de CURRENT o, si no hay, la raíz.
+    """
+    version = current_version(root)
+    return Path(root) / SNAPSHOTS_DIRNAME / version if version else Path(root)
+
+
+def snapshot_version(root) -> str:
+    """
+    Versión de lo que hay en servicio (con el formato antiguo, la fecha de vectors.npy).
+    """
+    version = current_version(root)
+    if version:
+        return version
+    try:
+        return f"legacy-{(Path(root) / VECTORS_FNAME).stat().st_mtime_ns}"
+    except FileNotFoundError:
+        return "legacy"
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    if os.path.basename(src) in LINKED_NAMES:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass  # otro sistema de ficheros o sin enlaces duros: se copia
+    shutil.copy2(src, dst)
+
+
+def _reserved(root: Path):
+    names = {CURRENT_NAME, CURRENT_NAME + ".tmp", SNAPSHOTS_DIRNAME, STAGING_DIRNAME, STAGING_DIRNAME + ".tmp"}
+
+    def ignore(path, entries):
+        # En la raíz (formato antiguo) solo se copia el índice, no las instantáneas
+        top = Path(path) == root
+        return [e for e in entries if (top and e in names) or e.startswith(LEASE_PREFIX)]
+
+    return ignore
+
+
+def open_staging(root) -> Path:
+    """
+    Directorio donde escribe el pipeline. Si no existe (o se copió de una instantánea
+    que ya no es la actual y no hay un build a medias que reanudar), se crea como copia
+    de la instantánea en servicio para que 03_build_rag.py pueda actualizarla.
+    """
+    from app.index_builder import StreamingIndexWriter
+
+    root = Path(root)
+    staging = root / STAGING_DIRNAME
+    base = snapshot_version(root)
+    if staging.is_dir():
+        if _read(staging / BASE_NAME) == base or StreamingIndexWriter.pending(staging):
+            return staging
+        shutil.rmtree(staging)
+    tmp = root / (STAGING_DIRNAME + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    source = current_dir(root)
+    if source.is_dir():
+        shutil.copytree(source, tmp, copy_function=_link_or_copy, ignore=_reserved(root))
+    else:
+        tmp.mkdir(parents=True)
+    _write(tmp / BASE_NAME, base)
+    tmp.replace(staging)
+    return staging
+
+
+def publish(root, keep: int = 2) -> str:
+    """
+    Convierte staging/ en una instantánea nueva y la pone en servicio cambiando
+    CURRENT de una vez. Después borra las antiguas (collect_garbage). Devuelve la versión.
+    """
+    root = Path(root)
+    staging = root / STAGING_DIRNAME
+    version = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    target = root / SNAPSHOTS_DIRNAME / version
+    target.parent.mkdir(parents=True, exist_ok=True)
+    (staging / BASE_NAME).unlink(missing_ok=True)
+    staging.replace(target)
+    _write(root / CURRENT_NAME, version)
+    collect_garbage(root, keep=keep)
+    return version
+
+
+def _alive(pid: int) -> bool:
+    try:
+        import psutil
+
+        return psutil.pid_exists(pid)
+    except ImportError:
+        pass
+    if os.name == "nt":
+        return True  # os.kill(pid, 0) terminaría el proceso en Windows: se da por vivo
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # sin permiso para comprobarlo: se da por vivo
+    return True
+
+
+def take_lease(snapshot) -> Optional[Path]:
+    """
+    Marca la instantánea como cargada por este proceso (antes de empezar a cargarla).
+    None con el formato antiguo: la raíz nunca se borra.
+    """
+    snapshot = Path(snapshot)
+    if snapshot.parent.name != SNAPSHOTS_DIRNAME:
+        return None
+    lease = snapshot / f"{LEASE_PREFIX}{os.getpid()}"
+    lease.touch()
+    return lease
+
+
+def release_lease(lease: Optional[Path]) -> None:
+    if lease is not None:
+        lease.unlink(missing_ok=True)
+
+
+def in_use(snapshot: Path) -> bool:
+    """
+    True si algún proceso vivo tiene la instantánea cargada (fichero .lease-<pid>).
+    """
+    for lease in snapshot.glob(LEASE_PREFIX + "*"):
+        try:
+            pid = int(lease.name[len(LEASE_PREFIX):])
+        except ValueError:
+            continue
+        if _alive(pid):
+            return True
+        lease.unlink(missing_ok=True)  # de un proceso que ya no existe
+    return False
+
+
+def snapshot_bytes(snapshot) -> int:
+    """
+    Lo que ocupa la instantánea en disco: estimación de la memoria que usa una vez cargada.
+    """
+    snapshot = Path(snapshot)
+    # Con el formato antiguo es la raíz: no cuentan staging/ ni las instantáneas
+    skip = {SNAPSHOTS_DIRNAME, STAGING_DIRNAME, STAGING_DIRNAME + ".tmp"}
+    total = 0
+    for path in snapshot.rglob("*"):
+        if path.relative_to(snapshot).parts[0] in skip:
+            continue
+        try:
+            if path.is_file():
+                total += path.stat().st_size
+        except OSError:
+            pass  # borrado mientras se recorría
+    return total
+
+
+def collect_garbage(root, keep: int = 2) -> list:
+    """
+    Borra las instantáneas salvo la actual, las `keep` más recientes y las que algún
+    servidor tenga todavía cargadas. Devuelve las versiones borradas.
+    """
+    root = Path(root)
+    current = current_version(root)
+    snapshots = sorted((p for p in (root / SNAPSHOTS_DIRNAME).glob("*") if p.is_dir()), key=lambda p: p.name)
+    removed = []
+    for snapshot in snapshots[:max(0, len(snapshots) - keep)]:
+        if snapshot.name == current or in_use(snapshot):
+            continue
+        shutil.rmtree(snapshot, ignore_errors=True)
+        if not snapshot.exists():
+            removed.append(snapshot.name)
+    return removed
+
+
+class ServingSnapshot:
+    """
+    Motor cargado desde una instantánea. Cada petición toma la referencia una vez y la
+    usa hasta terminar (use() o enter()/exit()): tras un cambio de instantánea, las que
+    estaban en curso acaban con la anterior. `lease` (take_lease) impide que
+    collect_garbage() la borre mientras está cargada.
+    """
+
+    def __init__(self, version: str, path, engine, spec_table=None, lease: Optional[Path] = None,
+                 catalog: Optional[str] = None):
+        self.version = version
+        self.path = Path(path)
+        self.engine = engine
+        self.spec_table = spec_table
+        self.catalog = catalog
+        self.size_bytes = snapshot_bytes(self.path)
+        self.loaded_at = time.time()
+        self.active = 0
+        self._cond = threading.Condition()
+        self._lease = lease
+
+    def enter(self) -> "ServingSnapshot":
+        with self._cond:
+            self.active += 1
+        return self
+
+    def exit(self) -> None:
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def use(self):
+        self.enter()
+        try:
+            yield self
+        finally:
+            self.exit()
+
+    def drain(self, timeout: float) -> bool:
+        """
+        Espera a que terminen las peticiones en curso (False si se agota el tiempo).
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self.active == 0, timeout=timeout)
+
+    def release(self) -> None:
+        release_lease(self._lease)
+
+    def stats(self) -> dict:
+        return {
+            "catalog": self.catalog,
+            "version": self.version,
+            "path": str(self.path),
+            "size_mb": round(self.size_bytes / (1024 * 1024), 1),
+            "loaded_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.loaded_at)),
+            "active": self.active,
+        }
@@ -0,0 +1,316 @@
+# app/vector_store.py
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, List, Optional, Sequence
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode, NodeRelationship, RelatedNodeInfo, TextNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    FilterCondition,
+    FilterOperator,
+    MetadataFilter,
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+from llama_index.core.vector_stores.utils import build_metadata_filter_fn
+
+from app.quantization import Int8Codes, block_dot, block_matmul
+
+# Matriz de embeddings (filas normalizadas L2) + tabla lateral con id, documento, texto y metadatos
+VECTORS_FNAME = "vectors.npy"
+NODES_FNAME = "vector_nodes.json"
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def node_row(node: BaseNode) -> dict:
+    """
+    Fila de la tabla lateral (vector_nodes.json) para un nodo.
+    """
+    return {"id": node.node_id, "ref_doc_id": node.ref_doc_id, "text": node.get_content(), "metadata": node.metadata}
+
+
+def mmr_select(scores: np.ndarray, vectors: np.ndarray, top_k: int, threshold: float):
+    """
+    MMR vectorizado con la misma regla que get_top_k_mmr_embeddings de LlamaIndex:
+    cada candidato se penaliza por su parecido con el último elegido.
+    Devuelve (posiciones elegidas, puntuaciones MMR).
+    """
+    n = len(scores)
+    remaining = np.ones(n, dtype=bool)
+    first = int(np.argmax(scores))
+    chosen, chosen_scores = [first], [float(scores[first] * threshold)]
+    remaining[first] = False
+    while len(chosen) < min(top_k, n):
+        last = np.asarray(vectors[chosen[-1]], dtype=np.float32)
+        overlap = vectors @ last if vectors.dtype == np.float32 else block_dot(vectors, last)
+        mmr = threshold * scores - (1 - threshold) * overlap
+        mmr[~remaining] = -np.inf
+        best = int(np.argmax(mmr))
+        chosen.append(best)
+        chosen_scores.append(float(mmr[best]))
+        remaining[best] = False
+    return chosen, chosen_scores
+
+
+class NumpyVectorStore(BasePydanticVectorStore):
+    """
+    Vector store sobre una matriz NumPy contigua (float32 o float16) persistida en .npy.
+    Al cargar se abre con mmap (sin copiar) y la búsqueda es un producto matriz-vector.
+    Guarda también el texto de cada nodo, así que el docstore no necesita duplicarlo.
+    Con quantization="int8" la búsqueda recorre los códigos int8 (la cuarta parte de
+    memoria) y solo lee de la matriz exacta los rerank * top_k mejores candidatos.
+    """
+
+    stores_text: bool = True
+    dtype: str = "float32"
+    quantization: str = "none"
+    rerank: int = 4
+
+    _vectors: np.ndarray = PrivateAttr()
+    _rows: List[dict] = PrivateAttr()
+    _models: np.ndarray = PrivateAttr()
+    _dirty: bool = PrivateAttr(default=False)
+    _codes: Optional[Int8Codes] = PrivateAttr(default=None)
+    # Puntuaciones precalculadas por batch(): bytes del embedding -> fila de puntuaciones
+    _batch_scores: dict = PrivateAttr(default_factory=dict)
+    _batch_lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    def __init__(self, vectors: Optional[np.ndarray] = None, rows: Optional[List[dict]] = None, dtype: str = "float32",
+                 codes: Optional[Int8Codes] = None, **kwargs: Any):
+        super().__init__(dtype=dtype, **kwargs)
+        self._vectors = vectors if vectors is not None else np.zeros((0, 0), dtype=dtype)
+        self._rows = rows or []
+        self._models = np.array([r["metadata"].get("model") for r in self._rows], dtype=object)
+        if self.quantization == "int8":
+            # Sin códigos guardados (o más antiguos que la matriz): se calculan al cargar
+            self._codes = codes if codes is not None and len(codes) == len(self._rows) else Int8Codes.from_vectors(self._vectors)
+        elif self.quantization != "none":
+            raise ValueError(f"Cuantización no soportada: {self.quantization}")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "NumpyVectorStore"
+
+    @classmethod
+    def exists(cls, persist_dir) -> bool:
+        return (Path(persist_dir) / VECTORS_FNAME).exists()
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir, mmap: bool = True, quantization: str = "none", rerank: int = 4) -> "NumpyVectorStore":
+        persist_dir = Path(persist_dir)
+        vectors = np.load(persist_dir / VECTORS_FNAME, mmap_mode="r" if mmap else None)
+        rows = json.loads((persist_dir / NODES_FNAME).read_text(encoding="utf-8"))
+        codes = None
+        if quantization == "int8" and Int8Codes.exists(persist_dir, persist_dir / VECTORS_FNAME):
+            codes = Int8Codes.load(persist_dir, mmap=mmap)
+        return cls(vectors=vectors, rows=rows, dtype=str(vectors.dtype), codes=codes, quantization=quantization, rerank=rerank)
+
+    @property
+    def client(self) -> None:
+        return None
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._vectors
+
+    @property
+    def rows(self) -> List[dict]:
+        return self._rows
+
+    @property
+    def codes(self) -> Optional[Int8Codes]:
+        return self._codes
+
+    @contextmanager
+    def batch(self, embeddings: Sequence[Sequence[float]]):
+        """
+        Puntúa varias consultas con una sola multiplicación de matrices: la matriz se
+        recorre una vez por lote y no una vez por pregunta. Dentro del bloque, query()
+        con uno de esos embeddings reutiliza su fila (con int8, la de los códigos).
+        """
+        queries = np.asarray(embeddings, dtype=np.float32)
+        keys = [q.tobytes() for q in queries]
+        if len(queries) and len(self._rows):
+            unit = _normalize(queries.copy())
+            if self._codes is not None:
+                scores = self._codes.scores_many(unit)
+            elif self._vectors.dtype == np.float32:
+                scores = unit @ np.asarray(self._vectors).T
+            else:
+                scores = block_matmul(self._vectors, unit)
+            with self._batch_lock:
+                self._batch_scores.update(zip(keys, scores))
+        try:
+            yield self
+        finally:
+            with self._batch_lock:
+                for key in keys:
+                    self._batch_scores.pop(key, None)
+
+    def _prefetched(self, query_embedding) -> Optional[np.ndarray]:
+        if not self._batch_scores:
+            return None
+        scores = self._batch_scores.get(np.asarray(query_embedding, dtype=np.float32).tobytes())
+        # Si el índice ha cambiado desde batch(), la fila ya no vale
+        return scores if scores is not None and len(scores) == len(self._rows) else None
+
+    # --- escritura ---
+
+    def add(self, nodes: Sequence[BaseNode], **kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+        new = _normalize(np.asarray([n.get_embedding() for n in nodes], dtype=np.float32))
+        new = new.astype(self.dtype)
+        if len(self._rows):
+            self._vectors = np.concatenate([self._vectors, new])
+        else:
+            self._vectors = new
+        if self._codes is not None:
+            self._codes = self._codes.add(new) if len(self._codes) else Int8Codes.from_vectors(new)
+        self._rows += [node_row(n) for n in nodes]
+        self._models = np.concatenate(
+            [self._models, np.array([n.metadata.get("model") for n in nodes], dtype=object)]
+        )
+        self._dirty = True
+        return [n.node_id for n in nodes]
+
+    def _drop(self, keep: np.ndarray) -> None:
+        if keep.all():
+            return
+        self._vectors = self._vectors[keep]
+        if self._codes is not None:
+            self._codes = self._codes.take(keep)
+        self._rows = [r for r, k in zip(self._rows, keep) if k]
+        self._models = self._models[keep]
+        self._dirty = True
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        self._drop(np.array([r["ref_doc_id"] != ref_doc_id for r in self._rows], dtype=bool))
+
+    def delete_nodes(self, node_ids: Optional[List[str]] = None, filters: Optional[MetadataFilters] = None, **delete_kwargs: Any) -> None:
+        self._drop(~self._mask(node_ids=node_ids, filters=filters))
+
+    def clear(self) -> None:
+        self._drop(np.zeros(len(self._rows), dtype=bool))
+
+    def persist(self, persist_path: str, fs: Any = None) -> None:
+        # StorageContext pasa la ruta de default__vector_store.json: se escribe al lado
+        persist_dir = Path(os.path.dirname(persist_path))
+        persist_dir.mkdir(parents=True, exist_ok=True)
+        if not self._dirty and (persist_dir / VECTORS_FNAME).exists():
+            return
+        tmp = persist_dir / (VECTORS_FNAME + ".tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, np.ascontiguousarray(self._vectors))
+        tmp.replace(persist_dir / VECTORS_FNAME)
+        tmp = persist_dir / (NODES_FNAME + ".tmp")
+        tmp.write_text(json.dumps(self._rows, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(persist_dir / NODES_FNAME)
+        if self._codes is not None:
+            self._codes.persist(persist_dir)
+        self._dirty = False
+
+    # --- lectura ---
+
+    def _to_node(self, i: int) -> TextNode:
+        r = self._rows[i]
+        relationships = {}
+        if r["ref_doc_id"]:
+            relationships[NodeRelationship.SOURCE] = RelatedNodeInfo(node_id=r["ref_doc_id"])
+        return TextNode(id_=r["id"], text=r["text"], metadata=r["metadata"], relationships=relationships)
+
+    def _mask(self, node_ids=None, doc_ids=None, filters: Optional[MetadataFilters] = None) -> np.ndarray:
+        n = len(self._rows)
+        mask = np.ones(n, dtype=bool)
+        # VectorStoreIndex.as_retriever() pasa node_ids=[] cuando el store guarda el texto
+        if node_ids:
+            wanted = set(node_ids)
+            mask &= np.fromiter((r["id"] in wanted for r in self._rows), dtype=bool, count=n)
+        if doc_ids:
+            wanted = set(doc_ids)
+            mask &= np.fromiter((r["ref_doc_id"] in wanted for r in self._rows), dtype=bool, count=n)
+        if not filters or not filters.filters:
+            return mask
+
+        # Camino rápido: filtros por modelo (EQ / IN) con la tabla lateral vectorizada
+        simple = all(
+            isinstance(f, MetadataFilter) and f.key == "model"
+            and f.operator in (FilterOperator.EQ, FilterOperator.IN)
+            for f in filters.filters
+        )
+        if simple and (filters.condition or FilterCondition.AND) == FilterCondition.AND:
+            for f in filters.filters:
+                values = f.value if f.operator == FilterOperator.IN else [f.value]
+                mask &= np.isin(self._models, list(values))
+            return mask
+
+        match = build_metadata_filter_fn(lambda i: self._rows[i]["metadata"], filters)
+        mask &= np.fromiter((match(i) for i in range(n)), dtype=bool, count=n)
+        return mask
+
+    def get_nodes(self, node_ids: Optional[List[str]] = None, filters: Optional[MetadataFilters] = None) -> List[BaseNode]:
+        mask = self._mask(node_ids=node_ids, filters=filters)
+        return [self._to_node(i) for i in np.flatnonzero(mask)]
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if not len(self._rows):
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+
+        mask = self._mask(node_ids=query.node_ids, doc_ids=query.doc_ids, filters=query.filters)
+        candidates = np.flatnonzero(mask)
+        if not len(candidates):
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+
+        q = np.asarray(query.query_embedding, dtype=np.float32)
+        q /= np.linalg.norm(q) or 1.0
+        pre = self._prefetched(query.query_embedding)
+        full = len(candidates) == len(self._rows)
+        k = min(query.similarity_top_k, len(candidates))
+        shortlist = k * max(1, self.rerank)
+        if self._codes is not None and shortlist < len(candidates):
+            # Preselección con los códigos int8; el ranking final (y el MMR) con los vectores exactos
+            if pre is not None:
+                approx = pre if full else pre[candidates]
+            else:
+                approx = self._codes.scores(q, None if full else candidates)
+            candidates = np.sort(candidates[np.argpartition(-approx, shortlist - 1)[:shortlist]])
+            pre = None  # eran puntuaciones aproximadas
+            full = False
+        sub = self._vectors if full else self._vectors[candidates]
+        if pre is not None and self._codes is None:
+            scores = pre if full else pre[candidates]
+        elif sub.dtype == np.float32:
+            scores = sub @ q
+        else:
+            scores = block_dot(sub, q)  # float16: en float32 por bloques, sin BLAS es muy lento
+
+        if query.mode == VectorStoreQueryMode.MMR:
+            threshold = query.mmr_threshold
+            if threshold is None:
+                threshold = kwargs.get("mmr_threshold")
+            picked, sims = mmr_select(scores, sub, k, 0.5 if threshold is None else threshold)
+        elif query.mode == VectorStoreQueryMode.DEFAULT:
+            top = np.argpartition(-scores, k - 1)[:k]
+            picked = top[np.argsort(-scores[top])].tolist()
+            sims = scores[picked].tolist()
+        else:
+            raise ValueError(f"Modo de consulta no soportado: {query.mode}")
+
+        rows = [int(candidates[p]) for p in picked]
+        return VectorStoreQueryResult(
+            nodes=[self._to_node(i) for i in rows],
+            similarities=sims,
+            ids=[self._rows[i]["id"] for i in rows],
+        )
@@ -1,6 +1,8 @@
+import json
 import os
 import sys
 import subprocess
+import urllib.request
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -9,6 +11,7 @@ sys.path.append(str(Path(__file__).resolve().parents[1]))
 
 load_dotenv()
 
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL")
 OLLAMA_EMBED_MODEL = os.getenv("OLLAMA_EMBED_MODEL")
 
@@ -18,8 +21,29 @@ if not OLLAMA_MODEL or not OLLAMA_EMBED_MODEL:
 
 MODELS = [OLLAMA_MODEL, OLLAMA_EMBED_MODEL]
 
+def installed_models() -> set:
+    """
+    Modelos ya descargados según /api/tags (vacío si Ollama no responde: se intenta el pull).
+    """
+    try:
+        with urllib.request.urlopen(OLLAMA_BASE_URL.rstrip("/") + "/api/tags", timeout=3) as r:
+            data = json.load(r)
+    except Exception:
+        return set()
+    names = set()
+    for model in data.get("models", []):
+        name = model.get("name") or model.get("model") or ""
+        names.add(name)
+        if name.endswith(":latest"):
+            names.add(name[: -len(":latest")])
+    return names
+
 def main():
+    present = installed_models()
     for m in MODELS:
+        if m in present:
+            print(f"Model already present: {m}")
+            continue
         print(f"Pulling model: {m}")
         try:
             subprocess.run(["ollama", "pull", m], check=True)
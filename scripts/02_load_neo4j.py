@@ -4,19 +4,46 @@ from pathlib import Path
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 # --- fin bootstrap ---
 
-import math
+import argparse
+import threading
+import time
 import pandas as pd
-from app.neo4j_utils import get_driver, run_cypher, run_cypher_many
+from app.catalog import CATALOG_DIRNAME, Catalog
+from app.config import NEO4J_BATCH_SIZE, NEO4J_LOAD_WORKERS
+from app.fingerprint import mark_graph_current, row_fingerprint
+from app.ingest_utils import normalize_frame
+from app.metrics import stage_report, timed
+from app.neo4j_utils import get_driver, run_cypher, run_cypher_many, write_batches
+from app.shards import UnknownCatalogError, get_catalog
+from app.snapshots import open_staging
 
-CSV_PATH = "data/smartphone-specification.csv"
-BATCH_SIZE = 200
-INR_TO_EUR = 0.0094
+# Base de datos del catálogo (solo Neo4j Enterprise; en Community tiene que existir ya)
+CREATE_DATABASE = "CREATE DATABASE $name IF NOT EXISTS WAIT"
 
-# (Opcional) Para desarrollo: borrar todo antes de cargar
+# (Opcional) Para desarrollo: borrar todo antes de cargar (--full)
 WIPE = """
 MATCH (n) DETACH DELETE n;
 """
 
+# Huellas ya cargadas, para la carga incremental
+EXISTING_HASHES = """
+MATCH (p:Phone) RETURN p.model AS model, p.row_hash AS row_hash;
+"""
+
+DELETE_PHONES = """
+UNWIND $models AS m
+MATCH (p:Phone {model: m})
+DETACH DELETE p;
+"""
+
+# Categorías que se han quedado sin ningún teléfono
+DELETE_ORPHAN_CATEGORIES = """
+MATCH (c)
+WHERE (c:OS OR c:Chipset OR c:Network OR c:DisplayType OR c:MemoryCardType)
+  AND NOT (c)<--()
+DELETE c;
+"""
+
 CONSTRAINTS = """
 CREATE CONSTRAINT phone_model_unique IF NOT EXISTS
 FOR (p:Phone) REQUIRE p.model IS UNIQUE;
@@ -37,13 +64,43 @@ CREATE CONSTRAINT memcardtype_name_unique IF NOT EXISTS
 FOR (m:MemoryCardType) REQUIRE m.name IS UNIQUE;
 """
 
-LOAD_BATCH = """
-UNWIND $rows AS row
-WITH row
-WHERE row.model IS NOT NULL AND trim(row.model) <> ''
+# Índices de rango para el prefiltrado de app/query_planner.py
+INDEXES = """
+CREATE INDEX phone_price IF NOT EXISTS FOR (p:Phone) ON (p.price);
+CREATE INDEX phone_ram_gb IF NOT EXISTS FOR (p:Phone) ON (p.ram_gb);
+CREATE INDEX phone_storage_gb IF NOT EXISTS FOR (p:Phone) ON (p.storage_gb);
+CREATE INDEX phone_battery_mah IF NOT EXISTS FOR (p:Phone) ON (p.battery_mah);
+CREATE INDEX phone_refresh_rate_hz IF NOT EXISTS FOR (p:Phone) ON (p.refresh_rate_hz);
+CREATE INDEX phone_screen_size_in IF NOT EXISTS FOR (p:Phone) ON (p.screen_size_in);
+CREATE INDEX phone_nfc IF NOT EXISTS FOR (p:Phone) ON (p.nfc);
+"""
 
-// Phone
+# Categorías compartidas: (etiqueta, clave de la fila, relación desde Phone)
+CATEGORIES = [
+    ("OS", "os", "RUNS"),
+    ("Chipset", "chipset", "HAS_CHIPSET"),
+    ("Network", "network_type", "SUPPORTS_NETWORK"),
+    ("DisplayType", "display_type", "HAS_DISPLAY_TYPE"),
+    ("MemoryCardType", "memory_card_type", "SUPPORTS_MEMORY_CARD_TYPE"),
+]
+
+# Pasada 1: nodos de categoría distintos (una sola vez, antes que los teléfonos)
+MERGE_CATEGORY = """
+UNWIND $names AS name
+MERGE (:{label} {{name: name}});
+"""
+
+# Pasada 2a: teléfonos
+LOAD_PHONES = """
+UNWIND $rows AS row
 MERGE (p:Phone {model: toLower(row.model)})
+
+// Si el teléfono ya existía (fila modificada), sus categorías pueden haber cambiado
+WITH p, row
+OPTIONAL MATCH (p)-[old:RUNS|HAS_CHIPSET|SUPPORTS_NETWORK|HAS_DISPLAY_TYPE|SUPPORTS_MEMORY_CARD_TYPE]->()
+DELETE old
+
+WITH DISTINCT p, row
 SET
   p.model_raw = row.model,
   p.price = row.price,
@@ -60,36 +117,17 @@ SET
   p.rear_camera_count = row.rear_camera_count,
   p.front_camera_mp = row.front_camera_mp,
   p.memory_card_supported = row.memory_card_supported,
-  p.text = row.text
-
-// Relaciones "de grafo" (categorías compartidas)
-WITH p, row
+  p.text = row.text,
+  p.row_hash = row.row_hash;
+"""
 
-FOREACH (_ IN CASE WHEN row.os <> '' THEN [1] ELSE [] END |
-  MERGE (o:OS {name: row.os})
-  MERGE (p)-[:RUNS]->(o)
-)
-
-FOREACH (_ IN CASE WHEN row.chipset <> '' THEN [1] ELSE [] END |
-  MERGE (c:Chipset {name: row.chipset})
-  MERGE (p)-[:HAS_CHIPSET]->(c)
-)
-
-FOREACH (_ IN CASE WHEN row.network_type <> '' THEN [1] ELSE [] END |
-  MERGE (n:Network {name: row.network_type})
-  MERGE (p)-[:SUPPORTS_NETWORK]->(n)
-)
-
-FOREACH (_ IN CASE WHEN row.display_type <> '' THEN [1] ELSE [] END |
-  MERGE (d:DisplayType {name: row.display_type})
-  MERGE (p)-[:HAS_DISPLAY_TYPE]->(d)
-)
-
-// Solo si soporta tarjeta y hay tipo
-FOREACH (_ IN CASE WHEN row.memory_card_supported = true AND row.memory_card_type <> '' THEN [1] ELSE [] END |
-  MERGE (m:MemoryCardType {name: row.memory_card_type})
-  MERGE (p)-[:SUPPORTS_MEMORY_CARD_TYPE]->(m)
-);
+# Pasada 2b: relaciones "de grafo". Las categorías ya existen (MATCH por constraint único)
+# y las relaciones antiguas se acaban de borrar, así que basta con CREATE
+LINK_CATEGORY = """
+UNWIND $links AS link
+MATCH (p:Phone {{model: toLower(link.model)}})
+MATCH (c:{label} {{name: link.name}})
+CREATE (p)-[:{rel}]->(c);
 """
 
 COUNT = "MATCH (p:Phone) RETURN count(p) AS n;"
@@ -97,105 +135,136 @@ REL_COUNT = """
 MATCH ()-[r]->() RETURN type(r) AS rel, count(r) AS n ORDER BY n DESC;
 """
 
-def to_bool(v) -> bool:
-    if isinstance(v, bool):
-        return v
-    if v is None or (isinstance(v, float) and math.isnan(v)):
-        return False
-    s = str(v).strip().lower()
-    return s in ("true", "1", "yes")
-
-def to_int(v):
-    if v is None or (isinstance(v, float) and math.isnan(v)):
-        return None
-    try:
-        return int(float(v))
-    except:
-        return None
+def category_name(row: dict, key: str) -> str:
+    # Solo se enlaza el tipo de tarjeta si el teléfono admite tarjeta
+    if key == "memory_card_type" and not row["memory_card_supported"]:
+        return ""
+    return row[key]
+
+def merge_categories(tx, rows: list):
+    for label, key, _ in CATEGORIES:
+        names = sorted({category_name(r, key) for r in rows} - {""})
+        if names:
+            tx.run(MERGE_CATEGORY.format(label=label), names=names).consume()
+
+def load_batch(tx, batch: list):
+    tx.run(LOAD_PHONES, rows=batch).consume()
+    for label, key, rel in CATEGORIES:
+        # Ordenadas por categoría: los hilos bloquean los nodos compartidos en el mismo orden
+        links = sorted(
+            ({"model": r["model"], "name": category_name(r, key)} for r in batch if category_name(r, key)),
+            key=lambda link: link["name"],
+        )
+        if links:
+            tx.run(LINK_CATEGORY.format(label=label, rel=rel), links=links).consume()
+
+def ensure_database(driver, name: str) -> None:
+    from neo4j.exceptions import Neo4jError
 
-def to_float(v):
-    if v is None or (isinstance(v, float) and math.isnan(v)):
-        return None
     try:
-        return float(v)
-    except:
-        return None
-
-def build_text(row: dict) -> str:
-    # Formato estable tipo key=value (suele ir muy bien para retrieval)
-    return (
-        f"Model={row.get('model','')}; "
-        f"Price_EUR={row.get('price')}; "
-        f"Rating={row.get('rating')}; "
-        f"OS={row.get('os','')}; "
-        f"Network={row.get('network_type','')}; "
-        f"NFC={str(row.get('nfc')).lower()}; "
-        f"VoLTE={str(row.get('volte')).lower()}; "
-        f"IRBlaster={str(row.get('ir_blaster')).lower()}; "
-        f"Chipset={row.get('chipset','')}; "
-        f"RAM_GB={row.get('ram_gb')}; "
-        f"Storage_GB={row.get('storage_gb')}; "
-        f"Battery_mAh={row.get('battery_mah')}; "
-        f"Screen_in={row.get('screen_size_in')}; "
-        f"RefreshRate_Hz={row.get('refresh_rate_hz')}; "
-        f"DisplayType={row.get('display_type','')}; "
-        f"RearCameras={row.get('rear_camera_mp_list','')}; "
-        f"RearCameraCount={row.get('rear_camera_count')}; "
-        f"FrontCamera_MP={row.get('front_camera_mp')}; "
-        f"MemoryCardSupported={str(row.get('memory_card_supported')).lower()}; "
-        f"MemoryCardType={row.get('memory_card_type','')}"
+        with driver.session(database="system") as s:
+            s.run(CREATE_DATABASE, name=name).consume()
+    except Neo4jError as e:
+        print(f"Aviso: no se pudo crear la base de datos '{name}' ({e.message}); se usará si ya existe")
+
+def bulk_load(driver, rows: list, batch_size: int, workers: int, database=None):
+    """
+    Carga en dos pasadas: primero todas las categorías distintas y después los
+    teléfonos con sus relaciones, en lotes paralelos de una transacción cada uno.
+    """
+    t0 = time.perf_counter()
+    with driver.session(database=database) as s:
+        s.execute_write(merge_categories, rows)
+
+    batches = [rows[i:i+batch_size] for i in range(0, len(rows), batch_size)]
+    lock = threading.Lock()
+    done = [0]
+
+    def progress(n):
+        with lock:
+            done[0] += n
+            print(f"Cargadas {done[0]}/{len(rows)} filas")
+
+    write_batches(driver, load_batch, batches, workers=workers, progress=progress, database=database)
+    elapsed = time.perf_counter() - t0
+    print(
+        f"Carga: {len(rows)} filas en {len(batches)} lotes de {batch_size} con "
+        f"{min(workers, len(batches))} hilos, {elapsed:.2f}s ({len(rows) / elapsed:.0f} filas/s)"
     )
 
 def main():
-    df = pd.read_csv(CSV_PATH)
-
-    rows = []
-    for _, r in df.iterrows():
-        model = r.get("model")
-        if pd.isna(model) or str(model).strip() == "":
-            continue
-
-        price_inr = to_float(r.get("price"))
-        price_eur = round(price_inr * INR_TO_EUR, 2) if price_inr is not None else None
-
-        row = {
-            "model": str(model).strip(),
-            "price": price_eur,
-            "rating": to_float(r.get("rating")),
-            "os": "" if pd.isna(r.get("os")) else str(r.get("os")).strip(),
-            "network_type": "" if pd.isna(r.get("network_type")) else str(r.get("network_type")).strip(),
-            "volte": to_bool(r.get("VoLTE")),
-            "nfc": to_bool(r.get("NFC")),
-            "ir_blaster": to_bool(r.get("ir_blaster")),
-            "chipset": "" if pd.isna(r.get("chipset")) else str(r.get("chipset")).strip(),
-            "ram_gb": to_float(r.get("ram_gb")),
-            "storage_gb": to_float(r.get("storage_gb")), 
-            "battery_mah": to_int(r.get("battery_mah")),
-            "screen_size_in": to_float(r.get("screen_size_in")),
-            "refresh_rate_hz": to_float(r.get("refresh_rate_hz")),
-            "display_type": "" if pd.isna(r.get("display_type")) else str(r.get("display_type")).strip(),
-            "rear_camera_mp_list": "" if pd.isna(r.get("rear_camera_mp_list")) else str(r.get("rear_camera_mp_list")).strip(),
-            "rear_camera_count": to_int(r.get("rear_camera_count")),
-            "front_camera_mp": to_float(r.get("front_camera_mp")),
-            "memory_card_supported": str(r.get("memory_card_supported", "")).strip() == "1",
-            "memory_card_type": "" if pd.isna(r.get("memory_card_type")) else str(r.get("memory_card_type")).strip(),
-        }
-        row["text"] = build_text(row)
-        rows.append(row)
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Borra el grafo y recarga todas las filas (por defecto: carga incremental)",
+    )
+    parser.add_argument("--batch-size", type=int, default=NEO4J_BATCH_SIZE, help="Filas por transacción")
+    parser.add_argument("--workers", type=int, default=NEO4J_LOAD_WORKERS, help="Transacciones en paralelo")
+    parser.add_argument("--catalog", help="Catálogo de catalogs.json (por defecto, DEFAULT_CATALOG o el primero)")
+    args = parser.parse_args()
+
+    try:
+        spec = get_catalog(args.catalog)
+    except UnknownCatalogError:
+        parser.error(f"no existe el catálogo '{args.catalog}' en catalogs.json")
+    database = spec.database
+    print(f"Catálogo {spec.name}: {spec.csv_path} ({spec.currency}, x{spec.to_eur} a EUR) -> Neo4j {database or '(por defecto)'}")
+
+    with timed("read_csv"):
+        df = pd.read_csv(spec.csv_path)
+
+    rows = {}
+    with timed("normalize"):
+        for row in normalize_frame(df, spec.to_eur):
+            row["row_hash"] = row_fingerprint(row)
+            # Un único Phone por modelo (MERGE por toLower(model)): gana la última fila
+            rows[row["model"].lower()] = row
+    catalog_rows = list(rows.values())
 
     driver = get_driver()
     try:
-        # Para desarrollo: limpia todo (si NO quieres esto, comenta la línea)
-        run_cypher(driver, WIPE)
+        if database:
+            ensure_database(driver, database)
+        if args.full:
+            run_cypher(driver, WIPE, database=database)
+
+        with timed("schema"):
+            run_cypher_many(driver, CONSTRAINTS, database=database)
+            run_cypher_many(driver, INDEXES, database=database)
+
+        with timed("diff"), driver.session(database=database) as s:
+            existing = {rec["model"]: rec["row_hash"] for rec in s.run(EXISTING_HASHES)}
+
+        removed = sorted(set(existing) - set(rows))
+        changed = [r for key, r in rows.items() if existing.get(key) != r["row_hash"]]
+        print(
+            f"Cambios: {len(changed)} nuevos/modificados, {len(removed)} eliminados, "
+            f"{len(rows) - len(changed)} sin cambios"
+        )
+        rows = changed
+
+        with timed("neo4j_write"):
+            if removed:
+                run_cypher(driver, DELETE_PHONES, {"models": removed}, database=database)
+
+            if rows:
+                bulk_load(driver, rows, max(1, args.batch_size), args.workers, database=database)
+
+            if removed or rows:
+                run_cypher(driver, DELETE_ORPHAN_CATEGORIES, database=database)
 
-        run_cypher_many(driver, CONSTRAINTS)
+        # Instantánea columnar (rankings y agregados del chat), con las mismas filas que el grafo.
+        # Va a <índice del catálogo>/staging/: se pone en servicio con el índice al terminar 03_build_rag.py
+        with timed("catalog"):
+            staging = open_staging(spec.persist_dir)
+            Catalog.from_rows(catalog_rows).persist(staging / CATALOG_DIRNAME)
+        print(f"Catálogo columnar: {len(catalog_rows)} teléfonos en {staging / CATALOG_DIRNAME}/")
 
-        for i in range(0, len(rows), BATCH_SIZE):
-            batch = rows[i:i+BATCH_SIZE]
-            run_cypher(driver, LOAD_BATCH, {"rows": batch})
-            print(f"Inserted batch {i//BATCH_SIZE + 1} ({len(batch)} rows)")
+        # Al final, con todo escrito: el servidor solo omite este paso si el grafo sigue así
+        mark_graph_current(driver, spec.csv_path, database=database)
 
-        with driver.session() as s:
+        with driver.session(database=database) as s:
             n = s.run(COUNT).single()["n"]
             print(f"OK. Phones cargados: {n}")
             print("Relaciones creadas:")
@@ -203,6 +272,7 @@ def main():
                 print(f"  {rec['rel']}: {rec['n']}")
     finally:
         driver.close()
+    print(stage_report())
 
 if __name__ == "__main__":
     main()
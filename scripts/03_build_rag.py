@@ -1,30 +1,165 @@
-import os
+import argparse
 from llama_index.core import Document
 import sys
 from pathlib import Path
+from typing import List, Tuple
 sys.path.append(str(Path(__file__).resolve().parents[1]))
-from app.neo4j_utils import get_driver
-from app.rag_utils import build_index
-
-PERSIST_DIR = "index_store"
+from app.config import INDEX_PAGE_SIZE, OLLAMA_EMBED_MODEL, SNAPSHOT_KEEP
+from app.fingerprint import load_manifest, save_manifest
+from app.metrics import stage_report, timed
+from app.neo4j_utils import read_pages, stream
+from app.hybrid import BM25Index
+from app.index_builder import StreamingIndexWriter
+from app.catalog import CATALOG_DIRNAME, Catalog
+from app.rag_utils import (
+    build_bm25, build_catalog, build_index_streaming, build_similar, get_embed_cache, insert_documents, load_index,
+)
+from app.shards import UnknownCatalogError, get_catalog
+from app.similar import SimilarPhones
+from app.snapshots import open_staging, publish
+from app.vector_store import NumpyVectorStore
 
 QUERY = """
 MATCH (p:Phone)
 WHERE p.text IS NOT NULL
-RETURN p.model_raw AS model, p.text AS text
+RETURN p.model AS key, p.model_raw AS model, p.text AS text, p.row_hash AS row_hash
+"""
+# Misma consulta por páginas en orden de clave (índice de la restricción única sobre p.model)
+PAGE_QUERY = """
+MATCH (p:Phone)
+WHERE p.model > $after AND p.text IS NOT NULL
+RETURN p.model AS key, p.model_raw AS model, p.text AS text, p.row_hash AS row_hash
+ORDER BY p.model
+LIMIT $limit
 """
 
+def to_document(r) -> Document:
+    # id_ estable (= clave del Phone) para poder borrar/reemplazar el documento después
+    return Document(id_=r["key"], text=r["text"], metadata={"model": r["model"]})
+
+def update_index(rows, manifest: dict, persist_dir) -> Tuple[List[str], List[str]]:
+    """
+    Reindexa solo los teléfonos nuevos, modificados o eliminados.
+    Devuelve (claves nuevas o modificadas, claves eliminadas).
+    """
+    old = manifest.get("phones", {})
+    # En memoria solo las claves y los teléfonos que cambian, no el catálogo entero
+    seen, changed = set(), []
+    for r in rows:
+        seen.add(r["key"])
+        if old.get(r["key"]) != r["row_hash"] or r["row_hash"] is None:
+            changed.append(r)
+    removed = [k for k in old if k not in seen]
+    print(
+        f"Cambios: {len(changed)} nuevos/modificados, {len(removed)} eliminados, "
+        f"{len(seen) - len(changed)} sin cambios"
+    )
+    if not removed and not changed:
+        return [], []
+
+    index = load_index(str(persist_dir))
+    for key in removed + [r["key"] for r in changed if r["key"] in old]:
+        index.delete_ref_doc(key, delete_from_docstore=True)
+    insert_documents(index, [to_document(r) for r in changed])
+    index.storage_context.persist(persist_dir=str(persist_dir))
+    return [r["key"] for r in changed], removed
+
 def main():
-    os.makedirs(PERSIST_DIR, exist_ok=True)
-    driver = get_driver()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Reconstruye el índice desde cero (por defecto: actualización incremental)",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Descarta un build completo interrumpido en vez de reanudarlo",
+    )
+    parser.add_argument("--page-size", type=int, default=INDEX_PAGE_SIZE, help="Teléfonos por lote del build completo")
+    parser.add_argument("--catalog", help="Catálogo de catalogs.json (por defecto, DEFAULT_CATALOG o el primero)")
+    args = parser.parse_args()
+
     try:
-        with driver.session() as s:
-            rows = list(s.run(QUERY))
-        docs = [Document(text=r["text"], metadata={"model": r["model"]}) for r in rows]
-        build_index(docs, persist_dir=PERSIST_DIR)
-        print(f"OK. Índice creado con {len(docs)} documentos en {PERSIST_DIR}/")
-    finally:
-        driver.close()
+        spec = get_catalog(args.catalog)
+    except UnknownCatalogError:
+        parser.error(f"no existe el catálogo '{args.catalog}' en catalogs.json")
+    database = spec.database
+    print(f"Catálogo {spec.name}: Neo4j {database or '(por defecto)'} -> {spec.persist_dir}")
+
+    # Se escribe en <índice del catálogo>/staging/ (copia de la instantánea en servicio) y al
+    # final se publica como instantánea nueva: el servidor nunca ve un índice a medias
+    persist_dir = open_staging(spec.persist_dir)
+    hashes = {}
+
+    def read_phones():
+        # Registros en streaming desde Neo4j (NEO4J_FETCH_SIZE por lote), sin lista intermedia
+        for r in stream(QUERY, database=database):
+            hashes[r["key"]] = r["row_hash"]
+            yield r
+
+    manifest = load_manifest(persist_dir)
+    # Un build completo que se cortó se termina antes de volver a lo incremental
+    resumable = StreamingIndexWriter.pending(persist_dir) and not args.restart
+    incremental = (
+        not args.full
+        and not resumable
+        and manifest.get("embed_model") == OLLAMA_EMBED_MODEL
+        and NumpyVectorStore.exists(persist_dir)
+    )
+    if incremental:
+        with timed("update_index"):
+            changed, removed = update_index(read_phones(), manifest, persist_dir)
+        n = len(changed) + len(removed)
+        print(f"OK. Índice actualizado ({n} cambios) en {persist_dir}/")
+    else:
+        def pages(after):
+            # Páginas de Neo4j -> Documents; solo una página en memoria cada vez
+            for page in read_pages(PAGE_QUERY, args.page_size, after=after, database=database):
+                yield [(to_document(r), r["row_hash"]) for r in page]
+
+        with timed("build_index"):
+            hashes = build_index_streaming(pages, str(persist_dir), restart=args.restart)
+        print(f"OK. Índice creado con {len(hashes)} documentos en {persist_dir}/")
+    save_manifest(persist_dir, hashes)
+
+    # BM25 siempre a juego con el índice vectorial (barato: solo texto)
+    if not incremental or n or not BM25Index.exists(persist_dir):
+        with timed("bm25"):
+            bm25 = build_bm25(persist_dir)
+        print(f"OK. Índice BM25 con {len(bm25)} documentos y {bm25.terms} términos")
+
+    # Vecinos por teléfono ("alternativas al X"): tabla en el índice y SIMILAR_TO en Neo4j
+    if not incremental or n or not SimilarPhones.exists(persist_dir):
+        with timed("similar"):
+            similar, keys = build_similar(persist_dir, *((changed, removed) if incremental else (None, None)))
+        recomputed = len(similar) if keys is None else len(keys)
+        print(f"OK. Vecinos de {recomputed} teléfonos recalculados ({similar.edges} en total, k={similar.k})")
+    else:
+        similar, keys = SimilarPhones.load(persist_dir), []
+    with timed("similar_edges"):
+        written = similar.write_edges(keys, database=database) if keys is None or keys else 0
+        # 02_load_neo4j.py --full vacía el grafo: si faltan relaciones se reescriben todas
+        if keys is not None and similar.edges_in_graph(database=database) != similar.edges:
+            written = similar.write_edges(database=database)
+    if written:
+        print(f"OK. {written} relaciones SIMILAR_TO escritas en Neo4j")
+
+    # Catálogo columnar: lo deja 02_load_neo4j.py en staging; si no (03 suelto sobre una
+    # instantánea sin él), se construye aquí con las filas del índice. El servidor no lo escribe
+    if not Catalog.exists(persist_dir / CATALOG_DIRNAME):
+        with timed("catalog"):
+            catalog = build_catalog(str(persist_dir))
+        if catalog is not None:
+            print(f"OK. Catálogo columnar con {len(catalog)} teléfonos")
+
+    version = publish(spec.persist_dir, keep=SNAPSHOT_KEEP)
+    print(f"OK. Instantánea {version} en servicio ({spec.persist_dir}/CURRENT)")
+
+    cache = get_embed_cache()
+    if cache is not None:
+        print(f"Caché de embeddings: {cache.stats()}")
+    print(stage_report())
 
 if __name__ == "__main__":
     main()
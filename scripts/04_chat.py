@@ -1,15 +1,16 @@
+import argparse
 import sys
 from pathlib import Path
 sys.path.append(str(Path(__file__).resolve().parents[1]))
-from app.rag_utils import load_index, get_llm
-from llama_index.core.query_engine import RetrieverQueryEngine
+from app.shards import UnknownCatalogError, get_catalog
+from app.snapshots import current_dir
+from app.rag_utils import create_query_engine, load_spec_table
 from app.config import OLLAMA_MODEL, OLLAMA_EMBED_MODEL
 
 
 print(f"Usando LLM: {OLLAMA_MODEL} | Embeddings: {OLLAMA_EMBED_MODEL}")
 
 
-PERSIST_DIR = "index_store"
 INTRO_TEXT = (
     "Hola. Soy un asistente RAG de especificaciones de moviles. "
     "Mi funcion es ayudarte a encontrar que movil es mejor para lo que buscas, "
@@ -34,14 +35,19 @@ def build_prompt(q: str) -> str:
 
 
 def main():
-    index = load_index(PERSIST_DIR)
-    llm = get_llm()
-    retriever = index.as_retriever(
-        similarity_top_k=10,
-        vector_store_query_mode="mmr",
-        alpha=0.7,
-    )
-    query_engine = RetrieverQueryEngine.from_args(retriever, llm=llm)
+    parser = argparse.ArgumentParser(description="Chat RAG por consola")
+    parser.add_argument("--catalog", help="Catálogo de catalogs.json (por defecto, DEFAULT_CATALOG o el primero)")
+    args = parser.parse_args()
+    try:
+        spec = get_catalog(args.catalog)
+    except UnknownCatalogError:
+        parser.error(f"no existe el catálogo '{args.catalog}' en catalogs.json")
+
+    # Instantánea en servicio del catálogo (<raíz>/CURRENT) o la raíz con el formato antiguo
+    persist_dir = str(current_dir(spec.persist_dir))
+    query_engine = create_query_engine(persist_dir, database=spec.database)
+    # Consultas de un dato o comparativas de modelos concretos: sin pasar por el LLM
+    spec_table = load_spec_table(persist_dir)
 
     print(INTRO_TEXT)
     print("Chat RAG listo. Escribe 'exit' para salir.")
@@ -49,6 +55,10 @@ def main():
         q = input("\n> ")
         if q.strip().lower() in ("exit", "quit"):
             break
+        direct = spec_table.answer(q) if spec_table else None
+        if direct:
+            print("\n" + direct["reply"])
+            continue
         resp = query_engine.query(build_prompt(q))
         print("\n" + str(resp))
 
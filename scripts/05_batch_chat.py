@@ -0,0 +1,71 @@
+import argparse
+import json
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from app.batch import BatchRunner, parse_questions
+from app.prompts import build_prompt
+from app.config import BATCH_CONCURRENCY, OLLAMA_MODEL, OLLAMA_EMBED_MODEL
+from app.shards import UnknownCatalogError, get_catalog
+from app.snapshots import current_dir, release_lease, take_lease
+from app.rag_utils import create_query_engine, embed_questions, load_spec_table
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Responde un fichero JSONL de preguntas ({\"id\", \"question\"} por línea) y escribe las respuestas en JSONL"
+    )
+    parser.add_argument("input", help="Fichero de preguntas ('-' = entrada estándar)")
+    parser.add_argument("--out", help="Fichero de respuestas (por defecto: salida estándar)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="Generaciones simultáneas")
+    parser.add_argument("--catalog", help="Catálogo de catalogs.json (por defecto, DEFAULT_CATALOG o el primero)")
+    args = parser.parse_args()
+    try:
+        spec = get_catalog(args.catalog)
+    except UnknownCatalogError:
+        parser.error(f"no existe el catálogo '{args.catalog}' en catalogs.json")
+
+    if args.input == "-":
+        items = parse_questions(sys.stdin)
+    else:
+        with open(args.input, encoding="utf-8") as f:
+            items = parse_questions(f)
+    print(
+        f"Usando LLM: {OLLAMA_MODEL} | Embeddings: {OLLAMA_EMBED_MODEL} | catálogo {spec.name} | {len(items)} preguntas",
+        file=sys.stderr,
+    )
+
+    # Instantánea en servicio del catálogo (<raíz>/CURRENT) o la raíz con el formato antiguo.
+    # No se borra mientras dure el lote aunque se publique otra
+    persist_dir = str(current_dir(spec.persist_dir))
+    lease = take_lease(persist_dir)
+    # Sin streaming: cada respuesta se usa entera
+    query_engine = create_query_engine(persist_dir, streaming=False, database=spec.database)
+    spec_table = load_spec_table(persist_dir)
+    runner = BatchRunner(
+        query_engine,
+        build_prompt,
+        embed_fn=embed_questions,
+        direct_fn=spec_table.answer if spec_table else None,
+        concurrency=args.concurrency,
+    )
+
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    try:
+        for result in runner.run(items):
+            if result.get("done"):
+                print(
+                    f"{result['questions']} preguntas ({result['unique']} distintas) en {result['total_ms'] / 1000:.1f}s: "
+                    f"{result['sources']}",
+                    file=sys.stderr,
+                )
+                continue
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+    finally:
+        release_lease(lease)
+        if out is not sys.stdout:
+            out.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.append(str(ROOT))
+sys.path.append(str(Path(__file__).resolve().parent))
+
+from mock_ollama import MockOllama
+
+# Plantillas con cifras: muchas preguntas distintas, y repetidas al crecer el lote
+TEMPLATES = [
+    "¿Qué móvil me recomiendas por menos de {price} euros?",
+    "Busco un móvil 5G con NFC y al menos {ram} GB de RAM",
+    "Móvil con batería de {battery} mAh y buena pantalla",
+    "Quiero un teléfono con buena cámara por menos de {price} €",
+    "¿Cuál es el mejor móvil para jugar por debajo de {price} euros?",
+]
+PRICES = [150, 200, 250, 300, 400, 500, 600, 800]
+RAMS = [4, 6, 8, 12]
+BATTERIES = [4000, 4500, 5000, 6000]
+
+
+def make_questions(n: int) -> list:
+    """
+    `n` preguntas: las combinaciones de las plantillas en orden, y después repetidas
+    (con mayúsculas y signos distintos, que la normalización debe juntar).
+    """
+    unique = []
+    for i, template in enumerate(TEMPLATES):
+        for j, price in enumerate(PRICES):
+            unique.append(template.format(price=price, ram=RAMS[j % len(RAMS)], battery=BATTERIES[(i + j) % len(BATTERIES)]))
+    questions = []
+    for i in range(n):
+        q = unique[i % len(unique)]
+        questions.append(q if i < len(unique) else q.upper().rstrip("?") + " ?")
+    return questions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Lote de preguntas: /api/chat una a una frente a /api/chat/batch")
+    parser.add_argument("--questions", type=int, default=500)
+    parser.add_argument("--serial", type=int, default=40, help="Preguntas de la pasada en serie (se extrapola al total)")
+    parser.add_argument("--concurrency", type=int, default=4, help="LLM_CONCURRENCY y BATCH_CONCURRENCY")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--embed-delay", type=float, default=0.02)
+    parser.add_argument("--first-token-delay", type=float, default=0.05)
+    parser.add_argument("--token-delay", type=float, default=0.002)
+    parser.add_argument("--out", help="Guarda el informe en JSON")
+    parser.add_argument("--verbose", action="store_true", help="Muestra los logs del servidor")
+    args = parser.parse_args()
+
+    mock = MockOllama(
+        dim=args.dim, embed_delay=args.embed_delay,
+        first_token_delay=args.first_token_delay, token_delay=args.token_delay,
+    ).start()
+    # Antes de importar app.config: todo el proceso habla con el Ollama simulado
+    os.environ["OLLAMA_BASE_URL"] = mock.url
+    os.environ["EMBED_CACHE"] = "0"
+    os.environ["ANSWER_CACHE"] = "0"
+    os.environ.setdefault("QUERY_PLANNER", "0")  # sin Neo4j
+    os.environ["LLM_CONCURRENCY"] = str(args.concurrency)
+    os.environ["BATCH_CONCURRENCY"] = str(args.concurrency)
+
+    import httpx
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    from bench_rag import build_synthetic_index, load_server_module
+
+    questions = make_questions(args.questions)
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    report = {"questions": len(questions), "concurrency": args.concurrency}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with quiet:
+            build_synthetic_index(tmp)
+        server = load_server_module()
+        # El índice sintético hace de catálogo por defecto
+        server.SHARDS.spec().persist_dir = Path(tmp)
+        server.load_snapshot()
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *a, **kw):
+                pass
+
+        http = make_server("127.0.0.1", 0, server.app, threaded=True, request_handler=QuietHandler)
+        threading.Thread(target=http.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{http.server_port}"
+        try:
+            with quiet, httpx.Client(timeout=600) as client:
+                # 1) En serie: una petición a /api/chat por pregunta
+                sample = questions[:args.serial]
+                t0 = time.perf_counter()
+                for q in sample:
+                    client.post(f"{base_url}/api/chat", json={"message": q}).raise_for_status()
+                serial_s = (time.perf_counter() - t0) * len(questions) / len(sample)
+
+                # 2) Lote: todas en una petición, resultados en JSONL según terminan
+                mock.reset_stats()
+                t0 = time.perf_counter()
+                results, first_s = [], None
+                with client.stream("POST", f"{base_url}/api/chat/batch", json={"questions": questions}) as resp:
+                    resp.raise_for_status()
+                    for line in resp.iter_lines():
+                        if line:
+                            results.append(json.loads(line))
+                            first_s = first_s or time.perf_counter() - t0
+                batch_s = time.perf_counter() - t0
+        finally:
+            http.shutdown()
+            mock.stop()
+
+    done = results[-1]
+    items = results[:-1]
+    report.update({
+        "serial_s_estimated": round(serial_s, 2),
+        "batch_s": round(batch_s, 2),
+        "speedup": round(serial_s / batch_s, 1),
+        "first_result_s": round(first_s, 3),
+        "unique": done["unique"],
+        "results": len(items),
+        "sources": done["sources"],
+        "embedding_ms": done.get("embedding_ms"),
+        "llm_calls": mock.generations,
+        "embed_requests": mock.embed_requests,
+        "errors": sum(1 for r in items if r["source"] == "error"),
+    })
+    print(f"{report['questions']} preguntas ({report['unique']} distintas), concurrencia {args.concurrency}")
+    print(f"En serie (estimado con {len(sample)}): {report['serial_s_estimated']:.1f}s")
+    print(f"Lote: {report['batch_s']:.1f}s (x{report['speedup']}), primer resultado a {report['first_result_s'] * 1000:.0f}ms")
+    print(f"Orígenes: {report['sources']}; llamadas al LLM {report['llm_calls']}, peticiones de embeddings {report['embed_requests']}")
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"Informe en {args.out}")
+    return 1 if report["errors"] or report["results"] != len(questions) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
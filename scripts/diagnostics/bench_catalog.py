@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.append(str(ROOT))
+
+from app.catalog import Catalog, parse_question
+from app.embed_utils import percentile
+from app.shards import INR_TO_EUR
+
+CSV_PATH = ROOT / "data" / "smartphone-specification.csv"
+
+QUESTIONS = [
+    "Top 5 móviles por batería por debajo de 250 €",
+    "precio medio de los móviles de 120 Hz",
+    "¿cuántos Samsung tienen 5G y NFC?",
+    "precio medio por marca",
+    "¿cuál es el móvil más barato con NFC?",
+    "los 3 mejor valorados con snapdragon",
+    "el móvil con más RAM de Xiaomi",
+    "¿cuántos móviles hay por sistema operativo?",
+]
+
+
+def grow(rows: list, total: int, rng) -> list:
+    """
+    Catálogo de `total` teléfonos: el CSV más copias con precio y batería ligeramente distintos.
+    """
+    out = list(rows)
+    while len(out) < total:
+        r = dict(rows[int(rng.integers(len(rows)))])
+        r["model"] = f"{r['model']} #{len(out)}"
+        if r["price"] is not None:
+            r["price"] = round(r["price"] * float(rng.uniform(0.8, 1.2)), 2)
+        if r["battery_mah"] is not None:
+            r["battery_mah"] = int(r["battery_mah"] + rng.integers(-300, 300))
+        out.append(r)
+    return out[:total]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Latencia de rankings y agregados sobre la instantánea columnar")
+    parser.add_argument("--rows", type=int, default=200000, help="Teléfonos del catálogo sintético")
+    parser.add_argument("--repeat", type=int, default=200, help="Repeticiones de cada pregunta")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    import pandas as pd
+    from app.ingest_utils import normalize_frame
+
+    rows = grow(normalize_frame(pd.read_csv(CSV_PATH), INR_TO_EUR), args.rows, np.random.default_rng(args.seed))
+    with tempfile.TemporaryDirectory() as tmp:
+        t0 = time.perf_counter()
+        Catalog.from_rows(rows).persist(tmp)
+        written = time.perf_counter() - t0
+        size = sum(f.stat().st_size for f in Path(tmp).iterdir()) / 2**20
+        t0 = time.perf_counter()
+        catalog = Catalog.load(tmp)
+        loaded = time.perf_counter() - t0
+        print(f"{len(catalog)} teléfonos: escritura {written:.2f}s, {size:.1f} MB, carga (mmap) {loaded * 1000:.0f} ms")
+
+        print(f"{'pregunta':<46} {'parse µs':>9} {'consulta µs p50':>16} {'p95':>8}")
+        for q in QUESTIONS:
+            query = parse_question(q, catalog)
+            if query is None:
+                print(f"{q:<46} (no es una consulta de catálogo)")
+                continue
+            parse, run = [], []
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                query = parse_question(q, catalog)
+                t1 = time.perf_counter()
+                query.run(catalog)
+                t2 = time.perf_counter()
+                parse.append((t1 - t0) * 1e6)
+                run.append((t2 - t1) * 1e6)
+            print(f"{q:<46} {percentile(parse, 50):>9.0f} {percentile(run, 50):>16.0f} {percentile(run, 95):>8.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.append(str(ROOT))
+sys.path.append(str(Path(__file__).resolve().parent))
+
+from mock_ollama import MockOllama
+
+CSV_PATH = ROOT / "data" / "smartphone-specification.csv"
+
+
+class Interrupted(Exception):
+    pass
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss viene en KB en Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def catalog(total: int):
+    """
+    Catálogo sintético de `total` teléfonos repitiendo las filas del CSV, generado al
+    vuelo y en orden de clave (como PAGE_QUERY en Neo4j): read_pages(after, page_size).
+    """
+    import pandas as pd
+    from llama_index.core import Document
+    from app.ingest_utils import normalize_frame
+    from app.shards import INR_TO_EUR
+
+    base = normalize_frame(pd.read_csv(CSV_PATH), INR_TO_EUR)
+
+    def read_pages(after: str, page_size: int):
+        start = int(after.split()[0]) + 1 if after else 0
+        for first in range(start, total, page_size):
+            page = []
+            for i in range(first, min(first + page_size, total)):
+                r = base[i % len(base)]
+                key = f"{i:08d} {r['model'].lower()}"
+                page.append((Document(id_=key, text=r["text"], metadata={"model": r["model"]}), str(i)))
+            yield page
+
+    return read_pages
+
+
+def build_streaming(persist_dir: str, read_pages, page_size: int, stop_after: int = 0, restart: bool = False) -> dict:
+    from app.rag_utils import build_index_streaming
+
+    def pages(after):
+        for n, page in enumerate(read_pages(after, page_size), start=1):
+            if stop_after and n > stop_after:
+                raise Interrupted()
+            yield page
+
+    return build_index_streaming(pages, persist_dir, restart=restart)
+
+
+def build_in_memory(persist_dir: str, read_pages, page_size: int) -> int:
+    # Lo que hacía 03_build_rag.py: lista de filas -> lista de Documents -> índice
+    from app.rag_utils import build_index
+
+    docs = [doc for page in read_pages("", page_size) for doc, _ in page]
+    build_index(docs, persist_dir=persist_dir)
+    return len(docs)
+
+
+def check_resume(read_pages, page_size: int, stop_after: int) -> bool:
+    """
+    Corta un build tras `stop_after` páginas, lo reanuda y compara con uno sin cortes.
+    """
+    import numpy as np
+    from app.vector_store import NumpyVectorStore
+
+    with tempfile.TemporaryDirectory() as clean, tempfile.TemporaryDirectory() as resumed:
+        build_streaming(clean, read_pages, page_size)
+        try:
+            build_streaming(resumed, read_pages, page_size, stop_after=stop_after)
+        except Interrupted:
+            print(f"Build cortado tras {stop_after} páginas; reanudando")
+        hashes = build_streaming(resumed, read_pages, page_size)
+        a, b = NumpyVectorStore.from_persist_dir(clean), NumpyVectorStore.from_persist_dir(resumed)
+        same = (
+            len(hashes) == len(b.rows)
+            and [r["ref_doc_id"] for r in a.rows] == [r["ref_doc_id"] for r in b.rows]
+            and [r["text"] for r in a.rows] == [r["text"] for r in b.rows]
+            and np.array_equal(a.vectors, b.vectors)
+        )
+    print(f"Reanudación: {'idéntico' if same else 'DISTINTO'} al build sin cortes ({len(hashes)} documentos)")
+    return same
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Memoria y tiempo del build completo del índice (streaming vs en memoria)")
+    parser.add_argument("--rows", type=int, default=20000, help="Teléfonos del catálogo sintético")
+    parser.add_argument("--mode", choices=["stream", "memory"], default="stream")
+    parser.add_argument("--page-size", type=int, default=512)
+    parser.add_argument("--dim", type=int, default=768, help="Dimensión de los embeddings simulados")
+    parser.add_argument("--check-resume", type=int, metavar="PAGES", default=0, help="Corta el build tras PAGES páginas y comprueba la reanudación")
+    args = parser.parse_args()
+
+    mock = MockOllama(dim=args.dim).start()
+    # Antes de importar app.config: todo el proceso habla con el Ollama simulado
+    os.environ["OLLAMA_BASE_URL"] = mock.url
+    os.environ["EMBED_CACHE"] = "0"
+    try:
+        read_pages = catalog(args.rows)
+        if args.check_resume:
+            return 0 if check_resume(read_pages, args.page_size, args.check_resume) else 1
+
+        before = peak_rss_mb()
+        t0 = time.perf_counter()
+        with tempfile.TemporaryDirectory() as tmp:
+            if args.mode == "stream":
+                n = len(build_streaming(tmp, read_pages, args.page_size))
+            else:
+                n = build_in_memory(tmp, read_pages, args.page_size)
+            size = sum(f.stat().st_size for f in Path(tmp).iterdir()) / 2**20
+        elapsed = time.perf_counter() - t0
+        print(
+            f"{args.mode}: {n} documentos en {elapsed:.1f}s ({n / elapsed:.0f} docs/s) | "
+            f"índice {size:.0f} MB | pico RSS {peak_rss_mb():.0f} MB (antes del build {before:.0f} MB)"
+        )
+    finally:
+        mock.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.append(str(ROOT))
+
+from app.embed_utils import percentile
+from app.neo4j_utils import aread_query, close_async_driver, get_driver, read_query, shared_driver, stream
+
+# Misma consulta que /api/phones/<modelo>
+LOOKUP = """
+MATCH (p:Phone {model: $model})
+OPTIONAL MATCH (p)-[r]->(c)
+RETURN p.model AS model, collect(c.name) AS links
+"""
+
+
+def report(name: str, latencies: list, elapsed: float) -> None:
+    ms = [x * 1000 for x in latencies]
+    print(
+        f"{name}: {len(ms)} consultas en {elapsed:.2f}s ({len(ms) / elapsed:.0f}/s), "
+        f"p50={percentile(ms, 50):.1f}ms p95={percentile(ms, 95):.1f}ms p99={percentile(ms, 99):.1f}ms"
+    )
+
+
+def run_threads(lookup, models: list, threads: int) -> tuple:
+    def one(model):
+        t0 = time.perf_counter()
+        lookup(model)
+        return time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        latencies = list(pool.map(one, models))
+    return latencies, time.perf_counter() - t0
+
+
+def per_call_driver(model: str) -> None:
+    # Lo que hacía cada script: driver nuevo, una sesión, cerrar
+    driver = get_driver()
+    try:
+        with driver.session() as s:
+            list(s.run(LOOKUP, model=model))
+    finally:
+        driver.close()
+
+
+async def run_async(models: list, concurrency: int) -> tuple:
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(model):
+        async with sem:
+            t0 = time.perf_counter()
+            await aread_query(LOOKUP, {"model": model})
+            return time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    try:
+        latencies = await asyncio.gather(*(one(m) for m in models))
+    finally:
+        await close_async_driver()
+    return list(latencies), time.perf_counter() - t0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Latencia de búsquedas puntuales en Neo4j bajo concurrencia")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=16, help="Hilos (o corrutinas) simultáneos")
+    parser.add_argument("--skip-per-call", action="store_true", help="No medir el driver nuevo por consulta")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    names = [r["model"] for r in stream("MATCH (p:Phone) RETURN p.model AS model")]
+    print(f"{len(names)} modelos leídos en streaming en {(time.perf_counter() - t0) * 1000:.0f}ms")
+    if not names:
+        print("El grafo está vacío: ejecuta antes scripts/02_load_neo4j.py")
+        return 1
+    models = [names[i % len(names)] for i in range(args.queries)]
+
+    shared_driver().verify_connectivity()
+    run_threads(lambda m: read_query(LOOKUP, {"model": m}), models[:args.threads], args.threads)  # calentamiento
+    report("Driver compartido (pool)", *run_threads(lambda m: read_query(LOOKUP, {"model": m}), models, args.threads))
+    report("Asíncrono (pool)", *asyncio.run(run_async(models, args.threads)))
+    if not args.skip_per_call:
+        few = models[: max(args.threads, args.queries // 10)]
+        report("Driver nuevo por consulta", *run_threads(per_call_driver, few, args.threads))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.append(str(ROOT))
+
+import numpy as np
+import pandas as pd
+from app.ingest_utils import normalize_frame, normalize_rows_iter
+from app.shards import INR_TO_EUR
+
+CSV_PATH = ROOT / "data" / "smartphone-specification.csv"
+
+
+def scale_csv(base: pd.DataFrame, n_rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Repite el catálogo hasta n_rows filas con modelos únicos, precios variados
+    y algunos huecos, para ejercitar también los casos nulos.
+    """
+    rng = np.random.default_rng(seed)
+    reps = -(-n_rows // len(base))
+    df = pd.concat([base] * reps, ignore_index=True).iloc[:n_rows].copy()
+    df["model"] = df["model"].astype(str) + " #" + (df.index // len(base)).astype(str)
+    df["price"] = (df["price"] * rng.uniform(0.8, 1.2, len(df))).round().astype("int64")
+    for col in ("rating", "battery_mah", "refresh_rate_hz", "os", "memory_card_type"):
+        df.loc[rng.random(len(df)) < 0.02, col] = np.nan
+    return df
+
+
+def timed(fn, path: Path):
+    t0 = time.perf_counter()
+    rows = fn(pd.read_csv(path), INR_TO_EUR)
+    return rows, time.perf_counter() - t0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000, help="Filas del CSV sintético")
+    args = parser.parse_args()
+
+    base = pd.read_csv(CSV_PATH)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "scaled.csv"
+        scale_csv(base, args.rows).to_csv(path, index=False)
+        print(f"CSV sintético: {args.rows} filas ({path.stat().st_size / 1e6:.1f} MB)")
+
+        old_rows, old_s = timed(normalize_rows_iter, path)
+        new_rows, new_s = timed(normalize_frame, path)
+
+    print(f"iterrows : {old_s:8.2f}s  ({len(old_rows) / old_s:10.0f} filas/s)")
+    print(f"columnar : {new_s:8.2f}s  ({len(new_rows) / new_s:10.0f} filas/s)")
+    print(f"speedup  : {old_s / new_s:8.1f}x")
+
+    old_json = json.dumps(old_rows, ensure_ascii=False)
+    new_json = json.dumps(new_rows, ensure_ascii=False)
+    if old_json != new_json:
+        for i, (a, b) in enumerate(zip(old_rows, new_rows)):
+            if a != b:
+                print(f"Fila {i} distinta:\n  iterrows: {a}\n  columnar: {b}")
+                break
+        print("ERROR: las salidas no son idénticas")
+        return 1
+    print(f"OK: salidas idénticas byte a byte ({len(new_json)} bytes)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.append(str(ROOT))
+sys.path.append(str(Path(__file__).resolve().parent))
+
+from app.embed_utils import percentile
+from app.quantization import Int8Codes
+from app.vector_store import NumpyVectorStore, _normalize
+from llama_index.core.vector_stores.types import VectorStoreQuery, VectorStoreQueryMode
+
+CSV_PATH = ROOT / "data" / "smartphone-specification.csv"
+
+
+def synthetic_vectors(dim: int) -> np.ndarray:
+    """
+    Embeddings del Ollama simulado para el CSV (sin levantar el servidor).
+    """
+    import pandas as pd
+    from app.ingest_utils import normalize_frame
+    from app.shards import INR_TO_EUR
+    from mock_ollama import fake_embedding
+
+    rows = normalize_frame(pd.read_csv(CSV_PATH), INR_TO_EUR)
+    return np.asarray([fake_embedding(r["text"], dim) for r in rows], dtype=np.float32)
+
+
+def grow(vectors: np.ndarray, rows: int, noise: float, rng) -> np.ndarray:
+    """
+    Catálogo de `rows` vectores: los originales más copias con ruido gaussiano.
+    """
+    if rows <= len(vectors):
+        return vectors[:rows]
+    base = vectors[rng.integers(0, len(vectors), rows - len(vectors))]
+    extra = base + rng.normal(0, noise / np.sqrt(vectors.shape[1]), base.shape).astype(np.float32)
+    return _normalize(np.vstack([vectors, extra])).astype(np.float32)
+
+
+def run(store: NumpyVectorStore, queries: np.ndarray, k: int, mode) -> tuple:
+    ids, latencies = [], []
+    for q in queries:
+        query = VectorStoreQuery(query_embedding=q.tolist(), similarity_top_k=k, mode=mode, mmr_threshold=0.7)
+        t0 = time.perf_counter()
+        result = store.query(query)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        ids.append(result.ids)
+    return ids, latencies
+
+
+def recall(found: list, truth: list) -> float:
+    return float(np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)]))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Recall@k, memoria y latencia de la búsqueda int8 frente a la exacta")
+    parser.add_argument("--persist-dir", help="Índice existente (por defecto: embeddings simulados del CSV)")
+    parser.add_argument("--rows", type=int, default=0, help="Crece el catálogo hasta ROWS vectores con copias ruidosas")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rerank", type=int, nargs="+", default=[1, 2, 4, 8], help="Factores de reordenación a probar")
+    parser.add_argument("--mmr", action="store_true", help="Modo MMR (el del recuperador) en vez de top-k")
+    parser.add_argument("--dim", type=int, default=768, help="Dimensión de los embeddings simulados")
+    parser.add_argument("--noise", type=float, default=0.6, help="Ruido de las consultas y de las copias")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="Guarda el informe en JSON")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.persist_dir:
+        vectors = np.asarray(NumpyVectorStore.from_persist_dir(args.persist_dir).vectors, dtype=np.float32)
+    else:
+        vectors = synthetic_vectors(args.dim)
+    vectors = grow(vectors, args.rows or len(vectors), args.noise, rng)
+    n, dim = vectors.shape
+    rows = [{"id": str(i), "ref_doc_id": str(i), "text": "", "metadata": {}} for i in range(n)]
+    # Consultas: teléfonos del catálogo con ruido (parecidas a una pregunta sobre ellos)
+    picked = vectors[rng.integers(0, n, args.queries)]
+    queries = _normalize(picked + rng.normal(0, args.noise / np.sqrt(dim), picked.shape).astype(np.float32))
+    mode = VectorStoreQueryMode.MMR if args.mmr else VectorStoreQueryMode.DEFAULT
+    print(f"{n} vectores de dimensión {dim}, {args.queries} consultas, k={args.k}, modo {mode.value}")
+
+    exact = NumpyVectorStore(vectors=vectors, rows=rows, dtype="float32")
+    truth, _ = run(exact, queries, args.k, mode)
+    variants = [("float32 (exacta)", exact, vectors.nbytes), ("float16", None, vectors.nbytes // 2)]
+    codes = Int8Codes.from_vectors(vectors)
+    for r in args.rerank:
+        store = NumpyVectorStore(vectors=vectors, rows=rows, dtype="float32", codes=codes, quantization="int8", rerank=r)
+        variants.append((f"int8 + reordenar {r}x", store, codes.nbytes))
+
+    report = {"rows": n, "dim": dim, "queries": args.queries, "k": args.k, "mode": mode.value, "results": []}
+    print(f"{'variante':<22} {'recall@k':>8} {'memoria':>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, store, nbytes in variants:
+        if store is None:
+            store = NumpyVectorStore(vectors=vectors.astype(np.float16), rows=rows, dtype="float16")
+        ids, lat = run(store, queries, args.k, mode)
+        item = {
+            "variant": name, "recall": round(recall(ids, truth), 4), "search_mb": round(nbytes / 2**20, 2),
+            "p50_ms": round(percentile(lat, 50), 3), "p95_ms": round(percentile(lat, 95), 3),
+        }
+        report["results"].append(item)
+        print(f"{name:<22} {item['recall']:>8.3f} {item['search_mb']:>8.1f}MB {item['p50_ms']:>8.2f} {item['p95_ms']:>8.2f}")
+
+    # Solo los códigos, sin reordenar con los vectores exactos: cota inferior del recall
+    t0 = time.perf_counter()
+    approx = [np.argpartition(-codes.scores(q), args.k - 1)[:args.k].astype(str).tolist() for q in queries]
+    per_query = (time.perf_counter() - t0) * 1000 / len(queries)
+    if not args.mmr:
+        print(f"{'int8 sin reordenar':<22} {recall(approx, truth):>8.3f} {codes.nbytes / 2**20:>8.1f}MB {per_query:>8.2f}")
+
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"Informe en {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
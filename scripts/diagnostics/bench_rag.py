@@ -0,0 +1,299 @@
+from __future__ import annotations
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.append(str(ROOT))
+sys.path.append(str(Path(__file__).resolve().parent))
+
+from mock_ollama import MockOllama
+
+CSV_PATH = ROOT / "data" / "smartphone-specification.csv"
+
+# Preguntas fijas: cambiar esta lista invalida la comparación con resultados anteriores
+QUESTIONS = [
+    "¿Qué móvil me recomiendas por menos de 300 euros?",
+    "Quiero un teléfono con buena batería y carga rápida",
+    "¿Qué tal es el Samsung Galaxy S23 Ultra?",
+    "Busco un móvil 5G con NFC y al menos 8 GB de RAM",
+    "¿Cuál es el mejor móvil para jugar?",
+    "Compara el iPhone 14 y el Pixel 7",
+    "Un móvil barato con pantalla AMOLED de 120 Hz",
+    "¿Qué chipset lleva el OnePlus 11?",
+    "Recomiéndame un móvil con buena cámara para fotos de noche",
+    "Móvil con ranura para tarjeta microSD y batería de 5000 mAh",
+    "¿Hay algún móvil con infrarrojos por menos de 200 €?",
+    "Quiero un móvil pequeño con Android y buen rendimiento",
+]
+
+
+def summary(values: list) -> dict:
+    from app.embed_utils import percentile
+
+    if not values:
+        return {"n": 0}
+    return {
+        "n": len(values),
+        "mean": round(sum(values) / len(values), 2),
+        "p50": round(percentile(values, 50), 2),
+        "p95": round(percentile(values, 95), 2),
+        "p99": round(percentile(values, 99), 2),
+        "max": round(max(values), 2),
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        )
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_synthetic_index(persist_dir: str) -> int:
+    """
+    Indexa el CSV directamente (sin Neo4j) con los embeddings del Ollama simulado.
+    """
+    import pandas as pd
+    from llama_index.core import Document
+    from app.ingest_utils import normalize_frame
+    from app.rag_utils import build_bm25, build_index, build_similar
+    from app.shards import INR_TO_EUR
+
+    rows = {}
+    for row in normalize_frame(pd.read_csv(CSV_PATH), INR_TO_EUR):
+        rows[row["model"].lower()] = row
+    docs = [Document(id_=key, text=r["text"], metadata={"model": r["model"]}) for key, r in rows.items()]
+    build_index(docs, persist_dir=persist_dir)
+    build_bm25(persist_dir)
+    build_similar(persist_dir)
+    return len(docs)
+
+
+def load_server_module():
+    spec = importlib.util.spec_from_file_location("bench_server", ROOT / "web-app" / "server.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def stream_chat(client, base_url: str, question: str) -> dict:
+    """
+    Una petición a /api/chat/stream: TTFT (primer evento "token") y tiempo total, medidos en el cliente.
+    """
+    started = time.perf_counter()
+    ttft = None
+    with client.stream("POST", f"{base_url}/api/chat/stream", json={"message": question}) as resp:
+        if resp.status_code != 200:
+            return {"status": resp.status_code}
+        for line in resp.iter_lines():
+            if ttft is None and line == "event: token":
+                ttft = (time.perf_counter() - started) * 1000
+    return {"status": 200, "ttft_ms": ttft, "total_ms": (time.perf_counter() - started) * 1000}
+
+
+def run_clients(base_url: str, questions: list, clients: int) -> dict:
+    """
+    `clients` hilos lanzando /api/chat sin pausa hasta agotar la lista de preguntas.
+    """
+    import httpx
+
+    pending = list(questions)
+    lock = threading.Lock()
+    latencies, statuses = [], {}
+
+    def client_loop():
+        with httpx.Client(timeout=600) as client:
+            while True:
+                with lock:
+                    if not pending:
+                        return
+                    question = pending.pop()
+                t0 = time.perf_counter()
+                status = client.post(f"{base_url}/api/chat", json={"message": question}).status_code
+                elapsed = (time.perf_counter() - t0) * 1000
+                with lock:
+                    statuses[status] = statuses.get(status, 0) + 1
+                    if status == 200:
+                        latencies.append(elapsed)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        for f in [pool.submit(client_loop) for _ in range(clients)]:
+            f.result()
+    elapsed = time.perf_counter() - t0
+    return {
+        "clients": clients,
+        "requests": len(questions),
+        "ok": statuses.get(200, 0),
+        "status_codes": {str(k): v for k, v in sorted(statuses.items())},
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(statuses.get(200, 0) / elapsed, 3),
+        "latency_ms": summary(latencies),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de recuperación y de /api/chat con Ollama simulado")
+    parser.add_argument("--persist-dir", help="Índice existente (por defecto: se construye uno sintético desde el CSV)")
+    parser.add_argument("--rounds", type=int, default=3, help="Repeticiones de la lista de preguntas")
+    parser.add_argument("--clients", type=int, default=4, help="Clientes concurrentes en la prueba de carga")
+    parser.add_argument("--dim", type=int, default=768, help="Dimensión de los embeddings simulados")
+    parser.add_argument("--embed-delay", type=float, default=0.0)
+    parser.add_argument("--first-token-delay", type=float, default=0.05)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    parser.add_argument("--load-delay", type=float, default=0.0, help="Segundos de carga de un modelo no residente")
+    parser.add_argument("--out", help="Fichero JSON de resultados (por defecto: bench_results/rag_<commit>.json)")
+    parser.add_argument("--verbose", action="store_true", help="Muestra los logs del servidor")
+    args = parser.parse_args()
+
+    mock = MockOllama(
+        dim=args.dim,
+        embed_delay=args.embed_delay,
+        first_token_delay=args.first_token_delay,
+        token_delay=args.token_delay,
+        load_delay=args.load_delay,
+    ).start()
+    # Antes de importar app.config: todo el proceso habla con el Ollama simulado
+    os.environ["OLLAMA_BASE_URL"] = mock.url
+    os.environ["EMBED_CACHE"] = "0"
+    os.environ["ANSWER_CACHE"] = "0"
+    os.environ.setdefault("QUERY_PLANNER", "0")  # sin Neo4j; QUERY_PLANNER=1 para incluirlo
+    os.environ.setdefault("LLM_MAX_QUEUE", str(max(8, args.clients * 2)))
+
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    from app.rag_utils import (
+        create_retriever, load_bm25, load_catalog, load_index, load_similar,
+    )
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {
+            "questions": len(QUESTIONS),
+            "rounds": args.rounds,
+            "clients": args.clients,
+            "dim": args.dim,
+            "embed_delay": args.embed_delay,
+            "first_token_delay": args.first_token_delay,
+            "token_delay": args.token_delay,
+            "load_delay": args.load_delay,
+            "model_keep_alive": os.getenv("MODEL_KEEP_ALIVE", "10m"),
+            "query_planner": os.environ["QUERY_PLANNER"],
+            "llm_concurrency": os.getenv("LLM_CONCURRENCY", "1"),
+            "direct_answers": os.getenv("DIRECT_ANSWERS", "1"),
+            "vector_quantization": os.getenv("VECTOR_QUANTIZATION", "none"),
+        },
+    }
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        persist_dir = args.persist_dir or tmp
+        index_info = {"persist_dir": args.persist_dir or "(sintético)"}
+        if not args.persist_dir:
+            t0 = time.perf_counter()
+            with quiet:
+                index_info["docs"] = build_synthetic_index(persist_dir)
+            index_info["build_s"] = round(time.perf_counter() - t0, 3)
+
+        # 1) Carga del índice
+        t0 = time.perf_counter()
+        index = load_index(persist_dir)
+        index_info["load_s"] = round(time.perf_counter() - t0, 3)
+        results["index"] = index_info
+        print(f"Índice: {index_info}")
+
+        # 2) Recuperación (embedding de la pregunta + top-k/MMR), sin LLM
+        server = load_server_module()
+        retriever = create_retriever(
+            index, bm25=load_bm25(persist_dir), similar=load_similar(persist_dir), catalog=load_catalog(persist_dir)
+        )
+        for q in QUESTIONS:  # calentamiento
+            retriever.retrieve(server.build_prompt(q))
+        retrieval = []
+        for _ in range(args.rounds):
+            for q in QUESTIONS:
+                t0 = time.perf_counter()
+                retriever.retrieve(server.build_prompt(q))
+                retrieval.append((time.perf_counter() - t0) * 1000)
+        results["retrieval_ms"] = summary(retrieval)
+        print(f"Recuperación (ms): {results['retrieval_ms']}")
+
+        # 3) Extremo a extremo contra la app Flask real
+        # El índice sintético hace de catálogo por defecto
+        server.SHARDS.spec().persist_dir = Path(persist_dir)
+        server.load_snapshot()
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *a, **kw):
+                if args.verbose:
+                    super().log_request(*a, **kw)
+
+        http = make_server("127.0.0.1", 0, server.app, threaded=True, request_handler=QuietHandler)
+        threading.Thread(target=http.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{http.server_port}"
+
+        import httpx
+
+        try:
+            with quiet:
+                mock.reset_stats()
+                ttft, total, failed = [], [], 0
+                with httpx.Client(timeout=600) as client:
+                    for _ in range(args.rounds):
+                        for q in QUESTIONS:
+                            r = stream_chat(client, base_url, q)
+                            if r["status"] != 200 or r["ttft_ms"] is None:
+                                failed += 1
+                                continue
+                            ttft.append(r["ttft_ms"])
+                            total.append(r["total_ms"])
+                prompt_tokens = list(mock.prompt_tokens)
+                llm_calls = mock.generations
+                model_loads = mock.loads
+                load = run_clients(base_url, QUESTIONS * args.rounds, args.clients)
+        finally:
+            http.shutdown()
+            mock.stop()
+
+    results["prompt_tokens"] = summary(prompt_tokens)
+    # Más de una llamada por pregunta = el sintetizador tuvo que refinar (contexto > ventana);
+    # menos de una = parte de las preguntas se respondieron directamente (DIRECT_ANSWERS)
+    results["llm_calls_per_question"] = round(llm_calls / max(1, len(ttft) + failed), 2)
+    results["stream"] = {"failed": failed, "ttft_ms": summary(ttft), "total_ms": summary(total)}
+    # Cargas de modelo (LLM o embeddings) durante el streaming: 0 si siguen residentes
+    results["model_loads"] = model_loads
+    results["load"] = load
+    print(f"Tokens de prompt (aprox.): {results['prompt_tokens']}")
+    print(f"Llamadas al LLM por pregunta: {results['llm_calls_per_question']}")
+    print(f"TTFT (ms): {results['stream']['ttft_ms']}")
+    print(f"Total streaming (ms): {results['stream']['total_ms']}")
+    print(f"Cargas de modelo durante el streaming: {model_loads}")
+    print(
+        f"Carga con {load['clients']} clientes: {load['ok']}/{load['requests']} OK, "
+        f"{load['requests_per_s']} peticiones/s, códigos {load['status_codes']}"
+    )
+
+    out = Path(args.out) if args.out else ROOT / "bench_results" / f"rag_{results['commit'] or 'local'}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"Resultados en {out}")
+    return 1 if failed or load["ok"] < load["requests"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
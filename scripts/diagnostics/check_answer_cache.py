@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.append(str(ROOT))
+
+from app.answer_cache import AnswerCache
+from app.hybrid import ModelMatcher
+
+MODELS = ["samsung galaxy a54 5g", "xiaomi redmi note 12", "oneplus 11 5g"]
+
+
+def make_cache(version: dict) -> AnswerCache:
+    # Todas las preguntas con el mismo embedding: solo deciden las comprobaciones de la caché
+    return AnswerCache(
+        embed_fn=lambda text: [1.0, 0.0],
+        version_fn=lambda: version["v"],
+        threshold=0.95,
+        ttl=3600,
+        max_entries=100,
+        matcher_fn=lambda: ModelMatcher(MODELS),
+    )
+
+
+def check_swap_during_generation() -> list:
+    """
+    A falla en v1 y genera con el motor de v1; la instantánea pasa a v2 y otra petición
+    vacía la caché; A guarda después. La respuesta de v1 no debe servirse en v2.
+    """
+    version = {"v": "v1"}
+    cache = make_cache(version)
+    errors = []
+    if cache.lookup("móvil con nfc") is not None:
+        errors.append("la caché vacía devuelve un acierto")
+    generated_with = version["v"]
+    version["v"] = "v2"
+    cache.lookup("otra pregunta")
+    cache.store("móvil con nfc", "respuesta de v1", version=generated_with)
+    hit = cache.lookup("móvil con nfc")
+    if hit is not None:
+        errors.append(f"respuesta de v1 servida tras el cambio a v2: {hit}")
+    cache.store("móvil con nfc", "respuesta de v2", version=version["v"])
+    hit = cache.lookup("móvil con nfc")
+    if hit != ("respuesta de v2", "exact"):
+        errors.append(f"la respuesta de v2 no se guarda: {hit}")
+    return errors
+
+
+# Preguntas casi iguales con distinta intención: ninguna puede reutilizar la respuesta de la otra
+OPPOSITES = [
+    ("el móvil más barato con nfc", "el móvil más caro con nfc"),
+    ("el móvil con más batería", "el móvil con menos batería"),
+    ("un móvil para fotos", "un móvil para jugar"),
+    ("móvil con pantalla grande", "móvil con pantalla pequeña"),
+    ("móvil con nfc", "móvil sin nfc"),
+    ("mejor móvil samsung", "mejor móvil xiaomi"),
+    ("móvil 5g", "móvil que no sea 5g"),
+]
+# Y las que piden lo mismo con otras palabras sí
+SAME = [
+    ("el móvil más barato con nfc", "¿cuál es el móvil más barato con NFC?"),
+    ("un móvil para jugar", "quiero un móvil para jugar"),
+]
+
+
+def check_signatures() -> list:
+    errors = []
+    for first, second in OPPOSITES:
+        cache = make_cache({"v": "v1"})
+        cache.store(first, "A", version="v1")
+        if cache.lookup(second) is not None:
+            errors.append(f"'{second}' reutiliza la respuesta de '{first}'")
+    for first, second in SAME:
+        cache = make_cache({"v": "v1"})
+        cache.store(first, "A", version="v1")
+        if cache.lookup(second) is None:
+            errors.append(f"'{second}' no reutiliza la respuesta de '{first}'")
+    return errors
+
+
+def main() -> int:
+    errors = check_swap_during_generation() + check_signatures()
+    for error in errors:
+        print(f"FALLO: {error}")
+    print("OK" if not errors else f"{len(errors)} fallos")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
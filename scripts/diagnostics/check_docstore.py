@@ -1,13 +1,23 @@
 from __future__ import annotations
 
 import json
+import sys
 from pathlib import Path
 
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.append(str(ROOT))
+
+from app.snapshots import current_dir
+
+
 def main() -> int:
-    root = Path(__file__).resolve().parents[2]
-    docstore_path = root / "index_store" / "docstore.json"
+    root = ROOT
+    # Instantánea en servicio (index_store/CURRENT) o index_store/ con el formato antiguo
+    persist_dir = current_dir(root / "index_store")
+    docstore_path = persist_dir / "docstore.json"
 
     print(f"Project root: {root}")
+    print(f"Index dir: {persist_dir}")
     print(f"Docstore path: {docstore_path}")
     print(f"Docstore exists: {docstore_path.exists()}")
 
@@ -22,6 +32,20 @@ def main() -> int:
 
     count = len(data.get("docstore/data", {}))
     print(f"Docstore document count: {count}")
+
+    # Índices con NumpyVectorStore: el texto vive en vector_nodes.json, no en el docstore
+    nodes_path = persist_dir / "vector_nodes.json"
+    vectors_path = persist_dir / "vectors.npy"
+    if nodes_path.exists() and vectors_path.exists():
+        import numpy as np
+
+        vectors = np.load(vectors_path, mmap_mode="r")
+        nodes = json.loads(nodes_path.read_text(encoding="utf-8"))
+        print(f"Vector store nodes: {len(nodes)}")
+        print(f"Vector matrix: shape={vectors.shape} dtype={vectors.dtype} ({vectors_path.stat().st_size / 1e6:.1f} MB)")
+        if len(nodes) != vectors.shape[0]:
+            print("Vector store inconsistente: filas de la matriz != nodos")
+            return 3
     return 0
 
 if __name__ == "__main__":
@@ -0,0 +1,287 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# Respuesta fija del LLM simulado, troceada en "tokens" (palabra + espacio)
+CANNED_ANSWER = (
+    "Te recomiendo el modelo con mejor relación calidad-precio del catálogo: buena batería, "
+    "pantalla fluida y un procesador solvente para el día a día. Si buscas algo más barato, "
+    "hay alternativas con especificaciones parecidas, aunque el precio varía según la zona."
+)
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def count_tokens(text: str) -> int:
+    """
+    Aproximación a los tokens del prompt (palabras + signos), suficiente para comparar commits.
+    """
+    return len(TOKEN_RE.findall(text))
+
+
+def fake_embedding(text: str, dim: int) -> list:
+    """
+    Embedding determinista: bolsa de palabras con hashing. Textos con palabras en
+    común quedan cerca, así que el ranking tiene sentido aunque no sea semántico.
+    """
+    vec = np.zeros(dim, dtype=np.float32)
+    for word in re.findall(r"\w+", text.lower()):
+        h = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+        vec[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+    norm = np.linalg.norm(vec)
+    if norm == 0:
+        vec[0], norm = 1.0, 1.0
+    return (vec / norm).tolist()
+
+
+class MockOllama:
+    """
+    Servidor HTTP que imita la API de Ollama que usa el proyecto (/api/embed, /api/chat,
+    /api/generate, /api/show, /api/tags, /api/ps) con embeddings deterministas y tokens fijos.
+    Guarda los tokens de cada prompt recibido para el informe del benchmark. Con
+    `load_delay`, un modelo que no está cargado tarda eso en cargarse y se descarga
+    según el keep_alive de cada petición, como Ollama.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        dim: int = 768,
+        embed_delay: float = 0.0,
+        first_token_delay: float = 0.05,
+        token_delay: float = 0.01,
+        load_delay: float = 0.0,
+        models=None,
+    ):
+        # Modelos que /api/tags da por descargados (01_setup_models.py no intenta el pull)
+        self.models = list(models or [
+            os.getenv("OLLAMA_MODEL", "phi3:mini"),
+            os.getenv("OLLAMA_EMBED_MODEL", "nomic-embed-text") + ":latest",
+        ])
+        self.dim = dim
+        self.embed_delay = embed_delay
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.load_delay = load_delay
+        self.loads = 0
+        self._expires = {}  # modelo cargado -> time.monotonic() en que se descarga
+        self.tokens = [t + " " for t in CANNED_ANSWER.split(" ")]
+        self._lock = threading.Lock()
+        self.prompt_tokens = []
+        self.embed_requests = 0
+        self.generations = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockOllama":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.prompt_tokens = []
+            self.embed_requests = 0
+            self.generations = 0
+            self.loads = 0
+
+    def _use(self, model: str, keep_alive) -> float:
+        """
+        Carga el modelo si no lo está (load_delay) y renueva su keep_alive. Devuelve los s de carga.
+        """
+        keep = keep_alive_seconds(keep_alive)
+        with self._lock:
+            loaded = self._expires.get(model, 0) > time.monotonic()
+            if not loaded:
+                self.loads += 1
+        if not loaded:
+            time.sleep(self.load_delay)
+        with self._lock:
+            if keep == 0:
+                self._expires.pop(model, None)
+            else:
+                self._expires[model] = time.monotonic() + (keep if keep > 0 else float("inf"))
+        return 0.0 if loaded else self.load_delay
+
+    def _record_prompt(self, text: str) -> int:
+        n = count_tokens(text)
+        with self._lock:
+            self.prompt_tokens.append(n)
+            self.generations += 1
+        return n
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, fmt, *args):
+                pass
+
+            def _json(self, payload: dict, status: int = 200) -> None:
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    self._json({"models": [{"name": m, "model": m} for m in mock.models]})
+                elif self.path == "/api/ps":
+                    now = time.monotonic()
+                    with mock._lock:
+                        loaded = [m for m, t in mock._expires.items() if t > now]
+                    self._json({"models": [{"name": m, "model": m, "size": 2**30} for m in loaded]})
+                elif self.path == "/api/version":
+                    self._json({"version": "mock"})
+                else:
+                    self._json({"status": "Ollama is running"})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                data = json.loads(self.rfile.read(length) or b"{}")
+                if self.path == "/api/embed":
+                    texts = data.get("input") or []
+                    texts = [texts] if isinstance(texts, str) else texts
+                    with mock._lock:
+                        mock.embed_requests += 1
+                    load = mock._use(data.get("model"), data.get("keep_alive"))
+                    time.sleep(mock.embed_delay)
+                    self._json({
+                        "model": data.get("model"),
+                        "embeddings": [fake_embedding(t, mock.dim) for t in texts],
+                        "load_duration": int(load * 1e9),
+                    })
+                elif self.path == "/api/embeddings":
+                    with mock._lock:
+                        mock.embed_requests += 1
+                    time.sleep(mock.embed_delay)
+                    self._json({"embedding": fake_embedding(data.get("prompt", ""), mock.dim)})
+                elif self.path == "/api/show":
+                    self._json({"model_info": {"mock.context_length": 2048}, "capabilities": ["completion"]})
+                elif self.path in ("/api/chat", "/api/generate"):
+                    self._generate(data, chat=self.path == "/api/chat")
+                else:
+                    self._json({"error": f"ruta no soportada: {self.path}"}, status=404)
+
+            def _generate(self, data: dict, chat: bool) -> None:
+                if not chat and not data.get("prompt"):
+                    # Prompt vacío: solo carga el modelo (o lo descarga con keep_alive=0)
+                    unload = keep_alive_seconds(data.get("keep_alive")) == 0
+                    if unload:
+                        with mock._lock:
+                            mock._expires.pop(data.get("model"), None)
+                    load = 0.0 if unload else mock._use(data.get("model"), data.get("keep_alive"))
+                    self._json({
+                        "model": data.get("model"), "response": "", "done": True,
+                        "done_reason": "unload" if unload else "load", "load_duration": int(load * 1e9),
+                    })
+                    return
+                if chat:
+                    prompt = "\n".join(m.get("content") or "" for m in data.get("messages", []))
+                else:
+                    prompt = data.get("prompt", "")
+                n_prompt = mock._record_prompt(prompt)
+                load = mock._use(data.get("model"), data.get("keep_alive"))
+                started = time.perf_counter()
+
+                def chunk(text: str, done: bool) -> dict:
+                    out = {
+                        "model": data.get("model"),
+                        "created_at": datetime.now(timezone.utc).isoformat(),
+                        "done": done,
+                    }
+                    if chat:
+                        out["message"] = {"role": "assistant", "content": text}
+                    else:
+                        out["response"] = text
+                    if done:
+                        out.update(
+                            done_reason="stop", prompt_eval_count=n_prompt, eval_count=len(mock.tokens),
+                            load_duration=int(load * 1e9),
+                            prompt_eval_duration=int(mock.first_token_delay * 1e9),
+                            eval_duration=int((time.perf_counter() - started - mock.first_token_delay) * 1e9),
+                        )
+                    return out
+
+                time.sleep(mock.first_token_delay)
+                if not data.get("stream", True):
+                    time.sleep(mock.token_delay * (len(mock.tokens) - 1))
+                    self._json(chunk("".join(mock.tokens), done=True))
+                    return
+
+                # NDJSON sin Content-Length (HTTP/1.0): el cliente lee hasta que se cierra
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+                for i, token in enumerate(mock.tokens):
+                    if i:
+                        time.sleep(mock.token_delay)
+                    self.wfile.write((json.dumps(chunk(token, done=False)) + "\n").encode("utf-8"))
+                    self.wfile.flush()
+                self.wfile.write((json.dumps(chunk("", done=True)) + "\n").encode("utf-8"))
+
+        return Handler
+
+
+def keep_alive_seconds(value) -> float:
+    """
+    keep_alive de una petición en segundos (5 minutos si no viene, como Ollama).
+    """
+    if value is None:
+        return 300.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "": 1}
+    return sum(float(n) * units[u] for n, u in re.findall(r"(-?\d+(?:\.\d+)?)(ms|s|m|h)?", value))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Ollama simulado para benchmarks")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--dim", type=int, default=768, help="Dimensión de los embeddings")
+    parser.add_argument("--embed-delay", type=float, default=0.0, help="Segundos por petición de embeddings")
+    parser.add_argument("--first-token-delay", type=float, default=0.05, help="Segundos hasta el primer token")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="Segundos entre tokens")
+    parser.add_argument("--load-delay", type=float, default=0.0, help="Segundos que tarda en cargarse un modelo")
+    args = parser.parse_args()
+
+    mock = MockOllama(
+        port=args.port,
+        dim=args.dim,
+        embed_delay=args.embed_delay,
+        first_token_delay=args.first_token_delay,
+        token_delay=args.token_delay,
+        load_delay=args.load_delay,
+    )
+    print(f"Ollama simulado en {mock.url} (OLLAMA_BASE_URL={mock.url})")
+    try:
+        mock._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -7,8 +7,8 @@ from pathlib import Path
 ROOT = Path(__file__).resolve().parents[2]
 sys.path.append(str(ROOT))
 
-from llama_index.core import StorageContext, load_index_from_storage
-from app.rag_utils import configure_llamaindex_defaults
+from app.rag_utils import load_index
+from app.snapshots import current_dir
 
 
 def main() -> int:
@@ -17,11 +17,10 @@ def main() -> int:
     parser.add_argument("--top-k", type=int, default=10)
     args = parser.parse_args()
 
-    persist_dir = ROOT / "index_store"
+    persist_dir = current_dir(ROOT / "index_store")
 
-    configure_llamaindex_defaults()
-    storage = StorageContext.from_defaults(persist_dir=str(persist_dir))
-    index = load_index_from_storage(storage)
+    # Misma carga que el servidor: con el almacén NumPy el índice no está en "default"
+    index = load_index(str(persist_dir))
     retriever = index.as_retriever(similarity_top_k=args.top_k)
 
     results = retriever.retrieve(args.query)
@@ -1,23 +1,45 @@
 from __future__ import annotations
 
+import hmac
+import json
 import os
 import sys
 import subprocess
+import threading
+import time
 from pathlib import Path
 
+# Arranque del proceso: /ready informa de cuánto tardó en estar listo
+STARTED = time.perf_counter()
+
 from dotenv import load_dotenv
-from flask import Flask, jsonify, render_template, request
+from flask import Flask, Response, g, jsonify, render_template, request, stream_with_context
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 sys.path.append(str(PROJECT_ROOT))
 
-from app.rag_utils import load_index, get_llm
-from llama_index.core.query_engine import RetrieverQueryEngine
+# Solo módulos ligeros: llama_index, numpy y el índice se cargan en boot(), con el puerto ya abierto
+from app.config import (
+    ANSWER_CACHE_ENABLED, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL, ANSWER_CACHE_MAX, BACKGROUND_BOOT,
+    ADMIN_TOKEN, BATCH_CONCURRENCY, BATCH_MAX_QUESTIONS, CATALOG_MEMORY_MB, LLM_CONCURRENCY, LLM_MAX_QUEUE,
+    LLM_QUEUE_TIMEOUT, LLM_REQUEST_TIMEOUT, MODEL_PREWARM, SNAPSHOT_KEEP, SNAPSHOT_POLL_SECONDS, WEB_SERVER,
+    WEB_THREADS,
+)
+from app.fingerprint import mark_pipeline_current, pipeline_is_current
+from app.llm_pool import GenerationPool, GenerationTimeout, QueueFullError, QueueTimeoutError
+from app.prompts import build_prompt
+from app.metrics import (
+    DIRECT_REPLIES, HTTP_REQUESTS, HTTP_SECONDS, REGISTRY, TTFT_SECONDS, record_stage, sample, timed, track_request,
+)
+from app.shards import CatalogSpec, CatalogUnavailableError, ShardPool, UnknownCatalogError, load_catalogs
+from app.snapshots import ServingSnapshot, collect_garbage, current_dir
 
 ENV_PATH = PROJECT_ROOT / ".env"
 load_dotenv(dotenv_path=ENV_PATH)
 
-PERSIST_DIR = PROJECT_ROOT / "index_store"
+# Catálogos (catalogs.json, app/shards.py): cada uno con su CSV, su base de datos de Neo4j y su
+# raíz de instantáneas (el índice en servicio es el de <raíz>/CURRENT, app/snapshots.py)
+CATALOGS = load_catalogs()
 
 INTRO_TEXT = (
     "Hola. Soy un asistente RAG de especificaciones de moviles. "
@@ -26,34 +48,44 @@ INTRO_TEXT = (
     "Solo respondo preguntas sobre moviles."
 )
 
-SYSTEM_PROMPT = (
-        "Eres un asistente especializado en smartphones. Responde siempre en espanol de Espana, "
-    "tutea y usa un tono natural. Evita modismos latinoamericanos. "
-    "No uses 'senor/senora' ni tratamientos formales. No mezcles ingles ni escribas etiquetas.\n\n"
-    "Reglas de comportamiento:\n"
-    "Tu objetivo es dar información sobre un modelo de smartphone o recomendar al usuario un smartphone segun la informacion que te proporcione"
-    "Nunca des el precio exactamente, di que varia según la zona. Da una estimacion de si es caro o barato"
-
-    "Además, se muy concreto de responder lo que te pregunta el usuario"
-
-    "Si te preguntan algo que no está relacionado con telefonos moviles, rechaza amablemente la pregunta y di cual es tu función"
-)
+# Ficha de un teléfono en el grafo con sus categorías (SO, chipset, red...)
+PHONE_QUERY = """
+MATCH (p:Phone {model: toLower($model)})
+OPTIONAL MATCH (p)-[r]->(c)
+WHERE NOT c:Phone
+WITH p, collect({rel: type(r), name: c.name}) AS links
+OPTIONAL MATCH (p)-[s:SIMILAR_TO]->(q:Phone)
+WITH p, links, s, q ORDER BY s.rank
+RETURN properties(p) AS phone, links, collect({model: q.model_raw, score: s.score}) AS similar
+"""
 
 
-def build_prompt(q: str) -> str:
-    return f"{SYSTEM_PROMPT}\n\nPregunta del usuario: {q}"
+def run_script(script: str, *args: str) -> None:
+    script_path = PROJECT_ROOT / "scripts" / script
+    started = time.perf_counter()
+    subprocess.run([sys.executable, str(script_path), *args], check=True, cwd=str(PROJECT_ROOT))
+    record_stage(f"pipeline:{script}", time.perf_counter() - started)
 
 
 def run_pipeline() -> None:
-    scripts = [
-        "00_check_env.py",
-        "01_setup_models.py",
-        "02_load_neo4j.py",
-        "03_build_rag.py",
-    ]
-    for script in scripts:
-        script_path = PROJECT_ROOT / "scripts" / script
-        subprocess.run([sys.executable, str(script_path)], check=True, cwd=str(PROJECT_ROOT))
+    for script in ("00_check_env.py", "01_setup_models.py"):
+        run_script(script)
+
+    # Carga + indexado de cada catálogo solo si su CSV, el modelo de embeddings o la versión del
+    # pipeline han cambiado, o si su grafo ya no es el que se cargó
+    for spec in CATALOGS.values():
+        if not spec.csv_path.exists():
+            print(f"Aviso: no existe {spec.csv_path}; el catálogo {spec.name} se sirve con el índice que tenga")
+            continue
+        persist_dir = current_dir(spec.persist_dir)
+        if os.getenv("PIPELINE_FORCE", "0") != "1" and pipeline_is_current(
+            persist_dir, spec.csv_path, database=spec.database
+        ):
+            print(f"Catálogo {spec.name} sin cambios: se omiten 02_load_neo4j.py y 03_build_rag.py")
+            continue
+        for script in ("02_load_neo4j.py", "03_build_rag.py"):
+            run_script(script, "--catalog", spec.name)
+        mark_pipeline_current(current_dir(spec.persist_dir), spec.csv_path)
 
 
 def reset_ollama_model() -> None:
@@ -66,19 +98,181 @@ def reset_ollama_model() -> None:
         pass
 
 
-def create_query_engine():
-    index = load_index(str(PERSIST_DIR))
-    llm = get_llm()
-    retriever = index.as_retriever(
-        similarity_top_k=10,
-        vector_store_query_mode="mmr",
-        alpha=0.7,
-    )
-    return RetrieverQueryEngine.from_args(retriever, llm=llm)
+class NotReadyError(Exception):
+    """El índice todavía se está cargando (el servidor responde 503)."""
+
+
+class GraphUnavailableError(Exception):
+    """Neo4j no responde (el servidor responde 503)."""
 
 
 app = Flask(__name__)
-QUERY_ENGINE = None
+# Cachés de respuestas, una por catálogo (se crean con su primera carga)
+ANSWER_CACHES = {}
+# Estado del arranque para /ready: starting -> pipeline -> loading_index -> ready | error
+BOOT = {"stage": "starting", "error": None, "ready_s": None}
+LLM_POOL = GenerationPool(
+    concurrency=LLM_CONCURRENCY,
+    max_queue=LLM_MAX_QUEUE,
+    queue_timeout=LLM_QUEUE_TIMEOUT,
+    request_timeout=LLM_REQUEST_TIMEOUT,
+)
+
+
+def runtime_metrics() -> list:
+    """
+    Métricas leídas en el momento del scrape: cola del LLM y cachés.
+    """
+    pool = LLM_POOL.stats()
+    lines = sample("rag_llm_active", "gauge", "Generaciones en curso", {"": pool["active"]})
+    lines += sample("rag_llm_queue_depth", "gauge", "Peticiones esperando hueco en el LLM", {"": pool["queued"]})
+    lines += sample("rag_llm_rejected_total", "counter", "Peticiones rechazadas (429/503)", {"": pool["rejected"]})
+    lines += sample("rag_llm_timeouts_total", "counter", "Generaciones que superaron el tiempo máximo", {"": pool["timeouts"]})
+    loaded = SHARDS.loaded()
+    if loaded:
+        now = time.time()
+        lines += sample(
+            "rag_index_snapshot_age_seconds", "gauge", "Segundos desde que se cargó el índice en servicio de cada catálogo",
+            {s.catalog: round(now - s.loaded_at, 1) for s in loaded}, labelname="catalog",
+        )
+        lines += sample(
+            "rag_catalog_memory_bytes", "gauge", "Tamaño estimado de los índices de catálogo cargados",
+            {s.catalog: s.size_bytes for s in loaded}, labelname="catalog",
+        )
+    caches = [cache.stats() for cache in list(ANSWER_CACHES.values())]
+    if caches:
+        lines += sample(
+            "rag_answer_cache_lookups_total", "counter", "Búsquedas en la caché de respuestas",
+            {
+                "exact": sum(c["exact_hits"] for c in caches),
+                "semantic": sum(c["semantic_hits"] for c in caches),
+                "miss": sum(c["misses"] for c in caches),
+            },
+            labelname="result",
+        )
+        lines += sample("rag_answer_cache_entries", "gauge", "Respuestas en caché", {"": sum(c["entries"] for c in caches)})
+    cache = embed_cache_stats()
+    if cache:
+        lines += sample(
+            "rag_embed_cache_lookups_total", "counter", "Búsquedas en la caché de embeddings",
+            {"hit": cache["hits"], "miss": cache["misses"]},
+            labelname="result",
+        )
+    models = model_stats()
+    if models:
+        lines += sample(
+            "rag_model_loaded", "gauge", "Modelo cargado en Ollama (1) o no (0)",
+            {role: int(m["loaded"]) for role, m in models["models"].items()},
+            labelname="role",
+        )
+    return lines
+
+
+REGISTRY.register_collector(runtime_metrics)
+
+
+def embed_cache_stats():
+    if not is_ready():
+        return None
+    from app.rag_utils import get_embed_cache
+
+    cache = get_embed_cache()
+    return cache.stats() if cache else None
+
+
+def is_ready() -> bool:
+    # Listo en cuanto se ha cargado un índice (el del catálogo por defecto, en boot())
+    return SHARDS.loads > 0
+
+
+def require_ready(catalog=None) -> ServingSnapshot:
+    """
+    Instantánea en servicio del catálogo pedido (por defecto, DEFAULT_CATALOG). Si no
+    estaba cargada se carga ahora (y puede descargar la usada hace más tiempo).
+    """
+    if not is_ready():
+        raise NotReadyError(BOOT["stage"])
+    return SHARDS.get(catalog)
+
+
+def requested_catalog(data) -> str | None:
+    # "catalog" en el cuerpo JSON o en la URL (?catalog=); None = DEFAULT_CATALOG
+    if isinstance(data, dict) and data.get("catalog"):
+        return str(data["catalog"])
+    return request.args.get("catalog") or None
+
+
+def answer_cache(serving: ServingSnapshot):
+    return ANSWER_CACHES.get(serving.catalog)
+
+
+def answer_directly(message: str, spec_table):
+    """
+    Consulta de un dato o comparativa de modelos concretos ("batería del oneplus 11",
+    "compara iphone 14 y pixel 7"): respuesta de la tabla de especificaciones en milisegundos, sin LLM.
+    """
+    if spec_table is None or not message:
+        return None
+    with timed("direct_answer"):
+        direct = spec_table.answer(message)
+    if direct:
+        DIRECT_REPLIES.inc(intent=direct["intent"])
+    return direct
+
+
+def wants_debug(data: dict) -> bool:
+    return bool(data.get("debug")) or request.args.get("debug") == "1"
+
+
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+
+
+@app.after_request
+def count_request(response):
+    endpoint = request.url_rule.rule if request.url_rule else "unknown"
+    HTTP_REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    # Los streams se miden al terminar de enviarse (events())
+    if not response.is_streamed:
+        HTTP_SECONDS.observe(time.perf_counter() - g.started, endpoint=endpoint)
+    return response
+
+
+@app.errorhandler(QueueFullError)
+def queue_full(e):
+    return jsonify({"error": "Servidor ocupado, inténtalo de nuevo en unos segundos."}), 429, {"Retry-After": "5"}
+
+
+@app.errorhandler(QueueTimeoutError)
+def queue_timeout(e):
+    return jsonify({"error": "Servidor ocupado, inténtalo de nuevo en unos segundos."}), 503, {"Retry-After": "10"}
+
+
+@app.errorhandler(NotReadyError)
+def not_ready(e):
+    return jsonify({"error": "El asistente se está iniciando, inténtalo en unos segundos.", "stage": BOOT["stage"]}), 503, {"Retry-After": "5"}
+
+
+@app.errorhandler(GraphUnavailableError)
+def graph_unavailable(e):
+    return jsonify({"error": "La base de datos de teléfonos no está disponible."}), 503, {"Retry-After": "10"}
+
+
+@app.errorhandler(UnknownCatalogError)
+def unknown_catalog(e):
+    return jsonify({"error": f"No existe el catálogo '{e.args[0]}'.", "catalogs": list(CATALOGS)}), 404
+
+
+@app.errorhandler(CatalogUnavailableError)
+def catalog_unavailable(e):
+    print(f"[catalog] {e}")
+    return jsonify({"error": "El catálogo no está disponible en este momento."}), 503, {"Retry-After": "30"}
+
+
+@app.errorhandler(GenerationTimeout)
+def generation_timeout(e):
+    return jsonify({"error": "La respuesta ha tardado demasiado."}), 504
 
 
 @app.get("/")
@@ -92,25 +286,430 @@ def chat():
     message = (data.get("message") or "").strip()
     if not message:
         return jsonify({"reply": ""})
+    serving = require_ready(requested_catalog(data))
+    cache = answer_cache(serving)
+
+    started = time.perf_counter()
+    with serving.use(), track_request() as timings:
+        direct = answer_directly(message, serving.spec_table)
+        cached = cache.lookup(message) if (cache and not direct) else None
+        if direct:
+            print(f"[chat] directa={direct['intent']} total={(time.perf_counter() - started) * 1000:.1f}ms")
+            body = {"reply": direct["reply"], "direct": direct["intent"]}
+        elif cached:
+            print(f"[chat] cache={cached[1]} total={(time.perf_counter() - started) * 1000:.1f}ms")
+            body = {"reply": cached[0], "cached": cached[1]}
+        else:
+            prompt = build_prompt(message)
+            reply = LLM_POOL.run(lambda: str(serving.engine.query(prompt)))
+            if cache:
+                cache.store(message, reply, version=serving.version)
+            print(f"[chat] {serving.catalog} total={(time.perf_counter() - started) * 1000:.0f}ms {timings.as_dict()['stages_ms']}")
+            body = {"reply": reply}
+    if wants_debug(data):
+        body["timings"] = {**timings.as_dict(), "total_ms": round((time.perf_counter() - started) * 1000, 1)}
+    return jsonify(body)
+
+
+def sse(event: str, payload: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
 
-    prompt = build_prompt(message)
-    resp = QUERY_ENGINE.query(prompt)
-    return jsonify({"reply": str(resp)})
+
+@app.post("/api/chat/stream")
+def chat_stream():
+    """
+    Igual que /api/chat pero envía los tokens según se generan (Server-Sent Events):
+    eventos "token" con {"t": ...} y un evento final "done" con los tiempos.
+    """
+    data = request.get_json(silent=True) or {}
+    message = (data.get("message") or "").strip()
+    debug = wants_debug(data)
+    serving = require_ready(requested_catalog(data)) if message else None
+    cache = answer_cache(serving) if serving else None
+    started = time.perf_counter()
+    with track_request() as lookup_timings:
+        direct = answer_directly(message, serving.spec_table if serving else None)
+        cached = cache.lookup(message) if (cache and not direct) else None
+    if direct or cached:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if direct:
+            reply, tag, source = direct["reply"], {"direct": direct["intent"]}, f"directa={direct['intent']}"
+        else:
+            reply, tag, source = cached[0], {"cached": cached[1]}, f"cache={cached[1]}"
+        print(f"[chat/stream] {source} total={elapsed_ms:.1f}ms")
+        done = {"ttft_ms": round(elapsed_ms, 1), "total_ms": round(elapsed_ms, 1), **tag}
+        if debug:
+            done["timings"] = lookup_timings.as_dict()
+        body = sse("token", {"t": reply}) + sse("done", done)
+        return Response(body, mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    # Admisión antes de abrir el stream: si no hay hueco, 429/503 normal
+    lease = LLM_POOL.acquire() if message else None
+    if serving is not None:
+        serving.enter()  # hasta cerrar la respuesta: el stream termina con esta instantánea
+
+    def generate():
+        resp = serving.engine.query(build_prompt(message))
+        yield from getattr(resp, "response_gen", None) or [str(resp)]
+
+    # Una vez empezado el stream el hueco es de LLM_POOL.stream, que lo libera cuando
+    # termina la generación aunque el cliente ya se haya ido
+    streaming = threading.Event()
+
+    def events():
+        if not message:
+            yield sse("done", {"ttft_ms": 0, "total_ms": 0})
+            return
+        ttft_ms = None
+        parts = []
+        with track_request() as timings:
+            timings.stages.update(lookup_timings.stages)
+            try:
+                streaming.set()
+                for token in LLM_POOL.stream(lease, generate):
+                    if ttft_ms is None:
+                        ttft_ms = (time.perf_counter() - started) * 1000
+                        TTFT_SECONDS.observe(ttft_ms / 1000)
+                        print(f"[chat/stream] ttft={ttft_ms:.0f}ms")
+                    parts.append(token)
+                    yield sse("token", {"t": token})
+            except Exception as e:
+                print(f"[chat/stream] error: {e}")
+                yield sse("error", {"message": "No he podido generar la respuesta."})
+                return
+            if cache:
+                cache.store(message, "".join(parts), version=serving.version)
+        total_ms = (time.perf_counter() - started) * 1000
+        HTTP_SECONDS.observe(total_ms / 1000, endpoint="/api/chat/stream")
+        print(f"[chat/stream] total={total_ms:.0f}ms {timings.as_dict()['stages_ms']}")
+        done = {"ttft_ms": round(ttft_ms or total_ms), "total_ms": round(total_ms)}
+        if debug:
+            done["timings"] = timings.as_dict()
+        yield sse("done", done)
+
+    response = Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    if lease is not None:
+        # Por si el cliente se va antes de que empiece el stream
+        response.call_on_close(lambda: streaming.is_set() or lease.release())
+    if serving is not None:
+        response.call_on_close(serving.exit)
+    return response
+
+
+def generate_in_pool(fn, cancelled):
+    """
+    Generación de una pregunta del lote a través de la cola del LLM con prioridad baja:
+    solo entra cuando hay hueco y ninguna petición interactiva esperando, y no ocupa la
+    cola (LLM_MAX_QUEUE), así que un lote no provoca 429/503 en /api/chat.
+    """
+    return LLM_POOL.run_background(fn, cancelled=cancelled)
+
+
+@app.post("/api/chat/batch")
+def chat_batch():
+    """
+    Modo lote: {"questions": [...]} (cadenas u objetos {"id", "question"}) o un cuerpo JSONL.
+    Responde en JSONL (application/x-ndjson) una línea por pregunta según terminan, con
+    sus tiempos, y una última línea {"done": true, ...} con el resumen del lote.
+    """
+    from app.batch import BatchRunner, parse_questions
+    from app.rag_utils import embed_questions
+
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        items = parse_questions(json.dumps(q, ensure_ascii=False) for q in data.get("questions") or [])
+    else:
+        items = parse_questions(request.get_data(as_text=True).splitlines())
+    if len(items) > BATCH_MAX_QUESTIONS:
+        return jsonify({"error": f"Como máximo {BATCH_MAX_QUESTIONS} preguntas por lote."}), 413
+    serving = require_ready(requested_catalog(data)) if items else None
+
+    runner = BatchRunner(
+        serving.engine if serving else None,
+        build_prompt,
+        embed_fn=embed_questions,
+        direct_fn=lambda q: answer_directly(q, serving.spec_table),
+        answer_cache=answer_cache(serving) if serving else None,
+        concurrency=BATCH_CONCURRENCY,
+        generate_fn=generate_in_pool,
+        cache_version=serving.version if serving else None,
+    )
+
+    def lines():
+        for result in runner.run(items):
+            if result.get("done"):
+                HTTP_SECONDS.observe(result["total_ms"] / 1000, endpoint="/api/chat/batch")
+                print(
+                    f"[chat/batch] {result['questions']} preguntas ({result['unique']} distintas) "
+                    f"total={result['total_ms']:.0f}ms {result['sources']}"
+                )
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    response = Response(
+        stream_with_context(lines()),
+        mimetype="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    if serving is not None:
+        serving.enter()
+        response.call_on_close(serving.exit)
+    return response
+
+
+@app.get("/api/phones/<path:model>")
+def phone(model: str):
+    """
+    Consulta directa al grafo por el driver compartido (pool de conexiones): propiedades
+    del teléfono y sus relaciones, sin pasar por el índice ni por el LLM.
+    ?catalog= elige la base de datos del catálogo (sin cargar su índice).
+    """
+    from neo4j.exceptions import Neo4jError, ServiceUnavailable
+    from app.neo4j_utils import read_query
+
+    spec = SHARDS.spec(requested_catalog(None))
+    try:
+        with timed("neo4j_lookup"):
+            rows = read_query(PHONE_QUERY, {"model": model.strip()}, retry=False, database=spec.database)
+    except (ServiceUnavailable, Neo4jError) as e:
+        print(f"[phones] Neo4j: {e}")
+        raise GraphUnavailableError() from e
+    if not rows:
+        return jsonify({"error": f"No encuentro el modelo '{model}'."}), 404
+    props = {k: v for k, v in rows[0]["phone"].items() if k not in ("text", "row_hash")}
+    links = {link["rel"]: link["name"] for link in rows[0]["links"] if link["rel"]}
+    similar = [s for s in rows[0]["similar"] if s["model"]]
+    return jsonify({"phone": props, "links": links, "similar": similar})
+
+
+def model_stats():
+    if not is_ready():
+        return None
+    from app.rag_utils import get_residency
+
+    return get_residency().stats()
+
+
+@app.get("/api/stats")
+def stats():
+    serving = SHARDS.peek()
+    return jsonify({
+        "llm_pool": LLM_POOL.stats(),
+        "answer_cache": {name: cache.stats() for name, cache in list(ANSWER_CACHES.items())} or None,
+        "embed_cache": embed_cache_stats(),
+        "models": model_stats(),
+        "index": serving.stats() if serving else None,
+        "catalogs": SHARDS.stats(),
+    })
+
+
+@app.get("/api/catalogs")
+def catalogs():
+    """
+    Catálogos que sirve el proceso (los valores válidos de "catalog") y cuáles están cargados.
+    """
+    loaded = {s.catalog: s.version for s in SHARDS.loaded()}
+    return jsonify({
+        "default": SHARDS.default,
+        "catalogs": [
+            {"name": name, "currency": spec.currency, "loaded": name in loaded, "version": loaded.get(name)}
+            for name, spec in CATALOGS.items()
+        ],
+    })
+
+
+@app.get("/metrics")
+def metrics():
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
 
 
 @app.get("/health")
 def health():
+    # Vivo: responde en cuanto el puerto está abierto, aunque el índice siga cargando
     return {"ok": True}
 
 
+@app.get("/ready")
+def ready():
+    serving = SHARDS.peek()
+    body = {
+        "ready": is_ready(),
+        "index_version": serving.version if serving else None,
+        "catalogs_loaded": [s.catalog for s in SHARDS.loaded()],
+        **BOOT,
+    }
+    return jsonify(body), 200 if body["ready"] else 503
+
+
+def load_engine(spec: CatalogSpec, path: Path):
+    """
+    Motor y tabla de especificaciones de una instantánea del catálogo (ShardPool la llama
+    fuera del camino de las peticiones de los demás catálogos).
+    """
+    from app.rag_utils import create_query_engine, embed_question, load_spec_table
+
+    engine = create_query_engine(str(path), database=spec.database)
+    spec_table = load_spec_table(str(path))
+    if ANSWER_CACHE_ENABLED and spec.name not in ANSWER_CACHES:
+        from app.answer_cache import AnswerCache
+
+        ANSWER_CACHES[spec.name] = AnswerCache(
+            embed_fn=embed_question,
+            # Se vacía sola al cambiar de instantánea del catálogo
+            version_fn=lambda: getattr(SHARDS.peek(spec.name), "version", None),
+            threshold=ANSWER_CACHE_THRESHOLD,
+            ttl=ANSWER_CACHE_TTL,
+            max_entries=ANSWER_CACHE_MAX,
+            # Modelos y marcas del catálogo en servicio, para no reutilizar la respuesta de otro
+            matcher_fn=lambda: getattr(getattr(SHARDS.peek(spec.name), "spec_table", None), "matcher", None),
+        )
+    return engine, spec_table
+
+
+def retire(spec: CatalogSpec, previous: ServingSnapshot) -> None:
+    """
+    Espera a que terminen las peticiones que usaban la instantánea que sale de servicio
+    (recargada o descargada), la libera y borra las que sobran (SNAPSHOT_KEEP).
+    """
+    if not previous.drain(timeout=LLM_QUEUE_TIMEOUT + LLM_REQUEST_TIMEOUT):
+        print(f"Aviso: {previous.active} peticiones siguen con la instantánea {spec.name}@{previous.version}")
+    previous.release()
+    removed = collect_garbage(spec.persist_dir, keep=SNAPSHOT_KEEP)
+    if removed:
+        print(f"Instantáneas borradas ({spec.name}): {', '.join(removed)}")
+
+
+# Índices en servicio por catálogo: se cargan al pedirlos y se descargan los usados hace más
+# tiempo si no caben en CATALOG_MEMORY_MB. Cada petición toma su instantánea una vez y la usa
+# hasta terminar, aunque entretanto se recargue o se descargue
+SHARDS = ShardPool(CATALOGS, load_engine, retire, budget_bytes=int(CATALOG_MEMORY_MB * 1024 * 1024))
+
+
+def load_snapshot(catalog=None) -> str:
+    """
+    Carga la instantánea de <raíz del catálogo>/CURRENT (o el índice con el formato antiguo)
+    y la pone en servicio con una sola asignación. Las peticiones en curso terminan con la
+    anterior, que se libera al acabar (retire()). Devuelve la versión en servicio.
+    """
+    return SHARDS.load(catalog).version
+
+
+def watch_snapshots() -> None:
+    """
+    Cada SNAPSHOT_POLL_SECONDS comprueba si 03_build_rag.py ha publicado una instantánea
+    nueva de algún catálogo cargado y, si la hay, la carga en este hilo (las peticiones
+    siguen con la actual).
+    """
+    while True:
+        time.sleep(SNAPSHOT_POLL_SECONDS)
+        try:
+            SHARDS.refresh()
+        except Exception as e:
+            print(f"Aviso: no se pudieron comprobar las instantáneas ({e})")
+
+
+def is_admin() -> bool:
+    # Con ADMIN_TOKEN, cabecera X-Admin-Token; sin él, solo peticiones desde la propia máquina
+    if ADMIN_TOKEN:
+        return hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN)
+    return request.remote_addr in ("127.0.0.1", "::1")
+
+
+@app.post("/api/admin/reload")
+def admin_reload():
+    """
+    Carga ya la instantánea de <raíz>/CURRENT del catálogo ({"catalog": ...} o ?catalog=,
+    por defecto DEFAULT_CATALOG), sin esperar al vigilante.
+    """
+    if not is_admin():
+        return jsonify({"error": "No autorizado."}), 403
+    if not is_ready():
+        raise NotReadyError(BOOT["stage"])
+    spec = SHARDS.spec(requested_catalog(request.get_json(silent=True)))
+    serving = SHARDS.peek(spec.name)
+    previous = serving.version if serving else None
+    try:
+        version = load_snapshot(spec.name)
+    except CatalogUnavailableError as e:
+        print(f"[admin/reload] error: {e}")
+        return jsonify({"error": f"No se pudo cargar la instantánea: {e}", "version": previous}), 500
+    return jsonify({"catalog": spec.name, "version": version, "previous": previous, "swapped": version != previous})
+
+
+def warm_graph() -> None:
+    """
+    Abre ya la primera conexión del pool compartido: la primera consulta no paga el handshake.
+    """
+    from app.neo4j_utils import shared_driver
+
+    try:
+        shared_driver().verify_connectivity()
+    except Exception as e:
+        print(f"Aviso: Neo4j no disponible ({e}); el prefiltrado y /api/phones fallarán hasta que vuelva")
+
+
+def warm_models() -> threading.Thread:
+    """
+    Precarga el LLM y el modelo de embeddings en Ollama (en paralelo con la carga del
+    índice) y arranca el vigilante de inactividad y memoria.
+    """
+    from app.rag_utils import get_residency
+
+    residency = get_residency().start()
+
+    def prewarm():
+        if MODEL_PREWARM:
+            print(f"Modelos precargados: {residency.prewarm()} s (keep_alive={residency.keep_alive})")
+
+    thread = threading.Thread(target=prewarm, name="prewarm", daemon=True)
+    thread.start()
+    return thread
+
+
+def boot() -> None:
+    """
+    Pipeline (solo los pasos necesarios) + carga del índice y precarga de los modelos.
+    Con BACKGROUND_BOOT=1 corre en un hilo mientras el servidor ya atiende /health y /ready.
+    """
+    try:
+        if os.getenv("OLLAMA_RESET_ON_START", "0") == "1":
+            reset_ollama_model()
+        BOOT["stage"] = "pipeline"
+        run_pipeline()
+        BOOT["stage"] = "loading_index"
+        prewarm = warm_models()
+        load_snapshot()
+        warm_graph()
+        prewarm.join()
+    except Exception as e:
+        BOOT.update(stage="error", error=str(e))
+        print(f"Error en el arranque: {e}")
+        raise
+    BOOT["ready_s"] = round(time.perf_counter() - STARTED, 2)
+    BOOT["stage"] = "ready"
+    record_stage("startup", BOOT["ready_s"])
+    print(f"Listo en {BOOT['ready_s']:.1f}s (catálogo {SHARDS.default}, índice {SHARDS.peek().version})")
+    if SNAPSHOT_POLL_SECONDS > 0:
+        threading.Thread(target=watch_snapshots, name="snapshot-watch", daemon=True).start()
+
+
 def main() -> None:
-    global QUERY_ENGINE
-    if os.getenv("OLLAMA_RESET_ON_START", "0") == "1":
-        reset_ollama_model()
-    run_pipeline()
-    QUERY_ENGINE = create_query_engine()
+    if BACKGROUND_BOOT:
+        threading.Thread(target=boot, name="boot", daemon=True).start()
+    else:
+        boot()
     port = int(os.getenv("WEB_APP_PORT", "8000"))
-    app.run(host="0.0.0.0", port=port, debug=False)
+    print(f"Escuchando en http://localhost:{port} (estado en /ready)")
+    if WEB_SERVER == "waitress":
+        from waitress import serve
+
+        # Hilos WSGI de sobra: la concurrencia real del LLM la limita LLM_POOL
+        serve(app, host="0.0.0.0", port=port, threads=WEB_THREADS)
+    else:
+        app.run(host="0.0.0.0", port=port, debug=False, threaded=True)
 
 
 if __name__ == "__main__":
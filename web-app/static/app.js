@@ -3,6 +3,8 @@ const form = document.getElementById("chat-form");
 const input = document.getElementById("chat-input");
 const sendButton = document.getElementById("send-button");
 const emptyState = document.getElementById("empty-state");
+// Catálogo (mercado) de la página: /?catalog=es; sin él, el catálogo por defecto del servidor
+const catalog = new URLSearchParams(window.location.search).get("catalog") || undefined;
 
 function removeEmptyState() {
   if (emptyState && emptyState.parentElement) {
@@ -35,23 +37,108 @@ function setBusy(isBusy) {
   sendButton.textContent = isBusy ? "Enviando..." : "Enviar";
 }
 
+// Sin ReadableStream (navegador antiguo...) se pide la respuesta completa a /api/chat
+const canStream = typeof ReadableStream !== "undefined" && typeof TextDecoder !== "undefined";
+const OFFLINE = "No hay conexion con el servidor. Revisa que la aplicacion siga activa.";
+
+class StreamUnsupported extends Error {}
+
+async function errorMessage(resp) {
+  // El servidor explica el error en {"error": ...} (ocupado, catálogo inexistente, tiempo agotado...)
+  const data = await resp.json().catch(() => ({}));
+  if (data.error) return data.error;
+  if (resp.status === 429 || resp.status === 503) {
+    return "El servidor está atendiendo otras consultas. Inténtalo de nuevo en unos segundos.";
+  }
+  return "No he podido consultar el servidor en este momento.";
+}
+
 async function sendMessage(message) {
   try {
     const resp = await fetch("/api/chat", {
       method: "POST",
       headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ message }),
+      body: JSON.stringify({ message, catalog }),
     });
 
     if (!resp.ok) {
-      return "No he podido consultar el servidor en este momento.";
+      return await errorMessage(resp);
     }
 
     const data = await resp.json();
     return (data.reply || "").trim() || "No he recibido contenido en la respuesta.";
   } catch (error) {
-    return "No hay conexion con el servidor. Revisa que la aplicacion siga activa.";
+    return OFFLINE;
+  }
+}
+
+function parseEvent(raw) {
+  const evt = { event: "message", data: {} };
+  for (const line of raw.split("\n")) {
+    if (line.startsWith("event:")) {
+      evt.event = line.slice(6).trim();
+    } else if (line.startsWith("data:")) {
+      evt.data = JSON.parse(line.slice(5).trim());
+    }
+  }
+  return evt;
+}
+
+async function streamMessage(message, bubble) {
+  let resp;
+  try {
+    resp = await fetch("/api/chat/stream", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ message, catalog }),
+    });
+  } catch (error) {
+    return OFFLINE;
+  }
+
+  // Errores HTTP (429, 404, 504...): se muestra el mensaje del servidor, sin volver a enviar la pregunta
+  if (!resp.ok) {
+    return errorMessage(resp);
   }
+  if (!resp.body || typeof resp.body.getReader !== "function") {
+    throw new StreamUnsupported("stream no disponible");
+  }
+
+  const reader = resp.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let text = "";
+
+  while (true) {
+    let chunk;
+    try {
+      chunk = await reader.read();
+    } catch (error) {
+      // Conexión cortada a mitad de respuesta: se queda lo recibido con un aviso
+      const partial = text.trim();
+      return partial ? `${partial}\n\n(Respuesta incompleta: se ha perdido la conexión.)` : OFFLINE;
+    }
+    const { value, done } = chunk;
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let sep;
+    while ((sep = buffer.indexOf("\n\n")) !== -1) {
+      const evt = parseEvent(buffer.slice(0, sep));
+      buffer = buffer.slice(sep + 2);
+
+      if (evt.event === "token") {
+        text += evt.data.t;
+        bubble.classList.remove("pending");
+        bubble.textContent = text;
+        chat.scrollTop = chat.scrollHeight;
+      } else if (evt.event === "error") {
+        return evt.data.message;
+      }
+    }
+  }
+
+  return text.trim() || "No he recibido contenido en la respuesta.";
 }
 
 form.addEventListener("submit", async (event) => {
@@ -64,13 +151,22 @@ form.addEventListener("submit", async (event) => {
   setBusy(true);
 
   const pendingBubble = appendMessage("Pensando...", "bot", { pending: true });
-  const reply = await sendMessage(message);
-
-  if (pendingBubble) {
-    pendingBubble.remove();
+  let reply;
+  if (!canStream) {
+    reply = await sendMessage(message);
+  } else {
+    try {
+      reply = await streamMessage(message, pendingBubble);
+    } catch (error) {
+      // Solo sin cuerpo legible como stream se repite la pregunta a /api/chat
+      reply = error instanceof StreamUnsupported
+        ? await sendMessage(message)
+        : "No he podido leer la respuesta del servidor.";
+    }
   }
 
-  appendMessage(reply, "bot");
+  pendingBubble.classList.remove("pending");
+  pendingBubble.textContent = reply;
   setBusy(false);
   input.focus();
 });